@@ -0,0 +1,170 @@
+"""
+Accuracy check of StarNet's fast mode (tile skipping), of the reduced precision
+backends and of blend mode (overlapping windows cross-faded instead of
+cropped) against the full float32 model with cropped windows.
+
+Every sample image is processed once with every tile going through the float32
+generator, then once per skip threshold, backend and overlap. For each the
+speedup and the deviation of the starless image and star mask from the full run
+(PSNR and max deviation) are reported, along with the share of skipped tiles for
+thresholds, the bare forward pass time per tile for backends and the number of
+generator calls for overlaps, so a setting can be picked with confidence.
+
+    python accuracy.py --images sample1.tif sample2.png --thresholds 0.01 0.02 0.05
+    python accuracy.py --weights weights/weights --thresholds --backends bfloat16 tflite-float16 tflite-int8
+    python accuracy.py --weights weights/weights --thresholds --overlaps 32 64 128
+
+Without --images, synthetic star fields with sparse stars are used. The
+generator comes from --saved-model or --weights; random weights (--seed) make
+the deviations meaningless and are only useful to check the harness itself.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import tifffile as tiff
+from benchmark import forward_pass_ms
+from synthetic import star_field
+from starnet_v1_TF2 import BACKENDS, TFLITE_BACKENDS, StarNet
+from tiling import read_image
+
+def compare(reference, candidate) -> dict:
+    """PSNR (dB) and max / mean absolute deviation of candidate, as a fraction of full scale."""
+    peak = np.iinfo(reference.dtype).max if reference.dtype.kind in 'ui' else 1.0
+    error = np.abs(np.asarray(reference, dtype='float64') - np.asarray(candidate, dtype='float64')) / peak
+    mse = float(np.mean(error ** 2))
+    return {
+        "psnr": float('inf') if mse == 0 else float(10 * np.log10(1 / mse)),
+        "max_deviation": float(error.max()),
+        "mean_abs_deviation": float(error.mean()),
+    }
+
+def compare_outputs(reference_path, candidate_path) -> dict:
+    """Compare the starless images and star masks written by two transform runs."""
+    results = {}
+    for name, suffix in (("starless", ""), ("mask", "_mask")):
+        reference = tiff.imread(f"{os.path.splitext(reference_path)[0]}{suffix}.tif")
+        candidate = tiff.imread(f"{os.path.splitext(candidate_path)[0]}{suffix}.tif")
+        results[name] = compare(reference, candidate)
+    return results
+
+def run(starnet, in_name, out_name) -> dict:
+    """Run transform and return its wall time and tile counts."""
+    counts = {}
+    def track(progress):
+        counts["tiles"] = progress["tiles_total"]
+        counts["skipped"] = progress["tiles_skipped"]
+    start = time.perf_counter()
+    starnet.transform(in_name, out_name, progress=track)
+    return {"seconds": time.perf_counter() - start, "tiles": counts["tiles"], "tiles_skipped": counts["skipped"]}
+
+def load_starnet(args, mode:str, backend:str = 'float32', calibration_images:list = None, workdir:str = None):
+    starnet = StarNet(mode, window_size=args.window_size, stride=args.stride, batch_size=args.batch_size, backend=backend)
+    if args.saved_model and backend != 'float32':
+        raise SystemExit(f"The {backend} backend is built from --weights, a SavedModel is always float32")
+    if args.saved_model:
+        starnet.load_saved_model(args.saved_model)
+    elif args.weights:
+        starnet.load_model(args.weights)
+    else:
+        print("No --saved-model or --weights given, using random weights: deviations are not representative")
+        starnet.init_random_weights(args.seed)
+    if backend in TFLITE_BACKENDS:
+        path = os.path.join(workdir, f"starnet_{mode}_{backend}.tflite")
+        starnet.export_tflite(path, calibration_images)
+        starnet.load_tflite(path)
+    starnet.compile_model()
+    return starnet
+
+def sample_images(args, workdir:str) -> list:
+    if args.images:
+        return args.images
+    n_stars = int(args.stars_per_megapixel * args.size * args.size / 1e6)
+    path = os.path.join(workdir, f"sample_{args.mode}.tif")
+    tiff.imwrite(path, star_field(args.size, 'uint16', args.mode, n_stars=n_stars))
+    return [path]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare StarNet fast mode, reduced precision backends and blend mode against the full model")
+    parser.add_argument("--images", nargs="+", help="sample images (default: a synthetic star field)")
+    parser.add_argument("--thresholds", type=float, nargs="*", default=[0.005, 0.01, 0.02, 0.05, 0.1])
+    parser.add_argument("--backends", nargs="*", default=[], choices=BACKENDS[1:])
+    parser.add_argument("--overlaps", type=int, nargs="*", default=[], help="blend mode window overlaps to compare, in pixels")
+    parser.add_argument("--calibration-images", nargs="+", help="images the int8 model is calibrated on (default: the sample images)")
+    parser.add_argument("--mode", default="RGB", choices=["RGB", "Greyscale"])
+    parser.add_argument("--saved-model", help="SavedModel directory exported by StarNet.export_saved_model")
+    parser.add_argument("--weights", help="weights prefix as passed to StarNet.load_model, e.g. weights/weights")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--window-size", type=int, default=512)
+    parser.add_argument("--stride", type=int, default=256)
+    parser.add_argument("--batch-size", default="auto")
+    parser.add_argument("--size", type=int, default=2048, help="side of the synthetic star field")
+    parser.add_argument("--stars-per-megapixel", type=float, default=20)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    args.batch_size = args.batch_size if args.batch_size == "auto" else int(args.batch_size)
+
+    starnet = load_starnet(args, args.mode)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        images = sample_images(args, workdir)
+        backends = {backend: load_starnet(args, args.mode, backend, args.calibration_images or images, workdir)
+                    for backend in args.backends}
+        forward_batch = starnet.tile_batch_size(4)
+        forward_ms = {backend: forward_pass_ms(candidate, forward_batch, 3)
+                      for backend, candidate in [('float32', starnet)] + list(backends.items())}
+        for image in images:
+            print(f"{image}: {read_image(image).shape}")
+            reference = os.path.join(workdir, "full.tif")
+            starnet.skip_threshold = None
+            full = run(starnet, image, reference)
+            if backends:
+                print(f"{'backend':>15} {'ms/tile':>8} {'speedup':>8} {'PSNR':>8} {'max dev':>8} {'mask PSNR':>10} {'mask max':>9}")
+                print(f"{'float32':>15} {forward_ms['float32']:>8.1f} {1:>8.2f}")
+            for backend, candidate in backends.items():
+                output = os.path.join(workdir, f"{backend}.tif")
+                reduced = run(candidate, image, output)
+                deviation = compare_outputs(reference, output)
+                results.append({"image": image, "backend": backend, "full": full, "reduced": reduced,
+                                "forward_ms_per_tile": forward_ms[backend], "float32_forward_ms_per_tile": forward_ms['float32'],
+                                "speedup": full["seconds"] / reduced["seconds"], **deviation})
+                print(f"{backend:>15} {forward_ms[backend]:>8.1f} {full['seconds'] / reduced['seconds']:>8.2f} "
+                      f"{deviation['starless']['psnr']:>8.2f} {deviation['starless']['max_deviation']:>8.4f} "
+                      f"{deviation['mask']['psnr']:>10.2f} {deviation['mask']['max_deviation']:>9.4f}")
+            if args.thresholds:
+                print(f"{'threshold':>10} {'skipped':>10} {'speedup':>8} {'PSNR':>8} {'max dev':>8} {'mask PSNR':>10} {'mask max':>9}")
+            for threshold in args.thresholds:
+                candidate = os.path.join(workdir, f"fast_{threshold:g}.tif")
+                starnet.skip_threshold = threshold
+                fast = run(starnet, image, candidate)
+                deviation = compare_outputs(reference, candidate)
+                results.append({"image": image, "threshold": threshold, "full": full, "fast": fast,
+                                "speedup": full["seconds"] / fast["seconds"], **deviation})
+                print(f"{threshold:>10g} {fast['tiles_skipped']:>4}/{fast['tiles']:<5} {full['seconds'] / fast['seconds']:>8.2f} "
+                      f"{deviation['starless']['psnr']:>8.2f} {deviation['starless']['max_deviation']:>8.4f} "
+                      f"{deviation['mask']['psnr']:>10.2f} {deviation['mask']['max_deviation']:>9.4f}")
+            starnet.skip_threshold = None
+            if args.overlaps:
+                print(f"{'overlap':>10} {'tiles':>10} {'speedup':>8} {'PSNR':>8} {'max dev':>8} {'mask PSNR':>10} {'mask max':>9}")
+                print(f"{'crop':>10} {full['tiles']:>10} {1:>8.2f}")
+            for overlap in args.overlaps:
+                candidate = os.path.join(workdir, f"blend_{overlap}.tif")
+                starnet.overlap = overlap
+                blend = run(starnet, image, candidate)
+                deviation = compare_outputs(reference, candidate)
+                results.append({"image": image, "overlap": overlap, "full": full, "blend": blend,
+                                "speedup": full["seconds"] / blend["seconds"], **deviation})
+                print(f"{overlap:>10} {blend['tiles']:>10} {full['seconds'] / blend['seconds']:>8.2f} "
+                      f"{deviation['starless']['psnr']:>8.2f} {deviation['starless']['max_deviation']:>8.4f} "
+                      f"{deviation['mask']['psnr']:>10.2f} {deviation['mask']['max_deviation']:>9.4f}")
+            starnet.overlap = None
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
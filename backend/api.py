@@ -1,18 +1,76 @@
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 import uvicorn
-from starnet_v1_TF2 import StarNet
 import os
-from PIL import Image
-import io
-import shutil
 from pathlib import Path
+from typing import List
 from fastapi.middleware.cors import CORSMiddleware
 from database import ImageDatabase
+from jobs import JobQueue, QueueFullError
+from batches import BatchItem, batch_result, run_pipeline, upload_members
+from cache import ResultCache, sha256_file
+from catalog import build_catalog, catalog_path
+from scene import build_scene, scene_path
+from model import ModelLoader
+from metrics import STAGE_SECONDS, RequestTimer, observe_progress, observe_stages, register_service, render
+from web_images import PREVIEW_SIZES, build_previews, is_not_modified, preview, snapshot, web_image
+from tiling import image_layers, read_image
+import asyncio
 import base64
-import requests
+import gzip
+import json
+import re
+import tarfile
+import time
+import zipfile
 
-app = FastAPI(title="StarNet API", description="API for removing stars from astronomical images")
+# Inference worker pool and the number of uploads allowed to wait for a worker
+INFERENCE_WORKERS = int(os.environ.get("STARNET_WORKERS", 2))
+JOB_QUEUE_SIZE = int(os.environ.get("STARNET_QUEUE_SIZE", 16))
+# Most images accepted in one batch upload (files and archive members together)
+BATCH_MAX_ITEMS = int(os.environ.get("STARNET_BATCH_MAX_ITEMS", 500))
+# Images never change once processed, let browsers keep them for a day
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+# Preview size listed with (or inlined into) paginated gallery results
+THUMBNAIL_SIZE = 256
+# Disk budget for stored images, least recently used ones are removed beyond it (0 = unlimited)
+CACHE_MAX_BYTES = int(os.environ.get("STARNET_CACHE_MAX_BYTES", 0)) or None
+# How often job event streams check for progress, and send partial previews when asked to
+JOB_EVENTS_INTERVAL = 0.5
+JOB_PREVIEW_INTERVAL = 2.0
+# Worker processes that run tile batches in parallel, each with its share of the
+# CPU cores (0 = run the generator in the API process)
+TILE_PROCESSES = int(os.environ.get("STARNET_PROCESSES", 0))
+# Fast mode: tiles whose star score (see starnet_v1_TF2.star_score) is below this
+# are passed through without running the generator (unset = process every tile)
+SKIP_THRESHOLD = float(os.environ["STARNET_SKIP_THRESHOLD"]) if os.environ.get("STARNET_SKIP_THRESHOLD") else None
+# Precision of the generator: float32, bfloat16 / float16 mixed precision, or a
+# converted TFLite model (tflite-float16, tflite-dynamic, tflite-int8); see
+# accuracy.py --backends for their fidelity and speed
+STARNET_BACKEND = os.environ.get("STARNET_BACKEND", "float32")
+# Blend mode: overlap in pixels of windows that are cross-faded instead of
+# cropped, 2-4x fewer generator calls (unset = crop the centre of each window)
+STARNET_OVERLAP = int(os.environ["STARNET_OVERLAP"]) if os.environ.get("STARNET_OVERLAP") else None
+# Longest a tile waits for tiles of other uploads to fill a shared generator batch.
+# Used when several inference workers share the in-process generator (unset = 5 ms,
+# "off" = every upload runs its own batches)
+STARNET_BATCH_WAIT_MS = os.environ.get("STARNET_BATCH_WAIT_MS", "5")
+# Load tests: seconds per tile of a cheap deterministic stand-in used instead of
+# the generator, nothing is downloaded (unset = the real model; see loadtest.py)
+STARNET_STAND_IN = float(os.environ["STARNET_STAND_IN"]) if os.environ.get("STARNET_STAND_IN") else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The model loads in the background; uploads queue up until it is ready
+    model.start()
+    job_queue.start()
+    yield
+    job_queue.shutdown(wait=False)
+    model.close()
+
+app = FastAPI(title="StarNet API", description="API for removing stars from astronomical images", lifespan=lifespan)
 
 # add cors
 app.add_middleware(
@@ -22,27 +80,18 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestTimer)
 
-# Create weights directory if it doesn't exist
-weights_dir = Path("weights")
-weights_dir.mkdir(exist_ok=True)
-
-# Check if weights file exists, if not download it
-weights_path = weights_dir / "weights_G_RGB.h5"
-if not weights_path.exists():
-    print("Downloading weights file...")
-    url = "https://storage.googleapis.com/sundai-test-bucket/weights_G_RGB.h5"
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(weights_path, "wb") as f:
-            f.write(response.content)
-        print("Weights file downloaded successfully")
-    else:
-        raise Exception(f"Failed to download weights file. Status code: {response.status_code}")
+STARNET_XLA = os.environ.get("STARNET_XLA", "0") == "1"
 
-# Initialize StarNet model
-starnet = StarNet(mode='RGB')
-starnet.load_model(weights='weights/weights')
+# StarNet (and TensorFlow) is loaded on a background thread once the server runs,
+# so the endpoints that don't need it answer right away
+model = ModelLoader(Path("weights"), mode='RGB', batch_size='auto', skip_threshold=SKIP_THRESHOLD,
+                    jit_compile=STARNET_XLA, processes=TILE_PROCESSES, backend=STARNET_BACKEND,
+                    overlap=STARNET_OVERLAP,
+                    max_batch_wait=float(STARNET_BATCH_WAIT_MS) / 1000
+                    if STARNET_BATCH_WAIT_MS != "off" and INFERENCE_WORKERS > 1 else None,
+                    stand_in=STARNET_STAND_IN)
 
 # Create a temporary directory for storing processed images
 TEMP_DIR = Path("temp_images")
@@ -51,81 +100,549 @@ TEMP_DIR.mkdir(exist_ok=True)
 # Initialize database
 db = ImageDatabase()
 
-@app.post("/process_image/")
-async def process_image(file: UploadFile = File(...)):
+# Uploads and results are stored under their content hash
+result_cache = ResultCache(db, TEMP_DIR, max_bytes=CACHE_MAX_BYTES)
+
+def image_result(image_id: int, message: str = "Images processed successfully"):
+    original_path, starless_path, mask_path, _ = db.get_image_paths(image_id)
+    return {
+        "message": message,
+        "image_id": image_id,
+        "starless_image_path": str(starless_path),
+        "star_mask_path": str(mask_path),
+        "original_image_path": str(original_path)
+    }
+
+def upload_result(outputs: list, image_ids: list, message: str = "Images processed successfully"):
+    """
+    Job result of an upload: the image id and paths of its result. Multi-layer
+    uploads also list the result of every processed layer under "layers"; the
+    top level fields are those of the first.
+    """
+    result = image_result(image_ids[0], message)
+    if outputs[0][0] is not None:
+        result["layers"] = [{"layer": layer, **image_result(image_id, message)}
+                            for (layer, _), image_id in zip(outputs, image_ids)]
+    return result
+
+def plan_outputs(data, cache_key: str, layers: list = None) -> list:
+    """
+    (layer, cache key) of every result of an upload: a single one (layer None)
+    for an image with one layer, one per selected layer (all by default) of a
+    multi-layer image (see tiling.image_layers). Each layer is cached on its own.
+    """
+    count = len(image_layers(data, model.mode == 'RGB'))
+    for layer in layers or []:
+        if not 0 <= layer < count:
+            raise ValueError(f"Image has {count} layers, there is no layer {layer}")
+    if count == 1:
+        return [(None, cache_key)]
+    return [(layer, f"{cache_key}_layer{layer}") for layer in (layers if layers is not None else range(count))]
+
+def output_layer(mask_path) -> int:
+    """Layer of the upload a result was made from, recovered from its cache key (see plan_outputs), or None."""
+    match = re.search(r"_layer(\d+)_mask\.tif$", str(mask_path))
+    return int(match.group(1)) if match else None
+
+def remove_outputs(outputs: list):
+    for _, key in outputs:
+        for path in result_cache.output_paths(key):
+            path.unlink(missing_ok=True)
+
+def run_job(job):
+    """
+    Run StarNet on a queued upload and store the result paths in the database.
+    Called on an inference worker thread.
+    """
+    input_path = Path(job.payload["input_path"])
+    cache_key = job.payload["cache_key"]
+    # Jobs submitted during startup wait here for the model to finish loading
+    starnet = model.get()
+
+    with result_cache.lock(cache_key):
+        start = time.perf_counter()
+        data = read_image(str(input_path))
+        decode_seconds = time.perf_counter() - start
+        outputs = plan_outputs(data, cache_key, job.payload.get("layers"))
+
+        # An identical upload (or some of its layers) may have been processed while this one was queued
+        image_ids = {key: result_cache.find(key) for _, key in outputs}
+        pending = [(layer, key) for layer, key in outputs if image_ids[key] is None]
+        if not pending:
+            return upload_result(outputs, [image_ids[key] for _, key in outputs], "Image was already processed")
+
+        try:
+            # Process the image with StarNet, publishing its progress on the job
+            def report(progress):
+                job.progress = progress
+                observe_progress(progress)
+            layers = None if pending[0][0] is None else [layer for layer, _ in pending]
+            stage_seconds = starnet.transform(data, str(result_cache.output_paths(cache_key)[0]),
+                                              progress=report, layers=layers, web=True)
+            stage_seconds["decode"] = stage_seconds.get("decode", 0) + decode_seconds
+            observe_stages(stage_seconds)
+
+            # Store paths in database
+            with STAGE_SECONDS.labels("db_insert").time():
+                new_ids = db.save_many_image_paths(
+                    [(input_path, *result_cache.output_paths(key)) for _, key in pending]
+                )
+        except Exception:
+            # Clean up any files in case of error
+            remove_outputs(pending)
+            raise
+        del data
+
+        build_derived_files(input_path, pending)
+        for (_, key), image_id in zip(pending, new_ids):
+            result_cache.add(key, image_id)
+            image_ids[key] = image_id
+
+    return upload_result(outputs, [image_ids[key] for _, key in outputs])
+
+def build_derived_files(input_path: Path, outputs: list):
+    """
+    Previews, star catalogs and flythrough scenes of an upload and of its
+    (layer, cache key) outputs. They are a convenience for the gallery and the
+    flythrough, and are rebuilt on demand if they fail here.
+    """
+    for path in [input_path] + [path for _, key in outputs for path in result_cache.output_paths(key)]:
+        try:
+            with STAGE_SECONDS.labels("previews").time():
+                build_previews(path)
+        except Exception as e:
+            print(f"Could not build previews of {path}: {e}")
+    for layer, key in outputs:
+        _, mask_path = result_cache.output_paths(key)
+        try:
+            with STAGE_SECONDS.labels("catalog").time():
+                build_catalog(mask_path, input_path, layer, model.mode == 'RGB')
+        except Exception as e:
+            print(f"Could not build star catalog of {mask_path}: {e}")
+            continue
+        output_path, _ = result_cache.output_paths(key)
+        try:
+            with STAGE_SECONDS.labels("scene").time():
+                build_scene(output_path, mask_path)
+        except Exception as e:
+            print(f"Could not build flythrough scene of {output_path}: {e}")
+
+def run_batch(job):
     """
-    Process an astronomical image to remove stars.
-    Returns both the starless image and a mask of the removed stars.
+    Run StarNet on the images of a batch upload and store all their results in
+    one database transaction. Called on an inference worker thread.
+
+    The images go through a decode -> infer -> encode pipeline with a thread per
+    stage: the next image is decoded and the previous one's previews and catalog
+    are written while the current one runs through the generator.
     """
+    items = [item for item in job.payload["items"] if item.status == 'queued']
+    starnet = model.get()
+
+    # Lock every key up front, in a fixed order so concurrent batches can't deadlock
+    locks = [result_cache.lock(key) for key in sorted({item.cache_key for item in items})]
+    for lock in locks:
+        lock.acquire()
     try:
-        # Create unique filenames for this request
-        input_path = TEMP_DIR / f"input_{file.filename}"
-        output_path = TEMP_DIR / f"starless_{file.filename.replace('.jpg', '.tif').replace('.jpeg', '.tif')}"
+        # Images processed since the upload are reused, identical images in the batch are processed once
+        first = {}
+        for item in items:
+            image_id = result_cache.find(item.cache_key)
+            if image_id is not None:
+                item.finish(image_result(image_id, "Image was already processed"))
+            else:
+                first.setdefault(item.cache_key, item)
+        unique = list(first.values())
 
-        print(input_path)
-        print(output_path)
-        
-        # Save uploaded file
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Process the image with StarNet
-        starnet.transform(str(input_path), str(output_path))
-        
-        # Get the mask path (created by StarNet)
-        mask_path = str(output_path).replace('.tif', '_mask.tif')
-        
-        # Store paths in database
-        image_id = db.save_image_paths(
-            original_path=input_path,
-            starless_path=output_path,
-            mask_path=mask_path
+        def decode(item):
+            item.status = 'decoding'
+            start = time.perf_counter()
+            item.data = read_image(str(item.input_path))
+            item.decode_seconds = time.perf_counter() - start
+            item.outputs = plan_outputs(item.data, item.cache_key)
+            item.image_ids = {key: result_cache.find(key) for _, key in item.outputs}
+            if all(image_id is not None for image_id in item.image_ids.values()):
+                item.finish(upload_result(item.outputs, list(item.image_ids.values()), "Image was already processed"))
+
+        def pending(item):
+            return [(layer, key) for layer, key in item.outputs if item.image_ids[key] is None]
+
+        def infer(item):
+            if item.status == 'done':
+                return
+            item.status = 'processing'
+            def report(progress):
+                item.progress = job.progress = {**progress, "filename": item.filename}
+                observe_progress(progress)
+            layers = None if item.outputs[0][0] is None else [layer for layer, _ in pending(item)]
+            try:
+                stage_seconds = starnet.transform(item.data, str(result_cache.output_paths(item.cache_key)[0]),
+                                                  progress=report, layers=layers, web=True)
+            finally:
+                item.data = None
+            stage_seconds["decode"] = stage_seconds.get("decode", 0) + item.decode_seconds
+            observe_stages(stage_seconds)
+
+        def encode(item):
+            if item.status == 'done':
+                return
+            item.status = 'encoding'
+            build_derived_files(item.input_path, pending(item))
+
+        def fail(item, error):
+            print(f"Could not process {item.filename}: {error}")
+            item.fail(str(error))
+            if item.outputs:
+                remove_outputs(pending(item))
+
+        run_pipeline(unique, [decode, infer, encode], fail)
+
+        processed = [(item, output) for item in unique if item.status == 'encoding' for output in pending(item)]
+        try:
+            with STAGE_SECONDS.labels("db_insert").time():
+                image_ids = db.save_many_image_paths(
+                    [(item.input_path, *result_cache.output_paths(key)) for item, (_, key) in processed]
+                )
+        except Exception as e:
+            for item in unique:
+                if item.status == 'encoding':
+                    fail(item, e)
+            raise
+        for (item, (_, key)), image_id in zip(processed, image_ids):
+            result_cache.add(key, image_id)
+            item.image_ids[key] = image_id
+        for item in unique:
+            if item.status == 'encoding':
+                item.finish(upload_result(item.outputs, list(item.image_ids.values())))
+
+        for item in items:
+            original = first.get(item.cache_key)
+            if original is not None and original is not item:
+                item.status, item.result, item.error = original.status, original.result, original.error
+    finally:
+        for lock in locks:
+            lock.release()
+
+    return batch_result(job.payload["items"])
+
+job_queue = JobQueue(run_job, workers=INFERENCE_WORKERS, max_queue=JOB_QUEUE_SIZE)
+register_service(job_queue, result_cache)
+
+@app.post("/process_image/", status_code=202)
+async def process_image(file: UploadFile = File(...), layers: str = None):
+    """
+    Queue an astronomical image for star removal (JPEG, PNG, TIFF or FITS).
+    Returns a job id right away; poll GET /jobs/{job_id} (or follow
+    GET /jobs/{job_id}/events) for the result, which contains the ids and paths
+    of the starless image and the star mask.
+    Uploads that were processed before are answered from the cache with a job
+    that is already done.
+    Every layer of a multi-layer image (a FITS or TIFF cube) is processed, or
+    only the comma separated layer indexes of layers (e.g. "0,2"); the result
+    then lists each layer's image under "layers".
+    """
+    try:
+        layers = sorted({int(layer) for layer in layers.split(",")}) if layers else None
+    except ValueError:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Layers must be comma separated layer indexes, e.g. 0,2"}
+        )
+    if model.status == 'failed':
+        return JSONResponse(
+            status_code=503,
+            content={"error": f"Model failed to load: {model.error}"}
+        )
+    if job_queue.stats()["queued"] >= JOB_QUEUE_SIZE:
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Too many images waiting to be processed, please retry later"}
+        )
+
+    # Save the upload under a temporary name while hashing it, without blocking the event loop
+    upload_path = TEMP_DIR / f"upload_{os.urandom(8).hex()}"
+
+    try:
+        with STAGE_SECONDS.labels("upload_write").time():
+            digest = await run_in_threadpool(sha256_file, file.file, upload_path)
+        cache_key = ResultCache.key(digest, model)
+
+        image_id = await run_in_threadpool(result_cache.lookup, cache_key)
+        if image_id is not None:
+            upload_path.unlink()
+            job = job_queue.complete({"cache_key": cache_key}, image_result(image_id, "Image was already processed"))
+            return {
+                "message": "Image was already processed",
+                "job_id": job.id,
+                "status": job.status,
+                "result": job.result
+            }
+
+        # Identical uploads share one stored input file
+        input_path = result_cache.input_path(digest, file.filename)
+        if input_path.exists():
+            upload_path.unlink()
+        else:
+            upload_path.replace(input_path)
+
+        job = job_queue.submit({"input_path": str(input_path), "cache_key": cache_key, "layers": layers})
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": str(e)}
         )
-        
-        # Return paths to the generated files
-        return {
-            "message": "Images processed successfully",
-            "image_id": image_id,
-            "starless_image_path": str(output_path),
-            "star_mask_path": str(mask_path),
-            "original_image_path": str(input_path)
-        }
-        
     except Exception as e:
         print(e)
-        # Clean up any files in case of error
-        if input_path.exists():
-            input_path.unlink()
-        if Path(output_path).exists():
-            Path(output_path).unlink()
-        if Path(mask_path).exists():
-            Path(mask_path).unlink()
+        upload_path.unlink(missing_ok=True)
         return JSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
 
-@app.get("/image/{image_type}/{image_id}")
-async def get_image(image_type: str, image_id: int):
+    return {
+        "message": "Image queued for processing",
+        "job_id": job.id,
+        "status": job.status
+    }
+
+def store_batch_uploads(files) -> list:
     """
-    Retrieve a processed image by image_id.
-    image_type can be either 'original', 'starless', or 'mask'
-    Returns the image as a base64 encoded string
+    Store the images of a batch upload (archives are expanded) under their
+    content hash, and return a BatchItem for each. Images processed before are
+    answered from the cache right away.
     """
-    if image_type not in ['original', 'starless', 'mask']:
+    items = []
+    for file in files:
+        for filename, fileobj in upload_members(file.filename, file.file):
+            if len(items) == BATCH_MAX_ITEMS:
+                raise ValueError(f"A batch can hold at most {BATCH_MAX_ITEMS} images")
+            upload_path = TEMP_DIR / f"upload_{os.urandom(8).hex()}"
+            try:
+                with STAGE_SECONDS.labels("upload_write").time():
+                    digest = sha256_file(fileobj, upload_path)
+                cache_key = ResultCache.key(digest, model)
+                image_id = result_cache.lookup(cache_key)
+                if image_id is not None:
+                    upload_path.unlink()
+                    item = BatchItem(filename)
+                    item.finish(image_result(image_id, "Image was already processed"))
+                else:
+                    input_path = result_cache.input_path(digest, filename)
+                    if input_path.exists():
+                        upload_path.unlink()
+                    else:
+                        upload_path.replace(input_path)
+                    item = BatchItem(filename, input_path, cache_key)
+            finally:
+                upload_path.unlink(missing_ok=True)
+            items.append(item)
+    return items
+
+@app.post("/process_batch/", status_code=202)
+async def process_batch(files: List[UploadFile] = File(...)):
+    """
+    Queue many astronomical images for star removal at once: several files,
+    and/or zip or tar archives of images.
+    Returns a batch id right away; poll GET /batches/{batch_id} for the status
+    and result of every image. The whole batch takes one place in the job queue.
+    """
+    if model.status == 'failed':
+        return JSONResponse(
+            status_code=503,
+            content={"error": f"Model failed to load: {model.error}"}
+        )
+    if job_queue.stats()["queued"] >= JOB_QUEUE_SIZE:
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Too many images waiting to be processed, please retry later"}
+        )
+
+    try:
+        items = await run_in_threadpool(store_batch_uploads, files)
+        if not items:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "No images found in the upload"}
+            )
+        if any(item.status == 'queued' for item in items):
+            job = job_queue.submit({"items": items}, handler=run_batch)
+        else:
+            job = job_queue.complete({"items": items}, batch_result(items))
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": str(e)}
+        )
+    except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
+    except Exception as e:
+        print(e)
+        return JSONResponse(
+            status_code=500,
+            content={"error": str(e)}
+        )
+
+    return {
+        "message": job.result["message"] if job.status == 'done' else f"{len(items)} images queued for processing",
+        "batch_id": job.id,
+        "status": job.status,
+        "items": [item.to_dict() for item in items]
+    }
+
+@app.get("/batches/{batch_id}")
+def get_batch(batch_id: str):
+    """
+    Status of a batch upload and of each of its images: queued, decoding,
+    processing, encoding, done or failed. Once done, the result of every image
+    holds its image id and paths.
+    """
+    job = job_queue.get(batch_id)
+    if not job or "items" not in job.payload:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Batch not found"}
+        )
+    items = job.payload["items"]
+    return {
+        **job.to_dict(),
+        "batch_id": job.id,
+        "items_done": sum(item.status == 'done' for item in items),
+        "items_failed": sum(item.status == 'failed' for item in items),
+        "items_total": len(items),
+        "items": [item.to_dict() for item in items]
+    }
+
+@app.get("/cache")
+def get_cache_stats():
+    """
+    Result cache hit/miss counts and disk usage.
+    """
+    return result_cache.stats()
+
+@app.get("/healthz")
+def healthz():
+    """
+    Liveness probe: the server is up and answering requests.
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """
+    Readiness probe: 200 once the model is loaded and warmed up, 503 while it
+    is loading or if it failed to load.
+    """
+    if not model.is_ready():
+        return JSONResponse(
+            status_code=503,
+            content={"status": model.status, "error": model.error}
+        )
+    return {"status": model.status}
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus metrics: stage and per-tile timings, request latency, queue
+    depth, jobs in flight and result cache hit rate.
+    """
+    body, media_type = render()
+    return Response(content=body, media_type=media_type)
+
+@app.get("/jobs")
+def get_job_stats():
+    """
+    Queue depth, number of running jobs and finished job counts, and the shared
+    batches of the inference scheduler when it is used.
+    """
+    stats = job_queue.stats()
+    if model.starnet is not None and model.starnet.scheduler is not None:
+        stats["scheduler"] = model.starnet.scheduler.stats()
+    return stats
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Status of a processing job: queued, running, done or failed.
+    Once done, "result" holds the image id and paths of the processed images.
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Job not found"}
+        )
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, request: Request, previews: bool = False, preview_size: int = THUMBNAIL_SIZE):
+    """
+    Server-Sent Events stream of a processing job.
+    A "job" event carrying the same data as GET /jobs/{job_id} (including the
+    tiles done so far) is sent whenever the job changes; the stream ends once the
+    job is done or failed. With previews, "preview" events with a low resolution
+    JPEG data URI of the starless image are sent while it fills in.
+    """
+    job = job_queue.get(job_id)
+    if not job:
         return JSONResponse(
+            status_code=404,
+            content={"error": "Job not found"}
+        )
+    if preview_size not in PREVIEW_SIZES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Preview size must be one of {PREVIEW_SIZES}"}
+        )
+    # Batches have no single image to preview, nor do multi-layer images (written per layer)
+    output_path = result_cache.output_paths(job.payload["cache_key"])[0] if "cache_key" in job.payload else None
+
+    async def events():
+        last_state, last_preview, preview_tiles = None, 0, 0
+        while not await request.is_disconnected():
+            state = job.to_dict()
+            if state != last_state:
+                last_state = state
+                yield f"event: job\ndata: {json.dumps(state)}\n\n"
+            if state["status"] in ('done', 'failed'):
+                break
+
+            progress = state["progress"]
+            if previews and output_path and output_path.exists() and progress and progress["stage"] == "infer" and progress["tiles_done"] > preview_tiles \
+                    and time.monotonic() - last_preview >= JOB_PREVIEW_INTERVAL:
+                last_preview, preview_tiles = time.monotonic(), progress["tiles_done"]
+                try:
+                    image = await run_in_threadpool(snapshot, output_path, preview_size)
+                    data = {"tiles_done": progress["tiles_done"], "tiles_total": progress["tiles_total"],
+                            "image": "data:image/jpeg;base64," + base64.b64encode(image).decode('utf-8')}
+                    yield f"event: preview\ndata: {json.dumps(data)}\n\n"
+                except Exception as e:
+                    print(f"Could not build partial preview of {output_path}: {e}")
+            await asyncio.sleep(JOB_EVENTS_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def find_image_file(image_type: str, image_id: int):
+    """
+    Path of one of the files of an image, or a JSONResponse with the error.
+    """
+    if image_type not in ['original', 'starless', 'mask']:
+        return None, JSONResponse(
             status_code=400,
             content={"error": "image_type must be either 'original', 'starless', or 'mask'"}
         )
     
     image_data = db.get_image_paths(image_id)
     if not image_data:
-        return JSONResponse(
+        return None, JSONResponse(
             status_code=404,
             content={"error": "Image not found"}
         )
     
     original_path, starless_path, mask_path, _ = image_data
+    db.touch_cache_entry(image_id)
     
     # Select the appropriate path based on image_type
     file_path = {
@@ -135,42 +652,131 @@ async def get_image(image_type: str, image_id: int):
     }[image_type]
     
     if not Path(file_path).exists():
-        return JSONResponse(
+        return None, JSONResponse(
             status_code=404,
             content={"error": "Image file not found"}
         )
+    return Path(file_path), None
+
+@app.get("/image/{image_type}/{image_id}")
+def get_image(image_type: str, image_id: int):
+    """
+    Retrieve a processed image by image_id.
+    image_type can be either 'original', 'starless', or 'mask'
+    Returns the image as a base64 encoded string.
+    Kept for compatibility, prefer GET /image/{image_type}/{image_id}/raw.
+    """
+    file_path, error = find_image_file(image_type, image_id)
+    if error:
+        return error
     
-    # Read the image file
-    with Image.open(file_path) as img:
-        # Convert to RGB if necessary (in case of RGBA or other modes)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # If the image is a TIFF, convert to PNG
-        if Path(file_path).suffix.lower() in ['.tif', '.tiff']:
-            # Create a BytesIO object to store the PNG
-            output_buffer = io.BytesIO()
-            img.save(output_buffer, format='PNG')
-            encoded_string = base64.b64encode(output_buffer.getvalue()).decode('utf-8')
-            return JSONResponse(
-                content={
-                    "image": encoded_string,
-                    "format": "png"
-                }
-            )
-        else:
-            # For non-TIFF images, read and encode as is
-            with open(file_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-            return JSONResponse(
-                content={
-                    "image": encoded_string,
-                    "format": Path(file_path).suffix[1:]  # Get file extension without the dot
-                }
-            )
+    # TIFFs are served from their cached PNG rendition, other images as is
+    web_path, media_type = web_image(file_path)
+    with open(web_path, "rb") as image_file:
+        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+    return JSONResponse(
+        content={
+            "image": encoded_string,
+            "format": "png" if web_path != file_path else file_path.suffix[1:]  # Get file extension without the dot
+        }
+    )
+
+@app.api_route("/image/{image_type}/{image_id}/raw", methods=["GET", "HEAD"])
+def get_image_raw(image_type: str, image_id: int, request: Request, size: int = None):
+    """
+    Retrieve a processed image by image_id as binary image data.
+    image_type can be either 'original', 'starless', or 'mask'
+    size selects a JPEG preview (longest side 256 or 1024 px) instead of the full image.
+    TIFFs are served as PNG. Supports conditional (ETag / Last-Modified) and Range requests.
+    """
+    file_path, error = find_image_file(image_type, image_id)
+    if error:
+        return error
+    
+    if size is None:
+        web_path, media_type = web_image(file_path)
+    elif size in PREVIEW_SIZES:
+        web_path, media_type = preview(file_path, size), "image/jpeg"
+    else:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"size must be one of {list(PREVIEW_SIZES)}"}
+        )
+    return serve_file(request, web_path, media_type)
+
+@app.api_route("/stars/{image_id}", methods=["GET", "HEAD"])
+def get_star_catalog(image_id: int, request: Request):
+    """
+    Star catalog of a processed image, extracted from its mask: one row per star
+    with the columns listed in "fields" (position, bounds and size in pixels,
+    peak brightness in [0,1] and mean RGB colour of the original).
+    """
+    mask_path, error = find_image_file('mask', image_id)
+    if error:
+        return error
+    original_path, error = find_image_file('original', image_id)
+    if error:
+        return error
+    
+    path = catalog_path(mask_path)
+    if not path.exists():
+        build_catalog(mask_path, original_path, output_layer(mask_path), model.mode == 'RGB')
+    return serve_file(request, path, "application/json")
+
+@app.api_route("/scene/{image_id}", methods=["GET", "HEAD"])
+def get_scene(image_id: int, request: Request):
+    """
+    Precomputed flythrough scene of a processed image, as one binary file of
+    typed buffers (downscaled starless texture, depth estimate, depth layers and
+    star sprites; see scene.build_scene for the layout) the browser uses as is.
+    """
+    starless_path, error = find_image_file('starless', image_id)
+    if error:
+        return error
+    mask_path, error = find_image_file('mask', image_id)
+    if error:
+        return error
+    original_path, error = find_image_file('original', image_id)
+    if error:
+        return error
+
+    path = scene_path(starless_path)
+    if not path.exists():
+        if not catalog_path(mask_path).exists():
+            build_catalog(mask_path, original_path, output_layer(mask_path), model.mode == 'RGB')
+        build_scene(starless_path, mask_path)
+    if "gzip" not in request.headers.get("accept-encoding", ""):
+        return Response(gzip.decompress(path.read_bytes()), media_type="application/octet-stream",
+                        headers={"Cache-Control": IMAGE_CACHE_CONTROL, "Vary": "Accept-Encoding"})
+    response = serve_file(request, path, "application/octet-stream")
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+def serve_file(request: Request, path: Path, media_type: str):
+    """
+    FileResponse with caching headers, or 304 if the client's copy is current.
+    Range requests are handled by FileResponse.
+    """
+    response = FileResponse(
+        path,
+        media_type=media_type,
+        stat_result=os.stat(path),
+        headers={"Cache-Control": IMAGE_CACHE_CONTROL}
+    )
+    if is_not_modified(request.headers, response.headers["etag"], response.headers["last-modified"]):
+        return Response(
+            status_code=304,
+            headers={
+                "ETag": response.headers["etag"],
+                "Last-Modified": response.headers["last-modified"],
+                "Cache-Control": IMAGE_CACHE_CONTROL
+            }
+        )
+    return response
 
 @app.get("/images")
-async def get_all_images():
+def get_all_images():
     """
     Retrieve all processed images with their paths and metadata.
     """
@@ -186,12 +792,39 @@ async def get_all_images():
         for image in images
     ]
 
+def thumbnail_urls(request: Request, image_id: int, size: int = THUMBNAIL_SIZE):
+    return {
+        image_type: str(request.url_for("get_image_raw", image_type=image_type, image_id=image_id)) + f"?size={size}"
+        for image_type in ['original', 'starless', 'mask']
+    }
+
+def inline_thumbnail(path: str, size: int = THUMBNAIL_SIZE):
+    """Small JPEG preview of an image file as a data URI, or None if the file is gone."""
+    if not Path(path).exists():
+        return None
+    with open(preview(path, size), "rb") as thumbnail:
+        return "data:image/jpeg;base64," + base64.b64encode(thumbnail.read()).decode('utf-8')
+
 @app.get("/images/paginated")
-async def get_paginated_images(page: int = 1, per_page: int = 5):
+def get_paginated_images(request: Request, page: int = 1, per_page: int = 5, cursor: str = None, inline_thumbnails: bool = False):
     """
     Retrieve paginated images with their paths and metadata.
+    Pages are selected by number, or with the next_cursor of the previous
+    page, which stays fast however deep into the gallery it is.
+    Every image includes the URLs of its thumbnails; with inline_thumbnails the
+    thumbnail of the original image is embedded as a data URI, so a gallery
+    page can be rendered from this single response.
     """
-    images = db.get_paginated_images(page, per_page)
+    try:
+        if cursor is not None:
+            images = db.get_images_after(cursor, per_page)
+        else:
+            images = db.get_paginated_images(page, per_page)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
     total_images = db.get_total_images()
     total_pages = (total_images + per_page - 1) // per_page
     
@@ -202,7 +835,9 @@ async def get_paginated_images(page: int = 1, per_page: int = 5):
                 "original_path": image[1],
                 "starless_path": image[2],
                 "mask_path": image[3],
-                "created_at": image[4]
+                "created_at": image[4],
+                "thumbnails": thumbnail_urls(request, image[0]),
+                **({"thumbnail": inline_thumbnail(image[1])} if inline_thumbnails else {})
             }
             for image in images
         ],
@@ -210,12 +845,13 @@ async def get_paginated_images(page: int = 1, per_page: int = 5):
             "current_page": page,
             "total_pages": total_pages,
             "total_images": total_images,
-            "per_page": per_page
+            "per_page": per_page,
+            "next_cursor": db.encode_cursor(images[-1]) if len(images) == per_page else None
         }
     }
 
 @app.delete("/image/{image_id}")
-async def delete_image(image_id: int):
+def delete_image(image_id: int):
     """
     Delete an image and its associated files from the system.
     """
@@ -228,15 +864,8 @@ async def delete_image(image_id: int):
                 content={"error": "Image not found"}
             )
         
-        original_path, starless_path, mask_path, _ = image_data
-        
-        # Delete files
-        for path in [original_path, starless_path, mask_path]:
-            if Path(path).exists():
-                Path(path).unlink()
-        
-        # Delete from database
-        db.delete_image(image_id)
+        # Delete from database, and the files no other image shares
+        result_cache.remove_image(image_id)
         
         return {"message": "Image deleted successfully"}
         
@@ -253,12 +882,24 @@ async def root():
         "message": "Welcome to StarNet API",
         "endpoints": {
             "POST /process_image/": "Upload an image to process",
-            "GET /image/{image_type}/{image_id}": "Retrieve a processed image",
+            "POST /process_batch/": "Upload many images (or zip/tar archives of images) to process",
+            "GET /batches/{batch_id}": "Get the status of a batch upload and of each of its images",
+            "GET /jobs/{job_id}": "Get the status and result of a processing job",
+            "GET /jobs/{job_id}/events": "Follow the progress of a processing job (Server-Sent Events)",
+            "GET /jobs": "Get processing queue statistics",
+            "GET /cache": "Get result cache statistics",
+            "GET /metrics": "Get Prometheus metrics",
+            "GET /healthz": "Liveness probe",
+            "GET /readyz": "Readiness probe (model loaded)",
+            "GET /image/{image_type}/{image_id}": "Retrieve a processed image as base64 JSON",
+            "GET /image/{image_type}/{image_id}/raw": "Retrieve a processed image as binary data",
+            "GET /stars/{image_id}": "Get the star catalog of a processed image",
+            "GET /scene/{image_id}": "Get the precomputed flythrough scene of a processed image (binary)",
             "GET /images": "Get all processed images",
             "GET /images/paginated": "Get paginated images",
             "DELETE /image/{image_id}": "Delete an image"
         },
-        "supported_formats": ["JPEG", "PNG", "TIFF"]
+        "supported_formats": ["JPEG", "PNG", "TIFF", "FITS"]
     }
 
 if __name__ == "__main__":
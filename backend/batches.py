@@ -0,0 +1,117 @@
+from pathlib import Path
+import queue
+import tarfile
+import threading
+import zipfile
+
+# Files taken from archives, anything else in them (readme, sidecar files...) is skipped
+IMAGE_SUFFIXES = {'.tif', '.tiff', '.png', '.jpg', '.jpeg', '.bmp', '.webp', '.fits', '.fit', '.fts'}
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+class BatchItem:
+    """One image of a batch upload and its status: queued -> decoding -> processing -> encoding -> done | failed."""
+    def __init__(self, filename: str, input_path: Path = None, cache_key: str = None):
+        self.filename = filename
+        self.input_path = input_path
+        self.cache_key = cache_key
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.progress = None
+        # Decoded image, held between the decode and infer stages
+        self.data = None
+        # (layer, cache key) of its results and their image ids, once decoded
+        self.outputs = []
+        self.image_ids = {}
+
+    def finish(self, result):
+        self.status, self.result, self.data = 'done', result, None
+
+    def fail(self, error: str):
+        self.status, self.error, self.data = 'failed', error, None
+
+    def to_dict(self):
+        return {
+            "filename": self.filename,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "progress": self.progress
+        }
+
+def batch_result(items) -> dict:
+    done = sum(item.status == 'done' for item in items)
+    return {
+        "message": f"{done} of {len(items)} images processed",
+        "items": [item.to_dict() for item in items]
+    }
+
+def upload_members(filename: str, fileobj):
+    """
+    (filename, file object) of every image in an upload: the upload itself, or
+    the images in it if it is a zip or tar archive (optionally compressed).
+    """
+    name = filename.lower()
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(fileobj) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and _is_image(member.filename):
+                    with archive.open(member) as f:
+                        yield Path(member.filename).name, f
+    elif name.endswith(ARCHIVE_SUFFIXES):
+        with tarfile.open(fileobj=fileobj, mode='r:*') as archive:
+            for member in archive:
+                if member.isfile() and _is_image(member.name):
+                    with archive.extractfile(member) as f:
+                        yield Path(member.name).name, f
+    else:
+        yield filename, fileobj
+
+def _is_image(name: str) -> bool:
+    path = Path(name)
+    # Skip hidden files and the resource forks macOS adds to zip files
+    if path.name.startswith('.') or '__MACOSX' in path.parts:
+        return False
+    return path.suffix.lower() in IMAGE_SUFFIXES
+
+_END = object()
+
+def run_pipeline(items, stages, on_error, max_pending: int = 1):
+    """
+    Run every item through stages (functions called with the item), in order.
+
+    Each stage runs on its own thread and hands items on through a queue of at
+    most max_pending items, so while one item is in a stage the next one can
+    already be in the stage before and the previous one in the stage after it.
+    An item whose stage raises is passed to on_error with the exception and skips
+    the remaining stages. Returns once every item went through.
+    """
+    inboxes = [queue.Queue(maxsize=max_pending) for _ in stages]
+
+    def run_stage(stage, inbox, outbox):
+        while True:
+            item = inbox.get()
+            if item is _END:
+                break
+            try:
+                stage(item)
+            except Exception as e:
+                on_error(item, e)
+                continue
+            if outbox is not None:
+                outbox.put(item)
+        if outbox is not None:
+            outbox.put(_END)
+
+    threads = []
+    for i, stage in enumerate(stages):
+        outbox = inboxes[i + 1] if i + 1 < len(stages) else None
+        thread = threading.Thread(target=run_stage, args=(stage, inboxes[i], outbox),
+                                  name=f"pipeline-{stage.__name__}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    for item in items:
+        inboxes[0].put(item)
+    inboxes[0].put(_END)
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,204 @@
+"""
+Offline inference benchmark for StarNet.
+
+Runs StarNet.transform on synthetic star fields with randomly initialised
+generator weights (nothing is downloaded), for every combination of the
+requested image sizes, bit depths and modes, and reports tiles/s, latency per
+megapixel and the peak RSS of every stage of transform. Results are written as
+JSON; pass a previous results file with --baseline to flag regressions.
+
+    python benchmark.py --sizes 1024 2048 --output benchmark_results.json
+    python benchmark.py --baseline benchmark_results.json --output benchmark_results_new.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+import tifffile as tiff
+from starnet_v1_TF2 import StarNet
+from synthetic import star_field
+
+# Relative change beyond which a metric is flagged as a regression
+DEFAULT_TOLERANCE = 0.10
+# Metrics compared against the baseline, and whether higher values are better
+COMPARED_METRICS = {
+    "tiles_per_second": True,
+    "seconds_per_megapixel": False,
+    "peak_rss_mb": False,
+}
+
+def rss_bytes() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+class StageMonitor:
+    """
+    Samples the resident set size in a background thread and records the peak
+    seen during each transform stage, as reported by its progress callback.
+    """
+    def __init__(self, interval:float = 0.002):
+        self.interval = interval
+        self.stage = None
+        self.peak_rss = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def progress(self, info):
+        self._record()
+        self.stage = info["stage"]
+        self._record()
+
+    def _record(self):
+        if self.stage is not None:
+            self.peak_rss[self.stage] = max(self.peak_rss.get(self.stage, 0), rss_bytes())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record()
+
+def forward_pass_ms(starnet, batch_size:int, repeat:int) -> float:
+    """Milliseconds per tile of the bare generator forward pass."""
+    tiles = np.random.default_rng(0).uniform(-1, 1, (batch_size, starnet.window_size, starnet.window_size,
+                                                    starnet.input_channels)).astype('float32')
+    starnet.infer(tiles)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        np.asarray(starnet.infer(tiles))
+    return (time.perf_counter() - start) * 1000 / (repeat * batch_size)
+
+def run_case(starnet, size:int, dtype:str, repeat:int, workdir:str) -> dict:
+    mode = starnet.mode
+    in_name = os.path.join(workdir, f"field_{mode}_{dtype}_{size}.tif")
+    out_name = os.path.join(workdir, f"starless_{mode}_{dtype}_{size}.tif")
+    tiff.imwrite(in_name, star_field(size, dtype, mode))
+
+    runs = []
+    for _ in range(repeat):
+        tiles = {}
+        def track_tiles(info):
+            tiles["total"] = info["tiles_total"]
+            monitor.progress(info)
+        with StageMonitor() as monitor:
+            start = time.perf_counter()
+            stage_seconds = starnet.transform(in_name, out_name, progress=track_tiles)
+            seconds = time.perf_counter() - start
+        runs.append((seconds, stage_seconds, monitor.peak_rss, tiles["total"]))
+
+    # Report the fastest run; the others mostly measure noise from the rest of the machine
+    seconds, stage_seconds, peak_rss, n_tiles = min(runs, key=lambda run: run[0])
+    megapixels = size * size / 1e6
+    return {
+        "name": f"{mode}-{dtype}-{size}",
+        "mode": mode,
+        "dtype": dtype,
+        "size": size,
+        "megapixels": megapixels,
+        "tiles": n_tiles,
+        "seconds": seconds,
+        "tiles_per_second": n_tiles / stage_seconds["infer"],
+        "seconds_per_megapixel": seconds / megapixels,
+        "peak_rss_mb": max(peak_rss.values()) / 2**20,
+        "stages": {
+            stage: {"seconds": stage_seconds.get(stage, 0), "peak_rss_mb": peak_rss.get(stage, 0) / 2**20}
+            for stage in stage_seconds
+        },
+    }
+
+def find_regressions(results:list, baseline:list, tolerance:float) -> list:
+    """Metrics of results that got worse than in baseline by more than tolerance."""
+    previous = {result["name"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["name"])
+        if before is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({"name": result["name"], "metric": metric, "baseline": old,
+                                    "value": new, "change": change})
+    return regressions
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "tensorflow": tf.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark StarNet inference on synthetic star fields")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 2048], help="side of the square test images")
+    parser.add_argument("--dtypes", nargs="+", default=["uint8", "uint16"], choices=["uint8", "uint16"])
+    parser.add_argument("--modes", nargs="+", default=["RGB", "Greyscale"], choices=["RGB", "Greyscale"])
+    parser.add_argument("--window-size", type=int, default=512)
+    parser.add_argument("--stride", type=int, default=256)
+    parser.add_argument("--batch-size", default="auto", help="tile batch size, or 'auto'")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator weights")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+    batch_size = args.batch_size if args.batch_size == "auto" else int(args.batch_size)
+
+    results = []
+    forward = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in args.modes:
+            starnet = StarNet(mode, window_size=args.window_size, stride=args.stride, batch_size=batch_size)
+            starnet.init_random_weights(args.seed)
+            starnet.compile_model()
+            starnet.warmup()
+            forward[mode] = forward_pass_ms(starnet, starnet.tile_batch_size(4), max(1, args.repeat))
+            for dtype in args.dtypes:
+                for size in args.sizes:
+                    result = run_case(starnet, size, dtype, args.repeat, workdir)
+                    result["forward_ms_per_tile"] = forward[mode]
+                    results.append(result)
+                    print(f"{result['name']:>24}: {result['tiles_per_second']:.2f} tiles/s, "
+                          f"{result['seconds_per_megapixel']:.2f} s/MP, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    report = {"environment": environment(), "settings": vars(args), "results": results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["baseline"] = {"file": args.baseline, "environment": baseline.get("environment")}
+        report["regressions"] = find_regressions(results, baseline["results"], args.tolerance)
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression['name']} {regression['metric']}: "
+                  f"{regression['baseline']:.3f} -> {regression['value']:.3f} ({regression['change']:+.1%})")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 1 if report.get("regressions") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import glob
+import hashlib
+import threading
+from pathlib import Path
+
+class _KeyLock:
+    """
+    Lock of one ResultCache key. The underlying lock is shared by everyone
+    holding or waiting for the key, and dropped once there is nobody left, so
+    the cache doesn't keep a lock for every key it has ever seen.
+    """
+    def __init__(self, cache, key: str):
+        self.cache = cache
+        self.key = key
+
+    def acquire(self):
+        with self.cache._lock:
+            entry = self.cache._locks.setdefault(self.key, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+
+    def release(self):
+        with self.cache._lock:
+            entry = self.cache._locks[self.key]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.cache._locks[self.key]
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class ResultCache:
+    """
+    Content-addressed store of processed images.
+
+    Uploads are stored under the sha256 of their bytes, and results under a key
+    made of that hash and the StarNet parameters that affect the output, so an
+    identical upload reuses the existing ImageDatabase row and files instead of
+    running inference again. When the stored results exceed max_bytes, the least
+    recently accessed images are removed (database row and files).
+    """
+    def __init__(self, db, store_dir: Path, max_bytes: int = None):
+        self.db = db
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Key -> [lock, number of holders and waiters], see _KeyLock
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(digest: str, starnet) -> str:
+        # Blend mode doesn't use the stride, only the overlap
+        if starnet.overlap:
+            key = f"{digest}_{starnet.mode}_{starnet.window_size}_overlap{starnet.overlap}"
+        else:
+            key = f"{digest}_{starnet.mode}_{starnet.window_size}_{starnet.stride}"
+        # Reduced precision backends change the output slightly, their results are cached separately
+        if starnet.backend != 'float32':
+            key += f"_{starnet.backend}"
+        # Fast mode changes the output, so its results are cached separately
+        if starnet.skip_threshold is not None:
+            key += f"_skip{starnet.skip_threshold:g}"
+        # Keep load test results apart from real ones
+        if starnet.stand_in is not None:
+            key += "_standin"
+        return key
+
+    def input_path(self, digest: str, filename: str) -> Path:
+        return self.store_dir / f"input_{digest}{Path(filename).suffix.lower()}"
+
+    def output_paths(self, key: str):
+        """Starless image and mask path for a cache key."""
+        return self.store_dir / f"starless_{key}.tif", self.store_dir / f"starless_{key}_mask.tif"
+
+    def lock(self, key: str) -> "_KeyLock":
+        """Lock held while a key is being processed, so identical uploads run inference once."""
+        return _KeyLock(self, key)
+
+    def find(self, key: str):
+        """Image id of a cached result whose files are all still on disk, or None."""
+        entry = self.db.get_cache_entry(key)
+        image_paths = self.db.get_image_paths(entry[0]) if entry else None
+        if not image_paths or not all(Path(path).exists() for path in image_paths[:3]):
+            return None
+        return entry[0]
+
+    def lookup(self, key: str):
+        """Like find, but counts towards the hit rate and as an access for eviction."""
+        image_id = self.find(key)
+        with self._lock:
+            if image_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if image_id is not None:
+            self.db.touch_cache_entry(image_id)
+        return image_id
+
+    def add(self, key: str, image_id: int) -> None:
+        """Record a freshly processed image, then evict old ones if over budget."""
+        paths = self.db.get_image_paths(image_id)[:3]
+        size_bytes = sum(Path(path).stat().st_size for path in paths if Path(path).exists())
+        self.db.save_cache_entry(key, image_id, size_bytes)
+        self.evict(keep=image_id)
+
+    def evict(self, keep: int = None) -> None:
+        if self.max_bytes is None:
+            return
+        size = self.db.get_cache_size()
+        while size > self.max_bytes:
+            entries = [entry for entry in self.db.get_least_recently_used(2) if entry[1] != keep]
+            if not entries:
+                break
+            _, image_id, size_bytes = entries[0]
+            print(f"Evicting cached image {image_id} ({size_bytes} bytes)")
+            self.remove_image(image_id)
+            size -= size_bytes
+
+    def remove_image(self, image_id: int) -> None:
+        """Delete an image row and every file of it that no other image shares."""
+        image_data = self.db.get_image_paths(image_id)
+        if not image_data:
+            return
+        self.db.delete_image(image_id)
+        for path in image_data[:3]:
+            if self.db.count_path_references(path) == 0:
+                # Also remove the files generated from it (web rendition, previews, catalog...),
+                # which are all named <file>.<suffix>
+                path = Path(path)
+                for file in [path] + list(path.parent.glob(glob.escape(path.name) + ".*")):
+                    file.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "size_bytes": self.db.get_cache_size(),
+            "max_bytes": self.max_bytes
+        }
+
+def sha256_file(fileobj, out_path: Path, chunk_size: int = 1 << 20) -> str:
+    """Copy a file object to out_path and return the sha256 hex digest of its contents."""
+    digest = hashlib.sha256()
+    with open(out_path, "wb") as buffer:
+        for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+            digest.update(chunk)
+            buffer.write(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,124 @@
+from pathlib import Path
+from scipy import ndimage
+import numpy as np
+import json
+import math
+import os
+import threading
+from tiling import image_layers, read_image
+
+# Same thresholds as the browser-side extractor (frontend/src/utils/starExtractor.ts)
+THRESHOLD = 100
+CENTER_THRESHOLD = 200
+MIN_BRIGHTNESS = 0.3
+# Larger masks are max-pooled down to about this many pixels before extraction
+MAX_PIXELS = 4096 * 4096
+
+FIELDS = ["x", "y", "min_x", "min_y", "max_x", "max_y", "size", "brightness", "r", "g", "b"]
+
+def catalog_path(mask_path) -> Path:
+    return Path(f"{mask_path}.stars.json")
+
+def find_stars(mask, threshold:int = THRESHOLD, center_threshold:int = CENTER_THRESHOLD):
+    """
+    Locate stars in an 8-bit star mask.
+
+    Star centres are pixels brighter than center_threshold and strictly brighter
+    than their 8 neighbours. A star's bounds are those of the connected region of
+    pixels above threshold it sits in. Stars are taken brightest first and
+    dropped when their disc overlaps one already taken.
+    Returns rows of (x, y, min_x, min_y, max_x, max_y, size, brightness).
+    """
+    footprint = np.ones((3, 3), dtype=bool)
+    footprint[1, 1] = False
+    neighbours = ndimage.maximum_filter(mask, footprint=footprint, mode='constant', cval=0)
+    ys, xs = np.nonzero((mask > center_threshold) & (mask > neighbours))
+    peaks = mask[ys, xs]
+
+    labels, _ = ndimage.label(mask > threshold, structure=np.ones((3, 3)))
+    objects = ndimage.find_objects(labels)
+
+    h, w = mask.shape
+    covered = np.zeros((h, w), dtype=bool)
+    stars = []
+    for i in np.argsort(-peaks, kind='stable'):
+        x, y, peak = int(xs[i]), int(ys[i]), int(peaks[i])
+        brightness = peak / 255
+        if brightness < MIN_BRIGHTNESS:
+            continue
+
+        rows, cols = objects[labels[y, x] - 1]
+        size = max(rows.stop - rows.start, cols.stop - cols.start)
+        size += 2 * math.ceil(size * 0.2)
+        if size < 2:
+            continue
+
+        # Disc of the star, clipped to the image
+        radius = size / 2
+        y0, y1 = max(0, math.ceil(y - radius)), min(h, math.floor(y + radius) + 1)
+        x0, x1 = max(0, math.ceil(x - radius)), min(w, math.floor(x + radius) + 1)
+        dy, dx = np.ogrid[y0 - y:y1 - y, x0 - x:x1 - x]
+        disc = dx * dx + dy * dy < radius * radius
+        if (covered[y0:y1, x0:x1] & disc).any():
+            continue
+        covered[y0:y1, x0:x1] |= disc
+
+        stars.append((x, y, cols.start, rows.start, cols.stop - 1, rows.stop - 1, size, brightness))
+    return stars
+
+def sample_colour(original, star):
+    """
+    Mean colour (0-255 RGB) of the original image over a star's bounds. Float
+    images have no fixed white level, their colours are scaled to the star's
+    brightest channel.
+    """
+    _, _, min_x, min_y, max_x, max_y, _, _ = star
+    region = np.asarray(original[min_y:max_y + 1, min_x:max_x + 1], dtype='float64')
+    if original.dtype == 'uint16':
+        region /= 257
+    elif original.dtype.kind == 'f':
+        region = np.nan_to_num(region) * 255 / max(np.nanmax(region), 1e-12)
+    if region.ndim == 2:
+        region = np.repeat(region[:, :, None], 3, axis=2)
+    return [int(round(c)) for c in region[:, :, :3].reshape(-1, 3).mean(axis=0)]
+
+def build_catalog(mask_path, original_path, layer:int = None, rgb:bool = True):
+    """
+    Extract the star catalog of a processed image and store it as JSON next to
+    the mask. Positions and bounds are in pixels of the full size image.
+    For one layer of a multi-layer original, layer and rgb select it like
+    tiling.image_layers.
+    """
+    mask = read_image(mask_path)
+    h, w = mask.shape[:2]
+
+    # Max-pool very large masks so labelling stays within memory; peaks survive pooling
+    factor = max(1, math.ceil(math.sqrt(h * w / MAX_PIXELS)))
+    if factor > 1:
+        ph, pw = h // factor, w // factor
+        pooled = np.empty((ph, pw), dtype=mask.dtype)
+        for row in range(0, ph, 256):
+            band = np.asarray(mask[row * factor:min(row + 256, ph) * factor, :pw * factor])
+            pooled[row:row + 256] = band.reshape(-1, factor, pw, factor).max(axis=(1, 3))
+        mask = pooled
+    else:
+        mask = np.asarray(mask)
+
+    original = read_image(original_path)
+    if layer is not None:
+        original = image_layers(original, rgb)[layer]
+    stars = []
+    for star in find_stars(mask):
+        x, y, min_x, min_y, max_x, max_y, size, brightness = star
+        star = (x * factor, y * factor, min_x * factor, min_y * factor,
+                min(w - 1, (max_x + 1) * factor - 1), min(h - 1, (max_y + 1) * factor - 1),
+                size * factor, round(brightness, 4))
+        stars.append(list(star) + sample_colour(original, star))
+
+    catalog = {"version": 1, "width": w, "height": h, "fields": FIELDS, "stars": stars}
+    target = catalog_path(mask_path)
+    partial = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.partial")
+    with open(partial, "w") as f:
+        json.dump(catalog, f, separators=(",", ":"))
+    partial.replace(target)
+    return target
@@ -1,14 +1,59 @@
 import sqlite3
+import queue
+import base64
+import json
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 
 class ImageDatabase:
-    def __init__(self, db_path="images.db"):
+    """
+    SQLite store of processed images.
+
+    Connections are kept open in a small pool and shared between threads. The
+    database runs in WAL mode, so reads never wait for a write to finish.
+    """
+    def __init__(self, db_path="images.db", pool_size: int = 8):
         self.db_path = db_path
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
         self.init_db()
 
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Safe with WAL: a crash can lose the last commits, never corrupt the database
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection for one transaction: committed on success,
+        rolled back on error, then returned to the pool.
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            if self._pool.qsize() < self.pool_size:
+                self._pool.put(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS images (
@@ -19,10 +64,50 @@ class ImageDatabase:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    image_id INTEGER NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    last_access TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_result_cache_last_access
+                ON result_cache (last_access)
+            ''')
+            # Newest first listing and keyset pagination walk this index
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_images_created_at
+                ON images (created_at DESC, id DESC)
+            ''')
+            # Row count kept up to date by triggers, instead of a COUNT(*) scan per request
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                INSERT OR IGNORE INTO counters (name, value)
+                SELECT 'images', COUNT(*) FROM images
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS images_count_insert AFTER INSERT ON images
+                BEGIN
+                    UPDATE counters SET value = value + 1 WHERE name = 'images';
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS images_count_delete AFTER DELETE ON images
+                BEGIN
+                    UPDATE counters SET value = value - 1 WHERE name = 'images';
+                END
+            ''')
             conn.commit()
 
     def save_image_paths(self, original_path: str, starless_path: str, mask_path: str) -> int:
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO images (original_path, starless_path, mask_path)
@@ -31,8 +116,22 @@ class ImageDatabase:
             conn.commit()
             return cursor.lastrowid
 
+    def save_many_image_paths(self, rows) -> list:
+        """Insert (original_path, starless_path, mask_path) rows in a single transaction, returning their ids."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            image_ids = []
+            for original_path, starless_path, mask_path in rows:
+                cursor.execute('''
+                    INSERT INTO images (original_path, starless_path, mask_path)
+                    VALUES (?, ?, ?)
+                ''', (str(original_path), str(starless_path), str(mask_path)))
+                image_ids.append(cursor.lastrowid)
+            conn.commit()
+            return image_ids
+
     def get_image_paths(self, image_id: int):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT original_path, starless_path, mask_path, created_at
@@ -42,35 +141,132 @@ class ImageDatabase:
             return cursor.fetchone()
 
     def get_all_images(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, original_path, starless_path, mask_path, created_at
                 FROM images
-                ORDER BY created_at DESC
+                ORDER BY created_at DESC, id DESC
             ''')
             return cursor.fetchall()
 
     def get_paginated_images(self, page: int, per_page: int):
         offset = (page - 1) * per_page
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, original_path, starless_path, mask_path, created_at
                 FROM images
-                ORDER BY created_at DESC
+                ORDER BY created_at DESC, id DESC
                 LIMIT ? OFFSET ?
             ''', (per_page, offset))
             return cursor.fetchall()
 
+    def get_images_after(self, cursor_token: str, per_page: int):
+        """
+        Keyset pagination: the per_page images that come after cursor_token
+        (None for the first page), newest first. Unlike OFFSET this costs the
+        same however deep into the listing the page is.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if cursor_token is None:
+                cursor.execute('''
+                    SELECT id, original_path, starless_path, mask_path, created_at
+                    FROM images
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                ''', (per_page,))
+            else:
+                created_at, image_id = self.decode_cursor(cursor_token)
+                cursor.execute('''
+                    SELECT id, original_path, starless_path, mask_path, created_at
+                    FROM images
+                    WHERE (created_at, id) < (?, ?)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                ''', (created_at, image_id, per_page))
+            return cursor.fetchall()
+
+    @staticmethod
+    def encode_cursor(image) -> str:
+        """Opaque cursor pointing just after an image row (id, ..., created_at)."""
+        payload = json.dumps([image[4], image[0]]).encode()
+        return base64.urlsafe_b64encode(payload).decode()
+
+    @staticmethod
+    def decode_cursor(cursor_token: str):
+        try:
+            created_at, image_id = json.loads(base64.urlsafe_b64decode(cursor_token.encode()))
+            return str(created_at), int(image_id)
+        except Exception:
+            raise ValueError("Invalid pagination cursor")
+
     def get_total_images(self) -> int:
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM images')
+            cursor.execute("SELECT value FROM counters WHERE name = 'images'")
             return cursor.fetchone()[0]
 
     def delete_image(self, image_id: int) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM images WHERE id = ?', (image_id,))
-            conn.commit() 
\ No newline at end of file
+            cursor.execute('DELETE FROM result_cache WHERE image_id = ?', (image_id,))
+            conn.commit()
+
+    def count_path_references(self, path: str) -> int:
+        """Number of images using path as their original, starless or mask file."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) FROM images
+                WHERE original_path = ? OR starless_path = ? OR mask_path = ?
+            ''', (str(path), str(path), str(path)))
+            return cursor.fetchone()[0]
+
+    def save_cache_entry(self, cache_key: str, image_id: int, size_bytes: int) -> None:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO result_cache (cache_key, image_id, size_bytes)
+                VALUES (?, ?, ?)
+            ''', (cache_key, image_id, size_bytes))
+            conn.commit()
+
+    def get_cache_entry(self, cache_key: str):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT image_id, size_bytes, last_access
+                FROM result_cache
+                WHERE cache_key = ?
+            ''', (cache_key,))
+            return cursor.fetchone()
+
+    def touch_cache_entry(self, image_id: int) -> None:
+        """Mark a cached image as accessed; skipped if it already was in the last minute."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE result_cache SET last_access = CURRENT_TIMESTAMP
+                WHERE image_id = ? AND last_access < datetime('now', '-60 seconds')
+            ''', (image_id,))
+            conn.commit()
+
+    def get_cache_size(self) -> int:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM result_cache')
+            return cursor.fetchone()[0]
+
+    def get_least_recently_used(self, limit: int):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT cache_key, image_id, size_bytes
+                FROM result_cache
+                ORDER BY last_access ASC, rowid ASC
+                LIMIT ?
+            ''', (limit,))
+            return cursor.fetchall() 
\ No newline at end of file
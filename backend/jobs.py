@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+class Job:
+    """A single unit of work and its lifecycle: queued -> running -> done | failed."""
+    def __init__(self, payload, handler = None):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        # Runs the job instead of the queue's handler when set
+        self.handler = handler
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        # Set by the handler while the job runs (see StarNet.transform)
+        self.progress = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+class JobQueue:
+    """Bounded job queue drained by a fixed pool of worker threads.
+
+    `handler` is called with each Job on a worker thread (unless the job was
+    submitted with its own) and its return value becomes the job result. Submitting while `max_queue` jobs are already waiting
+    raises QueueFullError, so callers can apply backpressure instead of piling up
+    work. The most recent `max_finished` finished jobs are kept for status lookups.
+    """
+    def __init__(self, handler, workers:int = 2, max_queue:int = 16, max_finished:int = 1000):
+        self.handler = handler
+        self.workers = workers
+        self.max_finished = max_finished
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+        self._finished = {'done': 0, 'failed': 0}
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"starnet-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self, wait:bool = True):
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def submit(self, payload, handler = None) -> Job:
+        job = Job(payload, handler)
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(f"Job queue is full ({self._queue.maxsize} jobs waiting)")
+            self._jobs[job.id] = job
+        return job
+
+    def complete(self, payload, result) -> Job:
+        """Record a job whose result is already known, without queueing it."""
+        job = Job(payload)
+        job.status = 'done'
+        job.result = result
+        job.started_at = job.finished_at = job.created_at
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        return job
+
+    def get(self, job_id:str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "running": self._running,
+                "workers": self.workers,
+                "max_queue": self._queue.maxsize,
+                "done": self._finished['done'],
+                "failed": self._finished['failed']
+            }
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            with self._lock:
+                job.status = 'running'
+                job.started_at = time.time()
+                self._running += 1
+            try:
+                result = (job.handler or self.handler)(job)
+                status, error = 'done', None
+            except Exception as e:
+                traceback.print_exc()
+                result, status, error = None, 'failed', str(e)
+            with self._lock:
+                job.result = result
+                job.error = error
+                job.status = status
+                job.finished_at = time.time()
+                self._running -= 1
+                self._finished[status] += 1
+                self._forget_finished()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
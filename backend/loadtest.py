@@ -0,0 +1,305 @@
+"""
+End-to-end HTTP load test of the API.
+
+Boots api.py with uvicorn in a scratch directory, with a StandInGenerator in
+place of the generator (STARNET_STAND_IN: nothing is downloaded, every tile
+takes --seconds-per-tile), and drives it from an async client. Every virtual
+user picks its next request from a weighted mix of uploads
+(POST /process_image/), gallery pages (GET /images/paginated), image fetches
+(GET /image/{type}/{id} and .../raw) and deletions (DELETE /image/{id}), while a
+probe requests GET /healthz every PROBE_INTERVAL: its latency shows the event
+loop (or thread pool) being blocked by a handler.
+
+For every request type the throughput, p50/p95/p99 latency and error rate are
+reported; "job" is the time from upload to processed image.
+
+    python loadtest.py --concurrency 16 --duration 60
+    python loadtest.py --mix process_image=1 paginated=10 get_image=5 delete=0.1 --seconds-per-tile 0.05
+    python loadtest.py --url http://localhost:8001 --duration 30
+
+With --url an already running server is tested instead (uploads then go
+through whatever model it runs). --max-error-rate and --max-probe-p99-ms make
+the exit status 1 when exceeded, to catch regressions.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import httpx
+import numpy as np
+import tifffile as tiff
+from synthetic import star_field
+
+DEFAULT_MIX = {"process_image": 1, "paginated": 4, "get_image": 2, "get_image_raw": 4, "delete": 0.25}
+IMAGE_TYPES = ("original", "starless", "mask")
+PER_PAGE = 20
+# How often the probe requests GET /healthz, and uploads poll their job
+PROBE_INTERVAL = 0.1
+JOB_POLL_INTERVAL = 0.25
+
+class Recorder:
+    """Latency and status of every request, by request type."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def record(self, name:str, seconds:float, status):
+        self.samples[name].append((seconds, status))
+
+    def report(self, elapsed:float) -> dict:
+        report = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = np.array([seconds for seconds, _ in samples]) * 1000
+            statuses = defaultdict(int)
+            for _, status in samples:
+                statuses[str(status)] += 1
+            errors = sum(1 for _, status in samples if not isinstance(status, int) or status >= 400)
+            p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+            report[name] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": errors / len(samples),
+                "throughput": len(samples) / elapsed,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(latencies.max()),
+                "statuses": dict(statuses),
+            }
+        return report
+
+class LoadTest:
+    def __init__(self, client:httpx.AsyncClient, args, recorder:Recorder):
+        self.client = client
+        self.args = args
+        self.recorder = recorder
+        self.rng = np.random.default_rng(args.seed)
+        self.mix = list(args.mix.items())
+        self.image_ids = []
+        self.jobs = set()
+        self.unfinished_jobs = 0
+        self.uploads = []
+        self.base = star_field(args.image_size, 'uint16', 'RGB', seed=args.seed)
+
+    async def request(self, name:str, method:str, url:str, **kwargs):
+        """Send a request and record it; returns the response, or None if it didn't get one."""
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            await response.aread()
+        except httpx.HTTPError as e:
+            self.recorder.record(name, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.recorder.record(name, time.perf_counter() - start, response.status_code)
+        return response
+
+    def upload(self) -> bytes:
+        # A share of the uploads repeat an earlier image (and are answered from the result
+        # cache), the others differ in one pixel so each one runs through the generator
+        if self.uploads and self.rng.uniform() < self.args.repeat_uploads:
+            return self.uploads[self.rng.integers(len(self.uploads))]
+        image = self.base.copy()
+        image[0, 0] = [len(self.uploads) % 65536, len(self.uploads) // 65536, 0]
+        buffer = io.BytesIO()
+        tiff.imwrite(buffer, image)
+        self.uploads.append(buffer.getvalue())
+        return self.uploads[-1]
+
+    async def process_image(self):
+        start = time.perf_counter()
+        files = {"file": ("loadtest.tif", self.upload(), "image/tiff")}
+        response = await self.request("process_image", "POST", "/process_image/", files=files)
+        if response is not None and response.status_code in (200, 202):
+            task = asyncio.create_task(self.wait_for_job(response.json()["job_id"], start))
+            self.jobs.add(task)
+            task.add_done_callback(self.jobs.discard)
+
+    async def wait_for_job(self, job_id:str, start:float):
+        while True:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            try:
+                response = await self.client.get(f"/jobs/{job_id}")
+            except httpx.HTTPError:
+                continue
+            job = response.json()
+            if job.get("status") in ("done", "failed"):
+                break
+        self.recorder.record("job", time.perf_counter() - start, 200 if job["status"] == "done" else job["status"])
+        if job["status"] == "done":
+            self.image_ids.append(job["result"]["image_id"])
+
+    async def paginated(self):
+        pages = max(1, -(-len(self.image_ids) // PER_PAGE))
+        await self.request("paginated", "GET", "/images/paginated",
+                           params={"page": int(self.rng.integers(1, pages + 1)), "per_page": PER_PAGE,
+                                   "inline_thumbnails": "true"})
+
+    async def get_image(self):
+        image_id = self.image_ids[self.rng.integers(len(self.image_ids))]
+        await self.request("get_image", "GET", f"/image/{self.rng.choice(IMAGE_TYPES)}/{image_id}")
+
+    async def get_image_raw(self):
+        image_id = self.image_ids[self.rng.integers(len(self.image_ids))]
+        await self.request("get_image_raw", "GET", f"/image/{self.rng.choice(IMAGE_TYPES)}/{image_id}/raw")
+
+    async def delete(self):
+        # Forget the image first so other users stop fetching it
+        image_id = self.image_ids.pop(self.rng.integers(len(self.image_ids)))
+        await self.request("delete", "DELETE", f"/image/{image_id}")
+
+    async def user(self, deadline:float):
+        names = [name for name, _ in self.mix]
+        weights = np.array([weight for _, weight in self.mix], dtype='float64')
+        while time.perf_counter() < deadline:
+            name = names[self.rng.choice(len(names), p=weights / weights.sum())]
+            # Until an upload is processed there is nothing to fetch or delete
+            if name in ("get_image", "get_image_raw", "delete") and not self.image_ids:
+                name = "paginated"
+            await getattr(self, name)()
+            if self.args.think_time:
+                await asyncio.sleep(self.rng.exponential(self.args.think_time))
+
+    async def probe(self, deadline:float):
+        while time.perf_counter() < deadline:
+            await self.request("probe", "GET", "/healthz")
+            await asyncio.sleep(PROBE_INTERVAL)
+
+    async def seed(self):
+        """Known images: those of the server's gallery, or a first processed upload."""
+        response = await self.client.get("/images/paginated", params={"page": 1, "per_page": 100})
+        self.image_ids = [image["id"] for image in response.json().get("images", [])]
+        if not self.image_ids:
+            await self.process_image()
+            await asyncio.gather(*self.jobs)
+
+    async def run(self) -> float:
+        await self.seed()
+        self.recorder.samples.clear()
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        await asyncio.gather(self.probe(deadline), *(self.user(deadline) for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - start
+        # Let the jobs still running finish, up to --drain seconds
+        if self.jobs:
+            _, pending = await asyncio.wait(set(self.jobs), timeout=self.args.drain)
+            for task in pending:
+                task.cancel()
+            self.unfinished_jobs = len(pending)
+        return elapsed
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def boot_server(args, workdir:str, port:int) -> subprocess.Popen:
+    """uvicorn running api:app in workdir (its database and images land there) with the stand-in generator."""
+    backend = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ,
+           "PYTHONPATH": os.pathsep.join([backend] + ([os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else [])),
+           "STARNET_STAND_IN": str(args.seconds_per_tile),
+           "STARNET_WORKERS": str(args.workers),
+           "STARNET_QUEUE_SIZE": str(args.queue_size)}
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], cwd=workdir, env=env)
+
+async def wait_until_ready(client:httpx.AsyncClient, server:subprocess.Popen, timeout:float):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server is not None and server.poll() is not None:
+            raise SystemExit(f"Server exited with status {server.returncode}")
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"Server not ready after {timeout:g} s")
+
+async def load_test(args, url:str, server:subprocess.Popen = None) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency + 8)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        await wait_until_ready(client, server, args.startup_timeout)
+        test = LoadTest(client, args, recorder)
+        elapsed = await test.run()
+    return {"elapsed": elapsed, "unfinished_jobs": test.unfinished_jobs, "endpoints": recorder.report(elapsed)}
+
+def parse_mix(items:list) -> dict:
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown request type {name}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the StarNet API with a stand-in generator")
+    parser.add_argument("--url", help="test a running server instead of booting one")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users sending requests")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--mix", nargs="+", default=[f"{name}={weight:g}" for name, weight in DEFAULT_MIX.items()],
+                        help="weights of the request types, e.g. process_image=1 paginated=4")
+    parser.add_argument("--think-time", type=float, default=0, help="mean pause of a user between requests, in seconds")
+    parser.add_argument("--image-size", type=int, default=512, help="side of the uploaded star fields")
+    parser.add_argument("--repeat-uploads", type=float, default=0, help="share of uploads repeating an earlier image")
+    parser.add_argument("--seconds-per-tile", type=float, default=0.02, help="time the stand-in generator takes per tile")
+    parser.add_argument("--workers", type=int, default=2, help="inference workers of the booted server (STARNET_WORKERS)")
+    parser.add_argument("--queue-size", type=int, default=16, help="job queue size of the booted server (STARNET_QUEUE_SIZE)")
+    parser.add_argument("--timeout", type=float, default=60, help="request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--drain", type=float, default=60, help="seconds to wait for running jobs after the load")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--max-error-rate", type=float, help="fail if the share of failed requests is above this")
+    parser.add_argument("--max-probe-p99-ms", type=float, help="fail if the p99 latency of GET /healthz is above this")
+    args = parser.parse_args()
+    args.mix = parse_mix(args.mix)
+
+    if args.url:
+        results = asyncio.run(load_test(args, args.url))
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            server = boot_server(args, workdir, port)
+            try:
+                results = asyncio.run(load_test(args, f"http://127.0.0.1:{port}", server))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    endpoints = results["endpoints"]
+    print(f"{args.concurrency} users for {results['elapsed']:.1f} s"
+          + (f", {results['unfinished_jobs']} jobs unfinished" if results["unfinished_jobs"] else ""))
+    print(f"{'request':>14} {'count':>7} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, stats in endpoints.items():
+        print(f"{name:>14} {stats['requests']:>7} {stats['throughput']:>8.2f} {stats['error_rate']:>7.1%} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}")
+
+    report = {"settings": vars(args), **results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    failures = []
+    requests = sum(stats["requests"] for name, stats in endpoints.items() if name != "job")
+    errors = sum(stats["errors"] for name, stats in endpoints.items() if name != "job")
+    if args.max_error_rate is not None and requests and errors / requests > args.max_error_rate:
+        failures.append(f"error rate {errors / requests:.1%} above {args.max_error_rate:.1%}")
+    probe = endpoints.get("probe")
+    if args.max_probe_p99_ms is not None and probe and probe["p99_ms"] > args.max_probe_p99_ms:
+        failures.append(f"GET /healthz p99 {probe['p99_ms']:.1f} ms above {args.max_probe_p99_ms:g} ms")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, disable_created_metrics, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import time
+
+# Leave out the *_created series, they only add size to every scrape
+disable_created_metrics()
+
+# Stages of processing an upload, from seconds (decode, mask) to minutes (inference of a large image)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TILE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16)
+
+STAGE_SECONDS = Histogram(
+    "starnet_stage_seconds",
+    "Time spent in each stage of processing an upload",
+    ["stage"], buckets=STAGE_BUCKETS
+)
+TILE_SECONDS = Histogram(
+    "starnet_tile_inference_seconds",
+    "Generator inference time per tile (batch time divided by the tiles in the batch)",
+    buckets=TILE_BUCKETS
+)
+TILES = Counter("starnet_tiles", "Tiles run through the generator")
+TILES_SKIPPED = Counter("starnet_tiles_skipped", "Tiles without stars passed through unchanged in fast mode")
+HTTP_REQUEST_SECONDS = Histogram(
+    "starnet_http_request_seconds",
+    "Time to answer HTTP requests, by route",
+    ["method", "route"]
+)
+
+def observe_progress(progress: dict) -> None:
+    """Record the tile timings of a StarNet.transform progress update."""
+    TILES_SKIPPED.inc(progress.get("batch_skipped", 0))
+    tiles = progress.get("batch_tiles")
+    if tiles:
+        TILES.inc(tiles)
+        per_tile = progress["batch_seconds"] / tiles
+        for _ in range(tiles):
+            TILE_SECONDS.observe(per_tile)
+
+def observe_stages(stage_seconds: dict) -> None:
+    """Record the stage timings returned by StarNet.transform."""
+    for stage, seconds in stage_seconds.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+class ServiceCollector:
+    """Job queue and result cache statistics, read from their stats() when metrics are scraped."""
+    def __init__(self, job_queue, result_cache):
+        self.job_queue = job_queue
+        self.result_cache = result_cache
+
+    def collect(self):
+        jobs = self.job_queue.stats()
+        yield GaugeMetricFamily("starnet_queue_depth", "Jobs waiting for an inference worker", value=jobs["queued"])
+        yield GaugeMetricFamily("starnet_jobs_in_flight", "Jobs being processed", value=jobs["running"])
+        finished = CounterMetricFamily("starnet_jobs", "Finished processing jobs", labels=["status"])
+        finished.add_metric(["done"], jobs["done"])
+        finished.add_metric(["failed"], jobs["failed"])
+        yield finished
+
+        cache = self.result_cache.stats()
+        lookups = CounterMetricFamily("starnet_cache_lookups", "Result cache lookups of uploads", labels=["result"])
+        lookups.add_metric(["hit"], cache["hits"])
+        lookups.add_metric(["miss"], cache["misses"])
+        yield lookups
+        total = cache["hits"] + cache["misses"]
+        yield GaugeMetricFamily("starnet_cache_hit_ratio", "Share of uploads answered from the result cache",
+                                value=cache["hits"] / total if total else 0)
+        yield GaugeMetricFamily("starnet_cache_size_bytes", "Disk space used by cached results", value=cache["size_bytes"])
+
+class RequestTimer:
+    """ASGI middleware recording the time to answer each HTTP request, labelled by route template."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # The router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route).observe(time.perf_counter() - start)
+
+def register_service(job_queue, result_cache) -> None:
+    REGISTRY.register(ServiceCollector(job_queue, result_cache))
+
+def render():
+    """Body and content type of the Prometheus text exposition of all metrics."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,171 @@
+from pathlib import Path
+import threading
+import traceback
+
+WEIGHTS_URL = "https://storage.googleapis.com/sundai-test-bucket/weights_G_RGB.h5"
+
+class ModelNotReadyError(Exception):
+    """Raised when the model is needed but failed to load."""
+
+class ModelLoader:
+    """
+    Loads StarNet in a background thread so the API can serve everything that
+    doesn't need the generator while it starts.
+
+    TensorFlow (through starnet_v1_TF2) and the weights download are only
+    imported and run on that thread. The StarNet parameters (mode, window_size,
+    stride, skip_threshold, backend, overlap) are known up front, so the loader can stand
+    in for the StarNet instance wherever only those are needed (e.g. ResultCache.key).
+
+    With a tflite-* backend the converted model is written next to the weights
+    on first boot; once it is there, serving doesn't need TensorFlow. The int8
+    model is calibrated on the images in weights_dir/calibration, or on synthetic
+    star fields if there are none.
+
+    With max_batch_wait set (in seconds) and no tile processes, the generator is
+    shared through a scheduler.BatchScheduler, so the tiles of uploads processed
+    at the same time run in common batches.
+
+    With stand_in set (seconds per tile), a StandInGenerator replaces the
+    generator: nothing is downloaded and the API can be load tested anywhere
+    (see loadtest.py).
+    """
+    def __init__(self, weights_dir: Path, mode: str = 'RGB', window_size: int = 512, stride: int = 256,
+                 batch_size = 'auto', skip_threshold: float = None, jit_compile: bool = False, processes: int = 0,
+                 backend: str = 'float32', overlap: int = None, max_batch_wait: float = None,
+                 stand_in: float = None):
+        self.weights_dir = Path(weights_dir)
+        self.mode = mode
+        self.window_size = window_size
+        self.stride = stride
+        self.batch_size = batch_size
+        self.skip_threshold = skip_threshold
+        self.jit_compile = jit_compile
+        self.processes = processes
+        self.backend = backend
+        self.overlap = overlap
+        self.max_batch_wait = max_batch_wait
+        self.stand_in = stand_in
+        self.status = 'pending'
+        self.error = None
+        self.starnet = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def saved_model_dir(self) -> Path:
+        # The generator is exported as a SavedModel on first boot and reloaded from it
+        # afterwards, which is much faster than rebuilding it and loading the .h5 weights
+        if self.backend == 'float32':
+            return self.weights_dir / f"starnet_{self.mode}"
+        return self.weights_dir / f"starnet_{self.mode}_{self.backend}"
+
+    @property
+    def tflite_path(self) -> Path:
+        # The converted model has a fixed tile size
+        return self.weights_dir / f"starnet_{self.mode}_{self.window_size}_{self.backend}.tflite"
+
+    def start(self):
+        self.status = 'loading'
+        self._thread = threading.Thread(target=self._load, name="starnet-loader", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self.starnet is not None and self.starnet.tile_pool:
+            self.starnet.tile_pool.close()
+        if self.starnet is not None and self.starnet.scheduler:
+            self.starnet.scheduler.close()
+
+    def get(self, timeout: float = None):
+        """The loaded StarNet, waiting for it to finish loading."""
+        if not self._ready.wait(timeout):
+            raise ModelNotReadyError("Model is still loading")
+        if self.status != 'ready':
+            raise ModelNotReadyError(f"Model failed to load: {self.error}")
+        return self.starnet
+
+    def is_ready(self) -> bool:
+        return self.status == 'ready'
+
+    def _load(self):
+        try:
+            from starnet_v1_TF2 import MAX_AUTO_BATCH_SIZE, StarNet
+            starnet = StarNet(mode=self.mode, window_size=self.window_size, stride=self.stride,
+                              batch_size=self.batch_size, skip_threshold=self.skip_threshold, backend=self.backend,
+                              overlap=self.overlap)
+
+            self.weights_dir.mkdir(exist_ok=True)
+            if self.stand_in is not None:
+                starnet.load_stand_in(self.stand_in)
+            elif self.backend.startswith('tflite'):
+                if not self.tflite_path.exists():
+                    self._download_weights()
+                    starnet.load_model(weights=str(self.weights_dir / "weights"))
+                    starnet.export_tflite(str(self.tflite_path), self._calibration_images())
+                starnet.load_tflite(str(self.tflite_path))
+            elif self.saved_model_dir.exists():
+                starnet.load_saved_model(str(self.saved_model_dir))
+            else:
+                self._download_weights()
+                starnet.load_model(weights=str(self.weights_dir / "weights"))
+                starnet.export_saved_model(str(self.saved_model_dir))
+            starnet.compile_model(jit_compile=self.jit_compile)
+
+            # Trace the inference graph (or start the tile workers) before accepting uploads
+            if self.processes:
+                from parallel import TilePool
+                starnet.tile_pool = TilePool(
+                    {"mode": self.mode, "window_size": self.window_size, "stride": self.stride, "backend": self.backend},
+                    self._model_source(),
+                    workers=self.processes,
+                    batch_size=max(1, starnet.tile_batch_size(MAX_AUTO_BATCH_SIZE) // self.processes),
+                    jit_compile=self.jit_compile
+                )
+                starnet.tile_pool.start()
+            else:
+                starnet.warmup()
+                if self.max_batch_wait is not None:
+                    from scheduler import BatchScheduler
+                    starnet.scheduler = BatchScheduler(starnet.infer, max_batch=starnet.tile_batch_size(MAX_AUTO_BATCH_SIZE),
+                                                       max_wait=self.max_batch_wait)
+                    starnet.scheduler.start()
+
+            self.starnet = starnet
+            self.status = 'ready'
+            print("Model ready")
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            self.status = 'failed'
+        finally:
+            self._ready.set()
+
+    def _model_source(self) -> dict:
+        # What the tile workers load, see parallel.TilePool
+        if self.stand_in is not None:
+            return {"stand_in": self.stand_in}
+        if self.backend.startswith('tflite'):
+            return {"tflite": str(self.tflite_path)}
+        return {"saved_model": str(self.saved_model_dir)}
+
+    def _calibration_images(self) -> list:
+        images = sorted(str(path) for path in (self.weights_dir / "calibration").glob("*") if path.is_file())
+        if images:
+            return images
+        from synthetic import star_field
+        return [star_field(2048, 'uint16', self.mode, seed=seed) for seed in range(2)]
+
+    def _download_weights(self):
+        # Check if weights file exists, if not download it
+        weights_path = self.weights_dir / f"weights_G_{self.mode}.h5"
+        if weights_path.exists():
+            return
+        import requests
+        print("Downloading weights file...")
+        response = requests.get(WEIGHTS_URL)
+        if response.status_code == 200:
+            with open(weights_path, "wb") as f:
+                f.write(response.content)
+            print("Weights file downloaded successfully")
+        else:
+            raise Exception(f"Failed to download weights file. Status code: {response.status_code}")
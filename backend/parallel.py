@@ -0,0 +1,282 @@
+from multiprocessing import shared_memory
+import multiprocessing as mp
+import numpy as np
+import threading
+import traceback
+import queue
+import time
+import os
+
+def _worker_main(model_args, model_source, jit_compile, threads, slot_names, slot_shape, tasks, results):
+    """
+    Entry point of a tile worker process: build its own generator limited to
+    `threads` intra-op threads, then run the batches it is handed in shared
+    memory slots until it receives None.
+    """
+    # Must be set before TensorFlow is imported in this process
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    from starnet_v1_TF2 import StarNet, tf
+    if tf is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    try:
+        starnet = StarNet(**model_args)
+        if "tflite" in model_source:
+            starnet.load_tflite(model_source["tflite"], num_threads=threads)
+        elif "saved_model" in model_source:
+            starnet.load_saved_model(model_source["saved_model"])
+        elif "weights" in model_source:
+            starnet.load_model(model_source["weights"])
+        elif "stand_in" in model_source:
+            starnet.load_stand_in(model_source["stand_in"])
+        else:
+            starnet.init_random_weights(model_source.get("seed", 0))
+        starnet.compile_model(jit_compile=jit_compile)
+        starnet.infer(np.zeros((1,) + slot_shape[1:], dtype='float32'))
+    except Exception:
+        results.put((None, traceback.format_exc(), 0))
+        return
+
+    memories = [(shared_memory.SharedMemory(name=tiles), shared_memory.SharedMemory(name=output)) for tiles, output in slot_names]
+    slots = [(np.ndarray(slot_shape, dtype='float32', buffer=tiles.buf), np.ndarray(slot_shape, dtype='float32', buffer=output.buf))
+             for tiles, output in memories]
+    results.put((None, None, 0))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        slot, n = task
+        try:
+            tiles, output = slots[slot]
+            start = time.perf_counter()
+            output[:n] = (np.asarray(starnet.infer(tiles[:n])) + 1) / 2
+            results.put((slot, None, time.perf_counter() - start))
+        except Exception:
+            results.put((slot, traceback.format_exc(), 0))
+
+    del slots
+    for tiles, output in memories:
+        tiles.close()
+        output.close()
+
+class TilePool:
+    """
+    Pool of worker processes that each hold their own generator.
+
+    model_args are the StarNet constructor arguments and model_source says what
+    each worker loads: {"saved_model": path}, {"tflite": path} (a model written
+    by StarNet.export_tflite), {"weights": path} (as passed to StarNet.load_model),
+    {"stand_in": seconds_per_tile} for a StandInGenerator or {"seed": n} for
+    random weights.
+
+    Tile batches and their results are exchanged through shared memory slots
+    (two per worker so a worker never waits for the next batch); only slot
+    numbers go through the process queues. Every worker is limited to its share
+    of the CPU cores for TensorFlow's intra-op threads, so the pool doesn't
+    oversubscribe the machine. A pool can be shared by several threads running
+    StarNet.transform at the same time.
+    """
+    def __init__(self, model_args:dict, model_source:dict, workers:int = None, batch_size:int = 4,
+                 threads_per_worker:int = None, jit_compile:bool = False):
+        cpus = os.cpu_count() or 1
+        self.workers = workers or cpus
+        self.threads_per_worker = threads_per_worker or max(1, cpus // self.workers)
+        self.batch_size = batch_size
+        self.model_args = model_args
+        self.model_source = model_source
+        self.jit_compile = jit_compile
+
+        window_size = model_args.get("window_size", 512)
+        channels = 3 if model_args["mode"] == "RGB" else 1
+        self.slot_shape = (batch_size, window_size, window_size, channels)
+        self._processes = []
+        self._memories = []
+        self._slots = []
+
+    def start(self):
+        ctx = mp.get_context("spawn")
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        nbytes = int(np.prod(self.slot_shape)) * 4
+        for _ in range(2 * self.workers):
+            tiles = shared_memory.SharedMemory(create=True, size=nbytes)
+            output = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._memories.append((tiles, output))
+            self._slots.append((np.ndarray(self.slot_shape, dtype='float32', buffer=tiles.buf),
+                                np.ndarray(self.slot_shape, dtype='float32', buffer=output.buf)))
+        slot_names = [(tiles.name, output.name) for tiles, output in self._memories]
+
+        for _ in range(self.workers):
+            process = ctx.Process(target=_worker_main, daemon=True, args=(
+                self.model_args, self.model_source, self.jit_compile, self.threads_per_worker,
+                slot_names, self.slot_shape, self._tasks, self._results))
+            process.start()
+            self._processes.append(process)
+
+        # Wait until every worker has built its generator
+        ready = 0
+        while ready < self.workers:
+            try:
+                _, error, _ = self._results.get(timeout=1)
+            except queue.Empty:
+                if any(not process.is_alive() for process in self._processes):
+                    error = "worker process exited"
+                else:
+                    continue
+            if error:
+                self.close()
+                raise RuntimeError(f"Tile worker failed to start:\n{error}")
+            ready += 1
+
+        self._free = list(range(len(self._slots)))
+        self._done = {}
+        self._condition = threading.Condition()
+        self._listener = threading.Thread(target=self._listen, name="tile-pool-results", daemon=True)
+        self._listener.start()
+        print(f"Tile pool started: {self.workers} workers x {self.threads_per_worker} threads")
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        if getattr(self, "_listener", None):
+            self._results.put(None)
+            self._listener.join()
+            self._listener = None
+        self._slots = []
+        for tiles, output in self._memories:
+            for memory in (tiles, output):
+                memory.close()
+                memory.unlink()
+        self._memories = []
+
+    def _listen(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            slot, error, seconds = message
+            with self._condition:
+                self._done[slot] = (error, seconds)
+                self._condition.notify_all()
+
+    def _acquire_slot(self, wait:bool = True):
+        """A free slot, or None if there is none and wait is False."""
+        with self._condition:
+            while not self._free:
+                if not wait:
+                    return None
+                self._check_workers()
+                self._condition.wait(timeout=1)
+            return self._free.pop()
+
+    def _wait_for(self, slots):
+        """Wait until one of slots is done and return it with the seconds its batch took."""
+        with self._condition:
+            while True:
+                for slot in slots:
+                    if slot in self._done:
+                        error, seconds = self._done.pop(slot)
+                        if error:
+                            self._free.append(slot)
+                            self._condition.notify_all()
+                            raise RuntimeError(f"Tile worker failed:\n{error}")
+                        return slot, seconds
+                self._check_workers()
+                self._condition.wait(timeout=1)
+
+    def _check_workers(self):
+        if any(not process.is_alive() for process in self._processes):
+            raise RuntimeError("A tile worker process died")
+
+    def imap(self, batches):
+        """
+        Run (coords, tiles) batches on the workers and yield (coords, tiles, result, seconds)
+        as they complete, which may not be the order they were submitted in.
+        Results are rescaled to [0, 1] and seconds is the time the worker spent
+        on the batch, like in StarNet.infer_batches.
+        """
+        pending = {}
+        try:
+            for coords, tiles in batches:
+                # Keep every worker busy, but no more batches in flight than there are slots
+                while len(pending) >= 2 * self.workers:
+                    yield self._collect(pending)
+                # With every slot taken, finish one of this caller's own batches instead of
+                # waiting for other callers to free one: they may be waiting for this one
+                slot = self._acquire_slot(wait=not pending)
+                while slot is None:
+                    yield self._collect(pending)
+                    slot = self._acquire_slot(wait=not pending)
+                n = len(tiles)
+                self._slots[slot][0][:n] = tiles
+                pending[slot] = (coords, tiles)
+                self._tasks.put((slot, n))
+            while pending:
+                yield self._collect(pending)
+        finally:
+            # Slots still in flight if the caller stopped early are freed once they finish
+            for slot in list(pending):
+                try:
+                    self._wait_for([slot])
+                except RuntimeError:
+                    continue
+                with self._condition:
+                    self._free.append(slot)
+                    self._condition.notify_all()
+
+    def _collect(self, pending):
+        slot, seconds = self._wait_for(list(pending))
+        coords, tiles = pending.pop(slot)
+        result = self._slots[slot][1][:len(tiles)].copy()
+        with self._condition:
+            self._free.append(slot)
+            self._condition.notify_all()
+        return coords, tiles, result, seconds
+
+if __name__ == "__main__":
+    # Scaling report: tiles/s of the pool for several worker counts, with random weights
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure how tile throughput scales with the number of worker processes")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--tiles", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--window-size", type=int, default=512)
+    parser.add_argument("--mode", default="RGB", choices=["RGB", "Greyscale"])
+    args = parser.parse_args()
+
+    channels = 3 if args.mode == "RGB" else 1
+    rng = np.random.default_rng(0)
+    tiles = rng.uniform(-1, 1, (args.batch_size, args.window_size, args.window_size, channels)).astype('float32')
+    batches = [(None, tiles)] * (args.tiles // args.batch_size)
+
+    print(f"{os.cpu_count()} CPUs, {len(batches) * args.batch_size} tiles of {args.window_size}px per run")
+    print(f"{'workers':>8} {'threads':>8} {'tiles/s':>10} {'speedup':>8} {'efficiency':>10}")
+    baseline = None
+    for workers in args.workers:
+        pool = TilePool({"mode": args.mode, "window_size": args.window_size}, {"seed": 0},
+                        workers=workers, batch_size=args.batch_size)
+        pool.start()
+        try:
+            start = time.perf_counter()
+            for _ in pool.imap(batches):
+                pass
+            elapsed = time.perf_counter() - start
+        finally:
+            pool.close()
+        rate = len(batches) * args.batch_size / elapsed
+        # Speedup and efficiency are relative to the first worker count
+        baseline = baseline or rate
+        speedup = rate / baseline
+        efficiency = speedup / (workers / args.workers[0])
+        print(f"{workers:>8} {pool.threads_per_worker:>8} {rate:>10.2f} {speedup:>8.2f} {efficiency:>10.2f}")
@@ -0,0 +1,128 @@
+from pathlib import Path
+from PIL import Image
+from scipy import ndimage
+import numpy as np
+import gzip
+import json
+import os
+import threading
+from catalog import catalog_path
+from web_images import PREVIEW_SIZES, preview
+
+# Longest side of the scene textures, taken from the largest preview of the starless image
+SCENE_SIZE = max(PREVIEW_SIZES)
+# Depth bands the starless image is split into, drawn as planes at their own distance
+SCENE_LAYERS = 4
+# Brightest stars kept as sprites
+MAX_STARS = 4000
+# Smoothing of the depth estimate, as a fraction of the texture width
+DEPTH_SMOOTHING = 0.01
+# Distance range of the stars in front of the nebula, in scene units (the nebula is at 10)
+STAR_DEPTH = (5.0, 10.0)
+
+SCENE_MAGIC = 0x4353424E  # "NBSC"
+SCENE_VERSION = 1
+HEADER_WORDS = 16
+# Float32 columns of every star, followed by its Uint8 RGBA colour in a buffer of its own
+STAR_FIELDS = ["x", "y", "z", "size", "brightness"]
+
+def scene_path(starless_path) -> Path:
+    return Path(f"{starless_path}.scene.bin.gz")
+
+def estimate_depth(rgb):
+    """
+    Depth estimate in [0,1] (1 = nearest) of a starless image: its smoothed
+    luminance, stretched between the 1st and 99th percentile. Bright, dense
+    nebulosity comes forward, faint background recedes.
+    """
+    lum = rgb.astype('float32') @ np.array([0.2126, 0.7152, 0.0722], dtype='float32')
+    lum = ndimage.gaussian_filter(lum, sigma=max(1.0, DEPTH_SMOOTHING * rgb.shape[1]))
+    low, high = np.percentile(lum, (1, 99))
+    return np.clip((lum - low) / max(high - low, 1e-6), 0, 1)
+
+def layer_weights(depth, layers:int = SCENE_LAYERS):
+    """
+    Share of every pixel in each of layers depth bands, as Uint8 alpha: linear
+    ramps between the band centres, so the shares of a pixel sum to 255 (up to
+    rounding). Band 0 is the farthest.
+    """
+    centres = np.linspace(0, 1, layers)[:, None, None]
+    weights = np.clip(1 - np.abs(depth[None] - centres) * (layers - 1), 0, 1)
+    return np.round(weights * 255).astype('uint8')
+
+def star_buffers(catalog, max_stars:int = MAX_STARS):
+    """
+    Float32 (x, y, z, size, brightness) rows and Uint8 RGBA colours of the
+    brightest stars of a catalog. x and y are in [-1, 1] with y up, z is a
+    distance in STAR_DEPTH (brighter stars are nearer, with a fixed jitter so
+    equally bright stars don't form a wall) and size is a fraction of the image width.
+    """
+    fields = {name: i for i, name in enumerate(catalog["fields"])}
+    stars = np.array(catalog["stars"][:max_stars], dtype='float64').reshape(-1, len(fields))
+    jitter = np.random.default_rng(0).uniform(0, 1, len(stars))
+    near, far = STAR_DEPTH
+    brightness = stars[:, fields["brightness"]]
+
+    rows = np.empty((len(stars), len(STAR_FIELDS)), dtype='float32')
+    rows[:, 0] = stars[:, fields["x"]] / catalog["width"] * 2 - 1
+    rows[:, 1] = 1 - stars[:, fields["y"]] / catalog["height"] * 2
+    rows[:, 2] = far - (far - near) * (0.5 * brightness + 0.5 * jitter)
+    rows[:, 3] = stars[:, fields["size"]] / catalog["width"]
+    rows[:, 4] = brightness
+
+    colours = np.full((len(stars), 4), 255, dtype='uint8')
+    colours[:, :3] = stars[:, [fields["r"], fields["g"], fields["b"]]]
+    return rows, colours
+
+def build_scene(starless_path, mask_path):
+    """
+    Precompute the flythrough scene of a processed image and store it next to the
+    starless image, in one binary file the browser maps straight onto typed arrays:
+
+        header   Uint32[16]: magic, version, width, height, layers, stars,
+                 image width, image height, then the byte offsets of the buffers
+        colour   Uint8 RGBA, width x height, the downscaled starless image
+        depth    Uint8, width x height, estimate_depth (255 = nearest)
+        layers   Uint8, layers x width x height, layer_weights
+        stars    Float32, stars x STAR_FIELDS
+        colours  Uint8 RGBA, stars x 4
+
+    Texture rows go bottom to top, as WebGL expects them. Every buffer starts on
+    a 4-byte boundary. The file is stored gzipped (about 5x smaller) and served
+    with Content-Encoding: gzip, so the browser inflates it natively.
+    The stars come from the image's star catalog, which must already be built
+    (see catalog.build_catalog).
+    """
+    with Image.open(preview(starless_path, SCENE_SIZE)) as img:
+        rgb = np.asarray(img.convert('RGB'))[::-1]
+    height, width = rgb.shape[:2]
+    depth = estimate_depth(rgb)
+    layers = layer_weights(depth)
+
+    with open(catalog_path(mask_path)) as f:
+        catalog = json.load(f)
+    stars, colours = star_buffers(catalog)
+
+    colour = np.empty((height, width, 4), dtype='uint8')
+    colour[:, :, :3] = rgb
+    colour[:, :, 3] = 255
+    buffers = [colour, np.round(depth * 255).astype('uint8'), layers, stars, colours]
+
+    offsets, offset = [], HEADER_WORDS * 4
+    for buffer in buffers:
+        offsets.append(offset)
+        offset += -(-buffer.nbytes // 4) * 4
+    header = np.zeros(HEADER_WORDS, dtype='<u4')
+    header[:13] = [SCENE_MAGIC, SCENE_VERSION, width, height, len(layers), len(stars),
+                   catalog["width"], catalog["height"], *offsets]
+
+    data = bytearray(offset)
+    data[:header.nbytes] = header.tobytes()
+    for buffer, start in zip(buffers, offsets):
+        data[start:start + buffer.nbytes] = buffer.astype(buffer.dtype.newbyteorder('<')).tobytes()
+
+    target = scene_path(starless_path)
+    partial = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.partial")
+    partial.write_bytes(gzip.compress(bytes(data), compresslevel=6, mtime=0))
+    partial.replace(target)
+    return target
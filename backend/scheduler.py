@@ -0,0 +1,163 @@
+from collections import deque
+import numpy as np
+import threading
+import time
+
+class _Submission:
+    """A batch of tiles one transform handed to the scheduler, filled in as its tiles are run."""
+    def __init__(self, client, coords, tiles):
+        self.client = client
+        self.coords = coords
+        self.tiles = tiles
+        self.result = None
+        self.remaining = len(tiles)
+        self.seconds = 0.0
+        self.error = None
+        self.submitted_at = time.monotonic()
+
+class BatchScheduler:
+    """
+    Runs the tiles of every transform in flight through one generator, in shared
+    batches.
+
+    Each StarNet.transform using the scheduler (see StarNet.scheduler) is a
+    client with its own queue of tiles. A dispatcher thread fills every generator
+    call with up to max_batch tiles, taking one tile from each client in turn
+    (round-robin, starting with a different client every batch) so a large mosaic
+    can't hold up small uploads. A batch that isn't full is sent once its oldest
+    tile waited max_wait seconds; with a single client its tiles arrive faster
+    than that and the batch is full anyway.
+
+    infer is called with a float32 batch of [-1, 1] tiles on the dispatcher
+    thread, like StarNet.infer. Tiles read from worker processes are already run
+    in shared batches by parallel.TilePool, which doesn't need a scheduler.
+    """
+    def __init__(self, infer, max_batch:int = 16, max_wait:float = 0.005):
+        self.infer = infer
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # Tiles a client may have queued or running; twice a batch so one can be read while the other runs
+        self.max_pending = 2 * max_batch
+        self._clients = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._batches = 0
+        self._tiles = 0
+        self._shared = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._dispatch, name="batch-scheduler", daemon=True)
+        self._thread.start()
+        print(f"Batch scheduler started: up to {self.max_batch} tiles per batch, {self.max_wait * 1000:g} ms wait")
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        """Generator calls, tiles run, batches with tiles of more than one transform and clients in flight."""
+        with self._condition:
+            return {
+                "batches": self._batches,
+                "tiles": self._tiles,
+                "mean_batch_size": self._tiles / self._batches if self._batches else 0,
+                "shared_batches": self._shared,
+                "clients": len(self._clients)
+            }
+
+    def imap(self, batches):
+        """
+        Run (coords, tiles) batches through the shared generator and yield
+        (coords, tiles, result, seconds) for them in order, like
+        StarNet.infer_batches. seconds is this batch's share of the generator
+        time of the calls its tiles went through.
+        """
+        queue = deque()
+        submissions = deque()
+        with self._condition:
+            self._clients.append(queue)
+        try:
+            for coords, tiles in batches:
+                # Yield what is done, and wait for it if this client has enough tiles in flight
+                while submissions and (submissions[0].remaining == 0 or
+                                       sum(s.remaining for s in submissions) + len(tiles) > self.max_pending):
+                    yield self._collect(submissions.popleft())
+                submission = _Submission(queue, coords, tiles)
+                with self._condition:
+                    if self._closed:
+                        raise RuntimeError("Batch scheduler is closed")
+                    queue.extend((submission, i) for i in range(len(tiles)))
+                    self._condition.notify_all()
+                submissions.append(submission)
+            while submissions:
+                yield self._collect(submissions.popleft())
+        finally:
+            # Tiles not dispatched yet are dropped if the caller stopped early
+            with self._condition:
+                queue.clear()
+                self._clients.remove(queue)
+
+    def _collect(self, submission):
+        with self._condition:
+            while submission.remaining and submission.error is None:
+                if self._closed:
+                    raise RuntimeError("Batch scheduler is closed")
+                self._condition.wait()
+        if submission.error is not None:
+            raise submission.error
+        return submission.coords, submission.tiles, submission.result, submission.seconds
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._closed and not any(self._clients):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                # Wait for a full batch, or until the oldest tile has waited max_wait
+                deadline = min(queue[0][0].submitted_at for queue in self._clients if queue) + self.max_wait
+                while not self._closed and sum(len(queue) for queue in self._clients) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                entries = self._take()
+
+            start = time.perf_counter()
+            try:
+                result = (np.asarray(self.infer(np.stack([s.tiles[i] for s, i in entries]))) + 1) / 2
+                error = None
+            except Exception as e:
+                error = e
+            seconds = (time.perf_counter() - start) / len(entries)
+
+            with self._condition:
+                for j, (submission, i) in enumerate(entries):
+                    if error is not None:
+                        submission.error = error
+                        continue
+                    if submission.result is None:
+                        submission.result = np.empty(submission.tiles.shape[:3] + result.shape[3:], dtype=result.dtype)
+                    submission.result[i] = result[j]
+                    submission.seconds += seconds
+                    submission.remaining -= 1
+                self._batches += 1
+                self._tiles += len(entries)
+                self._shared += len({id(submission.client) for submission, _ in entries}) > 1
+                self._condition.notify_all()
+
+    def _take(self):
+        """Up to max_batch queued tiles, one per client in turn."""
+        entries = []
+        while len(entries) < self.max_batch and any(self._clients):
+            for queue in self._clients:
+                if queue and len(entries) < self.max_batch:
+                    entries.append(queue.popleft())
+        # The next batch starts with the next client
+        self._clients.rotate(-1)
+        return entries
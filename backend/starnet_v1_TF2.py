@@ -1,21 +1,275 @@
-from PIL import Image as img
 from os import listdir
 from os.path import isfile, join
 import numpy as np
-import tensorflow as tf
-import tensorflow.keras as K
-import tensorflow.keras.layers as L
-import copy
+try:
+    import tensorflow as tf
+    import tensorflow.keras as K
+    import tensorflow.keras.layers as L
+except ImportError:
+    # Serving a converted TFLite generator (see load_tflite) doesn't need TensorFlow
+    tf = None
 import tifffile as tiff
+from collections import deque
+import tempfile
+import threading
+import time
 import os
+from tiling import TO_FLOAT, BlendGrid, TileGrid, image_layers, luminance, output_scale, read_image, release, sample_range, unit_scale
+from web_images import PngWriter, rendition_path, to_8bit
 
-class SubtractLayer(L.Layer):
-    def call(self, inputs):
-        return inputs[0] - inputs[1]
+# Rough working memory of one generator forward pass, per input pixel
+# (activations plus skip connections). Used to size automatic tile batches.
+TILE_BYTES_PER_PIXEL = 1200
+MAX_AUTO_BATCH_SIZE = 16
+# Block size of the local statistics used to screen tiles for stars (see star_score)
+SCREEN_BLOCK_SIZE = 16
+# Inference backends: the Keras dtype policy the generator is built with, or
+# for tflite-* backends the quantization of the converted model (see export_tflite)
+KERAS_BACKENDS = {'float32': 'float32', 'bfloat16': 'mixed_bfloat16', 'float16': 'mixed_float16'}
+TFLITE_BACKENDS = {'tflite-float16': 'float16', 'tflite-dynamic': 'dynamic', 'tflite-int8': 'int8'}
+BACKENDS = list(KERAS_BACKENDS) + list(TFLITE_BACKENDS)
+# Ops kept in float32 in the int8 model. These are the per-tile normalization
+# (mean, variance and scaling) and the final subtraction from the input; TFLite
+# can't allocate the model with them quantized, and they are cheap in float.
+TFLITE_INT8_FLOAT_OPS = ['MEAN', 'SQUARED_DIFFERENCE', 'RSQRT', 'MUL', 'ADD', 'SUB']
+# Tiles the int8 quantization ranges are calibrated on
+TFLITE_CALIBRATION_TILES = 32
+# The starless image and mask are written as tiled TIFFs with this compression
+# (None keeps them uncompressed); level 1 deflates about as well as the default
+# level on image data, in less than half the time
+OUTPUT_COMPRESSION = 'zlib'
+OUTPUT_COMPRESSION_LEVEL = 1
+OUTPUT_TILE = 256
+
+def available_memory():
+    """Return the memory available to new allocations in bytes, or None if unknown."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+if tf is not None:
+    class SubtractLayer(L.Layer):
+        def call(self, inputs):
+            return inputs[0] - inputs[1]
+
+    class TileBatchNormalization(L.BatchNormalization):
+        """Batch normalization that always uses the statistics of each tile on its own.
+
+        The generator was trained with ``training = True`` batch normalization and is
+        run the same way at inference time. With a batch of one tile that is exactly
+        a per-tile normalization; reducing over height and width only keeps results
+        identical when several tiles are stacked into one batch.
+
+        The statistics are computed in float32 under mixed precision policies too,
+        a variance over 256x256 activations is not reliable in 16 bits.
+        """
+        def call(self, inputs, training=None):
+            x = tf.cast(inputs, tf.float32)
+            mean, variance = tf.nn.moments(x, axes=[1, 2], keepdims=True)
+            normalized = tf.nn.batch_normalization(x, mean, variance, tf.cast(self.beta, tf.float32),
+                                                   tf.cast(self.gamma, tf.float32), self.epsilon)
+            return tf.cast(normalized, inputs.dtype)
+
+class StageTimer:
+    """Wall-clock seconds spent in each stage of a transform, in the order the stages ran."""
+    def __init__(self):
+        self.seconds = {}
+        self.stage = None
+        self._start = None
+        
+    def start(self, stage:str):
+        self.stop()
+        self.stage = stage
+        self._start = time.perf_counter()
+        
+    def stop(self):
+        if self.stage is not None:
+            self.seconds[self.stage] = self.seconds.get(self.stage, 0) + time.perf_counter() - self._start
+            self.stage = None
+            
+    def elapsed(self) -> dict:
+        """Seconds per stage so far, including the running time of the current stage."""
+        seconds = dict(self.seconds)
+        if self.stage is not None:
+            seconds[self.stage] = seconds.get(self.stage, 0) + time.perf_counter() - self._start
+        return seconds
+
+def output_paths(out_name:str, layer:int = None):
+    """Starless image and star mask paths transform writes for out_name, or for one layer of a multi-layer image."""
+    base_name, ext = os.path.splitext(out_name)
+    if layer is not None:
+        base_name = f"{base_name}_layer{layer}"
+    return f"{base_name}{ext}", f"{base_name}_mask{ext}"
+
+class LayerOutputs:
+    """
+    The outputs transform writes for one layer: the starless image in a
+    memory-mapped TIFF at its output path, and the raw luminance difference in a
+    temporary float32 file, with its running min and max, until encode writes
+    the star mask from it. In blend mode the weighted sum of the window outputs
+    is kept in another temporary file.
+    """
+    def __init__(self, paths, shape, dtype, blend_channels:int, work_dir:str):
+        self.starless_path, self.mask_path = paths
+        h, w = shape[:2]
+        self.starless = tiff.memmap(self.starless_path, shape = shape, dtype = dtype)
+        self.diff_file = tempfile.TemporaryFile(dir = work_dir)
+        self.diff = np.memmap(self.diff_file, dtype = 'float32', shape = (h, w))
+        self.diff_min, self.diff_max = np.float32(np.inf), np.float32(-np.inf)
+        self.blended_file = self.blended = None
+        if blend_channels:
+            self.blended_file = tempfile.TemporaryFile(dir = work_dir)
+            self.blended = np.memmap(self.blended_file, dtype = 'float32', shape = (h, w, blend_channels))
+            
+    def add_diff(self, region, diff):
+        self.diff[region] = diff
+        self.diff_min = min(self.diff_min, diff.min())
+        self.diff_max = max(self.diff_max, diff.max())
+        
+    def release(self):
+        for array in (self.starless, self.diff, self.blended):
+            if array is not None:
+                release(array)
+                
+    def encode(self, compression:str = None, web:bool = False):
+        """
+        Write the final outputs in one streaming pass, OUTPUT_TILE rows at a time:
+        the difference is normalized to [0,1] to get the star mask, and with
+        compression set the starless image is rewritten as a compressed tiled TIFF
+        (replacing the uncompressed one once complete). With web set, their PNG
+        renditions (see web_images.web_image) are written from the same rows;
+        float outputs have no fixed white level and get theirs on first view.
+        """
+        h, w = self.diff.shape
+        renditions = []
+        def bands(rows_at, source, channels):
+            png = None
+            if web and channels:
+                png = PngWriter(rendition_path(source), w, h, channels)
+                renditions.append(png)
+            for row in range(0, h, OUTPUT_TILE):
+                rows = rows_at(row)
+                if png is not None:
+                    png.write(to_8bit(rows))
+                yield rows
+                release(self.starless)
+                release(self.diff)
+        
+        def mask_rows(row):
+            rows = (self.diff[row:row+OUTPUT_TILE] - self.diff_min) / (self.diff_max - self.diff_min + 1e-8)
+            return (rows * 255).astype('uint8')
+        
+        starless_channels = (self.starless.shape[2] if self.starless.ndim == 3 else 1) if self.starless.dtype.kind == 'u' else 0
+        try:
+            starless = bands(lambda row: np.asarray(self.starless[row:row+OUTPUT_TILE]), self.starless_path, starless_channels)
+            if compression is None:
+                # Already written in place, only its rendition needs the rows
+                for _ in starless:
+                    pass
+                self.starless.flush()
+            else:
+                write_tiff(self.starless_path, starless, self.starless.shape, self.starless.dtype, compression)
+            write_tiff(self.mask_path, bands(mask_rows, self.mask_path, 1), (h, w), np.dtype('uint8'), compression)
+        except BaseException:
+            for png in renditions:
+                png.discard()
+            raise
+        # Renditions are completed last, so they are never older than their image
+        for png in renditions:
+            png.close()
+            
+    def close(self):
+        del self.starless, self.diff, self.blended
+        self.diff_file.close()
+        if self.blended_file is not None:
+            self.blended_file.close()
+
+def write_tiff(path:str, bands, shape, dtype, compression:str = None):
+    """
+    Write an image given as consecutive bands of OUTPUT_TILE rows to path: as a
+    tiled TIFF compressed with compression, written to a temporary name and
+    moved into place when complete, or as an uncompressed memory-mapped TIFF.
+    """
+    if compression is None:
+        out = tiff.memmap(path, shape = shape, dtype = dtype)
+        row = 0
+        for rows in bands:
+            out[row:row+len(rows)] = rows
+            row += len(rows)
+            release(out)
+        out.flush()
+        del out
+        return
+    
+    def tiles():
+        for rows in bands:
+            for column in range(0, shape[1], OUTPUT_TILE):
+                yield rows[:, column:column+OUTPUT_TILE]
+    partial = f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+    try:
+        tiff.imwrite(partial, tiles(), shape = shape, dtype = dtype, tile = (OUTPUT_TILE, OUTPUT_TILE),
+                     photometric = 'rgb' if len(shape) == 3 else 'minisblack', compression = compression,
+                     compressionargs = {'level': OUTPUT_COMPRESSION_LEVEL},
+                     # Horizontal differencing; the floating point predictor needs imagecodecs
+                     predictor = dtype.kind in 'ui')
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def star_score(tile):
+    """
+    How star-like the brightest feature of a [-1, 1] tile is: the largest
+    height of a pixel above the mean of its SCREEN_BLOCK_SIZE block, in
+    luminance on a [0, 1] scale. Smooth backgrounds, nebulosity and flat
+    padding score close to 0, stars score about their peak above the background.
+    """
+    lum = luminance((tile + 1) / 2)
+    b = SCREEN_BLOCK_SIZE
+    h, w = lum.shape[0] // b * b, lum.shape[1] // b * b
+    blocks = lum[:h, :w].reshape(h // b, b, w // b, b)
+    return float((blocks.max(axis = (1, 3)) - blocks.mean(axis = (1, 3))).max())
+
+class StandInGenerator:
+    """
+    Cheap deterministic stand-in for the generator, for load tests of the API
+    (see loadtest.py): no weights and no TensorFlow. Stars are "removed" with a
+    3 x 3 minimum filter, and a batch takes at least seconds_per_tile per tile
+    (sleeping, like an accelerator would let the CPU go) so the stand-in can
+    mimic the speed of a real deployment.
+    """
+    def __init__(self, seconds_per_tile:float = 0.0):
+        self.seconds_per_tile = seconds_per_tile
+        
+    def __call__(self, tiles):
+        start = time.perf_counter()
+        tiles = np.asarray(tiles, dtype = 'float32')
+        h, w = tiles.shape[1:3]
+        padded = np.pad(tiles, ((0, 0), (1, 1), (1, 1), (0, 0)), mode = 'edge')
+        output = tiles.copy()
+        for dy in range(3):
+            for dx in range(3):
+                np.minimum(output, padded[:, dy:dy + h, dx:dx + w], out = output)
+        remaining = self.seconds_per_tile * len(tiles) - (time.perf_counter() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+        return output
 
 class StarNet():
-    def __init__(self, mode:str, window_size:int = 512, stride:int = 256):
+    def __init__(self, mode:str, window_size:int = 512, stride:int = 256, batch_size = 1, skip_threshold:float = None,
+                 backend:str = 'float32', overlap:int = None):
         assert mode in ['RGB', 'Greyscale'], "Mode should be either RGB or Greyscale"
+        assert backend in BACKENDS, f"Backend should be one of {', '.join(BACKENDS)}"
+        assert batch_size == 'auto' or (isinstance(batch_size, int) and batch_size > 0), \
+            "Batch size should be a positive integer or 'auto'"
         self.mode = mode
         if self.mode == 'RGB': 
             self.input_channels = 3
@@ -23,128 +277,388 @@ class StarNet():
             self.input_channels = 1
         self.window_size = window_size
         self.stride = stride
+        self.batch_size = batch_size
+        # Fast mode: tiles whose star_score is below skip_threshold are passed
+        # through unchanged instead of running the generator on them
+        self.skip_threshold = skip_threshold
+        # Optional parallel.TilePool; when set, tile batches run in its worker processes
+        self.tile_pool = None
+        # Optional scheduler.BatchScheduler; when set, the tiles of concurrent
+        # transform calls share generator batches
+        self.scheduler = None
+        # Precision the generator runs in: float32, bfloat16 / float16 mixed precision
+        # (Keras), or a converted TFLite model (see export_tflite and load_tflite)
+        self.backend = backend
+        # Blend mode: windows overlap by this many pixels and are cross-faded (see
+        # tiling.BlendGrid) instead of keeping the central stride x stride of each.
+        # Needs far fewer generator calls; stride is not used.
+        self.overlap = overlap
+        # Compression of the output TIFFs, see OUTPUT_COMPRESSION
+        self.compression = OUTPUT_COMPRESSION
         
     def __str__(self):
         return "StarNet instance"
         
     def load_model(self, weights:str):
         """Load the generator model weights."""
-        self.G = self._generator(self.mode)
+        self.G = self._build_generator()
         
         try:
             self.G.load_weights(weights + '_G_' + self.mode + '.h5')
             print('Generator weights loaded successfully')
         except:
             raise ValueError('Could not load generator weights')
-            
-    def transform(self, in_name, out_name):
-        """Transform an image by removing stars and generate a mask of removed stars."""
-        # Use PIL to read the image, which supports multiple formats
+        
+        self.infer = self.G
+        
+    def init_random_weights(self, seed:int = 0):
+        """Build the generator with random (but reproducible) weights, for benchmarks and tests."""
+        tf.keras.utils.set_random_seed(seed)
+        self.G = self._build_generator()
+        self.infer = self.G
+        
+    def load_stand_in(self, seconds_per_tile:float = 0.0):
+        """Use a StandInGenerator instead of the generator, for load tests."""
+        self.G = None
+        self.infer = StandInGenerator(seconds_per_tile)
+        
+    def input_signature(self):
+        """Signature of the compiled generator: any number of window_size x window_size tiles."""
+        return [tf.TensorSpec([None, self.window_size, self.window_size, self.input_channels], tf.float32, name = "tiles")]
+        
+    def compile_model(self, jit_compile:bool = False):
+        """Run the generator as a compiled graph (optionally XLA-jitted) instead of eagerly.
+        
+        XLA may change results by a rounding step in the last bit of the output.
+        TFLite generators are already compiled and a stand-in has nothing to
+        compile, they are left as they are.
+        """
+        if self.backend in TFLITE_BACKENDS or isinstance(self.infer, StandInGenerator):
+            return
+        infer = self.infer
+        self.infer = tf.function(lambda tiles: infer(tiles), input_signature = self.input_signature(), jit_compile = jit_compile)
+        print('Generator compiled' + (' with XLA' if jit_compile else ''))
+        
+    def warmup(self):
+        """Trace the inference graph for the batch sizes transform uses so the first image doesn't pay for it."""
+        batch_sizes = {1, self.tile_batch_size(MAX_AUTO_BATCH_SIZE)}
+        for batch_size in sorted(batch_sizes):
+            self.infer(np.zeros((batch_size, self.window_size, self.window_size, self.input_channels), dtype = 'float32'))
+        print('Generator warmed up for batch sizes', sorted(batch_sizes))
+        
+    def export_saved_model(self, path:str):
+        """Export the generator as a SavedModel with a single 'serve' function."""
+        module = tf.Module()
+        module.G = self.G
+        module.serve = tf.function(lambda tiles: self.G(tiles, training = False), input_signature = self.input_signature())
+        tf.saved_model.save(module, path, signatures = {'serving_default': module.serve})
+        print(f'Generator exported to: {path}')
+        
+    def load_saved_model(self, path:str):
+        """Load a generator exported with export_saved_model, without rebuilding it in Python."""
         try:
-            pil_image = img.open(in_name)
-            data = np.array(pil_image)
+            self.saved_model = tf.saved_model.load(path)
         except Exception as e:
-            print(f"Error reading image with PIL: {e}")
-            # Fall back to tiff.imread for TIFF files
-            try:
-                data = tiff.imread(in_name)
-            except Exception as e:
-                print(f"Error reading image with tiff: {e}")
-                raise ValueError(f"Could not read image {in_name}. Please ensure it's a valid image file.")
+            raise ValueError(f'Could not load SavedModel from {path}: {e}')
+        self.infer = self.saved_model.serve
+        print('Generator SavedModel loaded successfully')
             
-        if len(data.shape) > 3:
-            layer = input("Image has %d layers, please enter layer to process: "%data.shape[0])
-            layer = int(layer)
-            data=data[layer]
-            
-        input_dtype = data.dtype
-        if input_dtype == 'uint16':
-            image = (data / 255.0 / 255.0).astype('float32')
-        elif input_dtype == 'uint8':
-            image = (data / 255.0).astype('float32')
+    def export_tflite(self, path:str, calibration_images:list = None):
+        """
+        Convert the loaded generator to a TFLite model with the quantization of the
+        tflite-* backend: float16 weights, dynamic-range (int8 weights, float
+        activations) or full int8. The int8 activation ranges are calibrated on tiles
+        of calibration_images (paths or arrays), which should look like the images
+        that will be processed.
+
+        The model takes one tile at a time: TFLite's transposed convolutions have a
+        fixed batch size.
+        """
+        quantization = TFLITE_BACKENDS[self.backend]
+        tiles = L.Input(batch_shape = (1, self.window_size, self.window_size, self.input_channels), name = "tiles")
+        converter = tf.lite.TFLiteConverter.from_keras_model(K.Model(tiles, self.G(tiles)))
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        if quantization == 'int8':
+            assert calibration_images, "int8 quantization needs calibration images"
+            calibration = self.calibration_tiles(calibration_images)
+            converter.representative_dataset = lambda: ([tile[None]] for tile in calibration)
+            # The debugger is the converter's way to leave selected ops in float
+            debugger = tf.lite.experimental.QuantizationDebugger(
+                converter = converter, debug_dataset = converter.representative_dataset,
+                debug_options = tf.lite.experimental.QuantizationDebugOptions(denylisted_ops = TFLITE_INT8_FLOAT_OPS))
+            model = debugger.get_nondebug_quantized_model()
         else:
-            raise ValueError('Unknown image dtype:', data.dtype)
+            model = converter.convert()
+        with open(path, 'wb') as f:
+            f.write(model)
+        print(f'Generator converted to TFLite ({quantization}): {path}')
+        
+    def load_tflite(self, path:str, num_threads:int = None):
+        """Run the generator with a TFLite model written by export_tflite."""
+        from tflite_backend import TFLiteGenerator
+        try:
+            self.infer = TFLiteGenerator(path, num_threads = num_threads)
+        except Exception as e:
+            raise ValueError(f'Could not load TFLite model from {path}: {e}')
+        print(f'Generator TFLite model loaded successfully ({self.infer.interpreter_name})')
+        
+    def calibration_tiles(self, images:list, n_tiles:int = TFLITE_CALIBRATION_TILES):
+        """Up to n_tiles tiles, spread evenly over the tile grids of images (paths or arrays)."""
+        tiles = []
+        for image in images:
+            data = image_layers(read_image(image) if isinstance(image, str) else image, self.mode == 'RGB')[0]
+            low, high = (0.0, 1.0) if str(data.dtype) in TO_FLOAT else sample_range([data])
+            grid = TileGrid(data.shape[0], data.shape[1], self.window_size, self.stride)
+            coords = grid.tiles()
+            step = max(1, len(coords) * len(images) // n_tiles)
+            tiles += [self._read_tile(grid, data, unit_scale(data.dtype, low, high), x, y) for x, y in coords[::step]]
+        return tiles[:n_tiles]
             
-        if self.mode == 'Greyscale' and len(image.shape) == 3:
-            raise ValueError('You loaded Greyscale model, but the image is RGB!')
+    def tile_batch_size(self, n_tiles:int) -> int:
+        """Number of tiles to run through the generator in one call."""
+        if self.batch_size != 'auto':
+            return min(self.batch_size, n_tiles)
+        available = available_memory()
+        if available is None:
+            return 1
+        # Leave half of the free memory to the rest of the process
+        tile_bytes = self.window_size * self.window_size * TILE_BYTES_PER_PIXEL
+        batch_size = available // 2 // tile_bytes
+        return int(max(1, min(batch_size, MAX_AUTO_BATCH_SIZE, n_tiles)))
             
-        if self.mode == 'Greyscale':
-            image = image[:, :, None]
+    def transform(self, in_name, out_name, progress = None, layers:list = None, web:bool = False):
+        """
+        Transform an image by removing stars and generate a mask of removed stars.
         
-        if self.mode == 'RGB' and len(image.shape) == 2:
-            raise ValueError('You loaded RGB model, but the image is Greyscale!')
+        The image is processed tile by tile: windows are read lazily from the
+        (memory-mapped where possible) input, the starless image is written
+        straight into a memory-mapped output TIFF and the luminance difference
+        into a temporary file, so memory use is bounded by the tile batch rather
+        than by the size of the image. A final streaming pass writes the star mask
+        and the compressed outputs (see LayerOutputs.encode), and with web set
+        their PNG renditions.
         
-        if self.mode == 'RGB' and image.shape[2] == 4:
-            print("Input image has 4 channels. Removing Alpha-Channel")
-            image=image[:,:,[0,1,2]]
+        Multi-layer images (FITS cubes, TIFF stacks; see tiling.image_layers) are
+        processed in one pass: the tiles of all layers, or of the indices in layers,
+        are batched through the generator together, and every layer gets its own
+        outputs, named by output_paths(out_name, layer). 8 and 16-bit images give
+        outputs of the same dtype, 32-bit and float images float32 outputs in the
+        range of their samples.
         
-        offset = int((self.window_size - self.stride) / 2)
+        progress, if given, is called with a dict of the current stage, tiles_done,
+        tiles_skipped (fast mode), tiles_total and stage_seconds at the start of
+        every stage (decode, pad, infer, blend in blend mode, encode, then
+        done) and after every
+        tile batch, when it also holds the size of the batch and the seconds the
+        generator took on it (batch_tiles, batch_seconds), or the number of tiles
+        passed through without running the generator (batch_skipped).
+        in_name may also be an image already opened with tiling.read_image, e.g.
+        decoded ahead of time while another image was being processed.
+        Returns the seconds spent in each stage.
+        """
+        timer = StageTimer()
+        tiles = []
+        tiles_done = tiles_skipped = 0
+        def report(stage:str, **batch):
+            if stage == "done":
+                timer.stop()
+            elif stage != timer.stage:
+                timer.start(stage)
+            if progress is not None:
+                progress({"stage": stage, "tiles_done": tiles_done, "tiles_skipped": tiles_skipped,
+                          "tiles_total": len(tiles), "stage_seconds": timer.elapsed(), **batch})
         
-        h, w, _ = image.shape
-        
-        ith = int(h / self.stride) + 1
-        itw = int(w / self.stride) + 1
+        report("decode")
+        data = read_image(in_name) if isinstance(in_name, (str, os.PathLike)) else in_name
+        sources = image_layers(data, self.mode == 'RGB')
+        multi_layer = len(sources) > 1
+        if layers is None:
+            layers = range(len(sources))
+        for layer in layers:
+            if not 0 <= layer < len(sources):
+                raise ValueError(f'Image has {len(sources)} layers, there is no layer {layer}')
+        sources = {layer: sources[layer] for layer in layers}
+        first = next(iter(sources.values()))
+            
+        input_dtype = first.dtype
+        if input_dtype.kind not in 'uif':
+            raise ValueError('Unknown image dtype:', first.dtype)
+        # 32-bit and float samples are scaled by their range, 8 and 16-bit ones by their type
+        low, high = (0.0, 1.0) if str(input_dtype) in TO_FLOAT else sample_range(sources.values())
+        to_float = unit_scale(input_dtype, low, high)
+        output_dtype, from_float = output_scale(input_dtype, low, high)
+            
+        if self.mode == 'Greyscale' and len(first.shape) == 3:
+            raise ValueError('You loaded Greyscale model, but the image is RGB!')
         
-        dh = ith * self.stride - h
-        dw = itw * self.stride - w
+        if self.mode == 'RGB' and len(first.shape) == 2:
+            raise ValueError('You loaded RGB model, but the image is Greyscale!')
         
-        image = np.concatenate((image, image[(h - dh) :, :, :]), axis = 0)
-        image = np.concatenate((image, image[:, (w - dw) :, :]), axis = 1)
+        if self.mode == 'RGB' and first.shape[2] == 4:
+            print("Input image has 4 channels. Removing Alpha-Channel")
         
-        h, w, _ = image.shape
-        image = np.concatenate((image, image[(h - offset) :, :, :]), axis = 0)
-        image = np.concatenate((image[: offset, :, :], image), axis = 0)
-        image = np.concatenate((image, image[:, (w - offset) :, :]), axis = 1)
-        image = np.concatenate((image[:, : offset, :], image), axis = 1)
+        # Lay out the (virtually padded) tile grid and allocate the outputs
+        report("pad")
+        h, w = first.shape[:2]
+        if self.overlap:
+            grid = BlendGrid(h, w, self.window_size, self.overlap)
+        else:
+            grid = TileGrid(h, w, self.window_size, self.stride)
         
-        image = image * 2 - 1
+        out_shape = (h, w, 3) if self.mode == 'RGB' else (h, w)
+        work_dir = os.path.dirname(os.path.abspath(out_name))
+        outputs = {layer: LayerOutputs(output_paths(out_name, layer if multi_layer else None), out_shape, output_dtype,
+                                       self.input_channels if self.overlap else None, work_dir)
+                   for layer in sources}
         
-        output = copy.deepcopy(image)
+        tiles = [(layer, x, y) for layer in sources for x, y in grid.tiles()]
+        if self.tile_pool is not None:
+            batch_size = min(self.tile_pool.batch_size, len(tiles))
+        else:
+            batch_size = self.tile_batch_size(len(tiles))
+        released_row = (-1, 0)
+        report("infer")
         
-        for i in range(ith):
-            for j in range(itw):
-                x = self.stride * i
-                y = self.stride * j
+        # Gather batch_size tiles, run them through the generator in one call and
+        # scatter the central stride x stride region of each result back
+        for coords, batch, result, batch_seconds in self._tile_results(grid, sources, to_float, tiles, batch_size):
+            for (layer, x, y), tile, output in zip(coords, batch, result):
+                out, win = grid.cell(x, y)
+                layer_out = outputs[layer]
+                if self.overlap:
+                    layer_out.blended[out] += np.clip(output[win], 0, 1) * grid.weights(x, y)[win][:, :, None]
+                    continue
+                output = np.clip(output[win], 0, 1)
+                original = (tile[win] + 1) / 2
                 
-                tile = np.expand_dims(image[x:x+self.window_size, y:y+self.window_size, :], axis = 0)
-                tile = (self.G(tile)[0] + 1) / 2
-                tile = tile[offset:offset+self.stride, offset:offset+self.stride, :]
-                output[x+offset:self.stride*(i+1)+offset, y+offset:self.stride*(j+1)+offset, :] = tile
+                # Difference in luminance between the original and starless image
+                layer_out.add_diff(out, np.abs(luminance(original) - luminance(output)))
+                layer_out.starless[out] = from_float(self._output_channels(output))
+            
+            # Once a row of tiles is done, drop the pages it touched
+            # (batches from a tile pool can complete slightly out of order)
+            if coords[-1][:2] > released_row:
+                released_row = coords[-1][:2]
+                for layer in sources:
+                    release(sources[layer])
+                    outputs[layer].release()
+            tiles_done += len(coords)
+            if batch_seconds is None:
+                tiles_skipped += len(coords)
+                report("infer", batch_skipped = len(coords))
+            else:
+                report("infer", batch_tiles = len(coords), batch_seconds = batch_seconds)
+            
+        if self.overlap:
+            # Finish the starless image and the luminance difference, a band of rows at a time
+            report("blend")
+            for layer, source in sources.items():
+                layer_out = outputs[layer]
+                for row in range(0, h, self.window_size):
+                    rows = slice(row, row + self.window_size)
+                    output = np.clip(layer_out.blended[rows], 0, 1)
+                    original = source[rows][:, :, None] if self.mode == 'Greyscale' else source[rows][:, :, :3]
+                    layer_out.add_diff(rows, np.abs(luminance(to_float(original)) - luminance(output)))
+                    layer_out.starless[rows] = from_float(self._output_channels(output))
+                    release(source)
+                    layer_out.release()
+            
+        # Write the star mask and the final outputs in one pass
+        report("encode")
+        for layer_out in outputs.values():
+            layer_out.encode(self.compression, web)
+            layer_out.close()
+            print(f"Saved starless image to: {layer_out.starless_path}")
+            print(f"Saved star mask to: {layer_out.mask_path}")
+        if self.skip_threshold is not None:
+            print(f"Skipped {tiles_skipped} of {len(tiles)} tiles without stars")
+        report("done")
+        return timer.seconds
         
-        output = np.clip(output, 0, 1)
+    def infer_batches(self, batches):
+        """
+        Run (coords, tiles) batches through the generator and yield (coords, tiles, result,
+        seconds) with the result scaled to [0, 1] and the seconds the generator took.
+        With a tile_pool the batches run in parallel in its worker processes and are
+        yielded as they complete; with a scheduler their tiles are batched with
+        those of other transform calls running at the same time.
+        """
+        if self.tile_pool is not None:
+            yield from self.tile_pool.imap(batches)
+            return
+        if self.scheduler is not None:
+            yield from self.scheduler.imap(batches)
+            return
+        for coords, batch in batches:
+            start = time.perf_counter()
+            result = (np.asarray(self.infer(batch)) + 1) / 2
+            yield coords, batch, result, time.perf_counter() - start
         
-        if self.mode == 'Greyscale':
-            output = output[offset:-(offset+dh), offset:-(offset+dw), 0]
-        else:
-            output = output[offset:-(offset+dh), offset:-(offset+dw), :]
-            
-        # Create a mask of the stars by comparing the original and starless images
-        # First, get the original image without padding and rescale back from [-1,1] to [0,1]
-        original = (image[offset:-(offset+dh), offset:-(offset+dw), :] + 1) / 2
+    def _tile_results(self, grid, sources, to_float, tiles, batch_size:int):
+        """
+        Read the (layer, x, y) tiles of sources (layer -> image) in batches and yield
+        (coords, tiles, result, seconds) for them like infer_batches. In fast mode, tiles without stars are yielded on their
+        own with the input as result and seconds None, and only the others are
+        batched for the generator.
+        """
+        if self.skip_threshold is None:
+            batches = ((coords, np.stack([self._read_tile(grid, sources[layer], to_float, x, y) for layer, x, y in coords]))
+                       for coords in (tiles[start:start+batch_size] for start in range(0, len(tiles), batch_size)))
+            yield from self.infer_batches(batches)
+            return
+        
+        # Only the coordinates of skipped tiles are kept, they are read again when
+        # written out so a long run of empty sky doesn't pile up in memory
+        skipped = deque()
+        def screened_batches():
+            coords, batch = [], []
+            for layer, x, y in tiles:
+                tile = self._read_tile(grid, sources[layer], to_float, x, y)
+                if star_score(tile) < self.skip_threshold:
+                    skipped.append((layer, x, y))
+                    continue
+                coords.append((layer, x, y))
+                batch.append(tile)
+                if len(batch) == batch_size:
+                    yield coords, np.stack(batch)
+                    coords, batch = [], []
+            if batch:
+                yield coords, np.stack(batch)
         
-        # Calculate the luminance of both images (0.299R + 0.587G + 0.114B)
-        original_lum = 0.299 * original[:,:,0] + 0.587 * original[:,:,1] + 0.114 * original[:,:,2]
-        output_lum = 0.299 * output[:,:,0] + 0.587 * output[:,:,1] + 0.114 * output[:,:,2]
+        def passed_through():
+            while skipped:
+                layer, x, y = skipped.popleft()
+                tile = self._read_tile(grid, sources[layer], to_float, x, y)[None]
+                yield [(layer, x, y)], tile, (tile + 1) / 2, None
         
-        # Calculate the difference in luminance
-        mask = np.abs(original_lum - output_lum)
+        for item in self.infer_batches(screened_batches()):
+            yield from passed_through()
+            yield item
+        yield from passed_through()
         
-        # Normalize the difference to [0,1]
-        mask = (mask - mask.min()) / (mask.max() - mask.min() + 1e-8)
+    def _output_channels(self, output):
+        """A block of generator output in the channel layout of the starless image."""
+        return output[:, :, 0] if self.mode == 'Greyscale' else output
         
-        # Save the starless image
-        if input_dtype == 'uint8':
-            tiff.imwrite(out_name, (output * 255).astype('uint8'))
+    def _read_tile(self, grid, data, to_float, x:int, y:int):
+        """Read one window of the input, scaled to [-1, 1] float32 with input_channels channels."""
+        tile = grid.window(data, x, y)
+        if self.mode == 'Greyscale':
+            tile = tile[:, :, None]
         else:
-            tiff.imwrite(out_name, (output * 255 * 255).astype('uint16'))
-            
-        # Save the star mask
-        base_name, ext = os.path.splitext(out_name)
-        mask_filename = f"{base_name}_mask{ext}"
-        tiff.imwrite(mask_filename, (mask * 255).astype('uint8'))
+            tile = tile[:, :, :3]
+        return to_float(tile) * 2 - 1
         
-        print(f"Saved starless image to: {out_name}")
-        print(f"Saved star mask to: {mask_filename}")
+    def _build_generator(self):
+        """The Keras generator in the backend's precision (float32 for the TFLite backends, they are converted from it)."""
+        previous = K.mixed_precision.global_policy()
+        K.mixed_precision.set_global_policy(KERAS_BACKENDS.get(self.backend, 'float32'))
+        try:
+            return self._generator(self.mode)
+        finally:
+            K.mixed_precision.set_global_policy(previous)
         
     def _generator(self, m):
         layers = []
@@ -160,91 +674,91 @@ class StarNet():
         # layer 1
         rectified = L.LeakyReLU(alpha = 0.2)(layers[-1])
         convolved = L.Conv2D(filters[1], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(convolved, training = True)
+        normalized = TileBatchNormalization()(convolved)
         layers.append(normalized)
             
         # layer 2
         rectified = L.LeakyReLU(alpha = 0.2)(layers[-1])
         convolved = L.Conv2D(filters[2], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(convolved, training = True)
+        normalized = TileBatchNormalization()(convolved)
         layers.append(normalized)
             
         # layer 3
         rectified = L.LeakyReLU(alpha = 0.2)(layers[-1])
         convolved = L.Conv2D(filters[3], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(convolved, training = True)
+        normalized = TileBatchNormalization()(convolved)
         layers.append(normalized)
             
         # layer 4
         rectified = L.LeakyReLU(alpha = 0.2)(layers[-1])
         convolved = L.Conv2D(filters[4], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(convolved, training = True)
+        normalized = TileBatchNormalization()(convolved)
         layers.append(normalized)
             
         # layer 5
         rectified = L.LeakyReLU(alpha = 0.2)(layers[-1])
         convolved = L.Conv2D(filters[5], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(convolved, training = True)
+        normalized = TileBatchNormalization()(convolved)
         layers.append(normalized)
         
         # layer 6
         rectified = L.LeakyReLU(alpha = 0.2)(layers[-1])
         convolved = L.Conv2D(filters[6], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(convolved, training = True)
+        normalized = TileBatchNormalization()(convolved)
         layers.append(normalized)
         
         # layer 7
         rectified = L.LeakyReLU(alpha = 0.2)(layers[-1])
         convolved = L.Conv2D(filters[7], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(convolved, training = True)
+        normalized = TileBatchNormalization()(convolved)
         layers.append(normalized)
         
         # layer 8
         rectified = L.ReLU()(layers[-1])
         deconvolved = L.Conv2DTranspose(filters[8], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(deconvolved, training = True)
+        normalized = TileBatchNormalization()(deconvolved)
         layers.append(normalized)
             
         # layer 9
         concatenated = L.Concatenate(axis=3)([layers[-1], layers[6]])
         rectified = L.ReLU()(concatenated)
         deconvolved = L.Conv2DTranspose(filters[9], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(deconvolved, training = True)
+        normalized = TileBatchNormalization()(deconvolved)
         layers.append(normalized)
         
         # layer 10
         concatenated = L.Concatenate(axis=3)([layers[-1], layers[5]])
         rectified = L.ReLU()(concatenated)
         deconvolved = L.Conv2DTranspose(filters[10], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(deconvolved, training = True)
+        normalized = TileBatchNormalization()(deconvolved)
         layers.append(normalized)
             
         # layer 11
         concatenated = L.Concatenate(axis=3)([layers[-1], layers[4]])
         rectified = L.ReLU()(concatenated)
         deconvolved = L.Conv2DTranspose(filters[11], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(deconvolved, training = True)
+        normalized = TileBatchNormalization()(deconvolved)
         layers.append(normalized)
             
         # layer 12
         concatenated = L.Concatenate(axis=3)([layers[-1], layers[3]])
         rectified = L.ReLU()(concatenated)
         deconvolved = L.Conv2DTranspose(filters[12], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(deconvolved, training = True)
+        normalized = TileBatchNormalization()(deconvolved)
         layers.append(normalized)
             
         # layer 13
         concatenated = L.Concatenate(axis=3)([layers[-1], layers[2]])
         rectified = L.ReLU()(concatenated)
         deconvolved = L.Conv2DTranspose(filters[13], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(deconvolved, training = True)
+        normalized = TileBatchNormalization()(deconvolved)
         layers.append(normalized)
             
         # layer 14
         concatenated = L.Concatenate(axis=3)([layers[-1], layers[1]])
         rectified = L.ReLU()(concatenated)
         deconvolved = L.Conv2DTranspose(filters[14], kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
-        normalized = L.BatchNormalization()(deconvolved, training = True)
+        normalized = TileBatchNormalization()(deconvolved)
         layers.append(normalized)
             
         # layer 15
@@ -252,6 +766,7 @@ class StarNet():
         rectified = L.ReLU()(concatenated)
         deconvolved = L.Conv2DTranspose(self.input_channels, kernel_size = 4, strides = (2, 2), padding = "same", kernel_initializer = tf.initializers.GlorotUniform())(rectified)
         rectified = L.ReLU()(deconvolved)
-        output = SubtractLayer()([input, rectified])
+        # The output is the input minus the stars, always in float32
+        output = SubtractLayer(dtype = 'float32')([input, rectified])
         
         return K.Model(inputs = input, outputs = output, name = "generator")
\ No newline at end of file
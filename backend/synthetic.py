@@ -0,0 +1,24 @@
+import numpy as np
+
+def star_field(size:int, dtype:str, mode:str, seed:int = 0, n_stars:int = None):
+    """
+    Synthetic size x size star field: a smooth nebula-like background with
+    Gaussian stars of random position, width and brightness.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype('float32') / size
+    image = 0.15 + 0.1 * np.sin(6 * xx + 3 * yy) * np.cos(4 * yy - 2 * xx)
+    n_stars = n_stars or size * size // 2000
+    for x, y, sigma, peak in zip(rng.uniform(0, size, n_stars), rng.uniform(0, size, n_stars),
+                                 rng.uniform(0.7, 3, n_stars), rng.uniform(0.3, 1, n_stars)):
+        r = int(4 * sigma) + 1
+        x0, x1 = max(0, int(x) - r), min(size, int(x) + r + 1)
+        y0, y1 = max(0, int(y) - r), min(size, int(y) + r + 1)
+        dy, dx = np.arange(y0, y1)[:, None] - y, np.arange(x0, x1)[None, :] - x
+        image[y0:y1, x0:x1] += peak * np.exp(-(dx * dx + dy * dy) / (2 * sigma * sigma))
+    image = np.clip(image, 0, 1)
+    if mode == 'RGB':
+        tint = rng.uniform(0.85, 1.0, 3).astype('float32')
+        image = image[:, :, None] * tint
+    scale = 255 if dtype == 'uint8' else 65535
+    return (image * scale).astype(dtype)
@@ -0,0 +1,20 @@
+import threading
+import time
+from cache import ResultCache
+
+def test_key_locks_are_dropped_when_released(tmp_path):
+    cache = ResultCache(None, tmp_path)
+    order = []
+    def process(name):
+        with cache.lock("a"):
+            order.append(name)
+            time.sleep(0.05)
+            order.append(name)
+    threads = [threading.Thread(target=process, args=(name,)) for name in "xyz"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Holders of a key never overlap, and nothing is left once they are done
+    assert all(order[i] == order[i + 1] for i in range(0, len(order), 2))
+    assert cache._locks == {}
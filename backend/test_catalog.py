@@ -0,0 +1,21 @@
+import json
+import numpy as np
+import tifffile as tiff
+import catalog
+
+def test_downsampled_mask_with_odd_height(tmp_path, monkeypatch):
+    # 1501 x 1000 pools by a factor of 3, leaving a last row that doesn't fill a block
+    monkeypatch.setattr(catalog, "MAX_PIXELS", 500 * 500)
+    mask = np.zeros((1501, 1000), dtype='uint8')
+    mask[590:611, 290:311] = 150
+    mask[600, 300] = 255
+    tiff.imwrite(tmp_path / "out_mask.tif", mask)
+    tiff.imwrite(tmp_path / "in.tif", np.full((1501, 1000, 3), 128, dtype='uint8'))
+
+    path = catalog.build_catalog(tmp_path / "out_mask.tif", tmp_path / "in.tif")
+    with open(path) as f:
+        result = json.load(f)
+    assert (result["width"], result["height"]) == (1000, 1501)
+    assert len(result["stars"]) == 1
+    star = dict(zip(result["fields"], result["stars"][0]))
+    assert abs(star["x"] - 300) < 3 and abs(star["y"] - 600) < 3
@@ -0,0 +1,21 @@
+import threading
+import numpy as np
+from parallel import TilePool
+
+def test_concurrent_callers_share_the_pool():
+    # One worker has two slots; each caller may take both, so they must not wait on each other
+    pool = TilePool({"mode": "Greyscale", "window_size": 16}, {"stand_in": 0}, workers=1, batch_size=2)
+    pool.start()
+    try:
+        tiles = np.zeros((2, 16, 16, 1), dtype='float32')
+        done = {}
+        def run(name):
+            done[name] = sum(1 for _ in pool.imap((i, tiles) for i in range(40)))
+        threads = [threading.Thread(target=run, args=(name,), daemon=True) for name in "ab"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+        assert done == {"a": 40, "b": 40}
+    finally:
+        pool.close()
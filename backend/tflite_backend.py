@@ -0,0 +1,48 @@
+import threading
+import numpy as np
+import os
+
+def load_interpreter(path:str, num_threads:int = None):
+    """
+    A TFLite interpreter for the model at path, from the lightest runtime that is
+    installed: LiteRT (ai-edge-litert), then tflite-runtime, then the one bundled
+    with TensorFlow. Returns the interpreter and the name of its package.
+    """
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        name = 'ai-edge-litert'
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+            name = 'tflite-runtime'
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+            name = 'tensorflow'
+    interpreter = Interpreter(model_path = path, num_threads = num_threads or os.cpu_count() or 1)
+    interpreter.allocate_tensors()
+    return interpreter, name
+
+class TFLiteGenerator:
+    """
+    Runs a generator converted with StarNet.export_tflite like the Keras one:
+    called with a batch of [-1, 1] tiles, returns the batch of outputs.
+
+    The converted model takes one tile at a time, so batches are run tile by tile.
+    An interpreter isn't thread-safe; calls from several threads take turns.
+    """
+    def __init__(self, path:str, num_threads:int = None):
+        self.interpreter, self.interpreter_name = load_interpreter(path, num_threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self._lock = threading.Lock()
+
+    def __call__(self, tiles):
+        tiles = np.asarray(tiles, dtype = 'float32')
+        result = np.empty(tiles.shape[:3] + (self.output['shape'][-1],), dtype = 'float32')
+        with self._lock:
+            for i, tile in enumerate(tiles):
+                self.interpreter.set_tensor(self.input['index'], tile[None])
+                self.interpreter.invoke()
+                result[i] = self.interpreter.get_tensor(self.output['index'])[0]
+        return result
@@ -0,0 +1,322 @@
+from PIL import Image as img
+from pathlib import Path
+import numpy as np
+import tifffile as tiff
+import mmap
+
+# uint8 / uint16 sample -> float32 in [0, 1], computed exactly like the
+# original `(data / 255.0).astype('float32')` so results stay bit-identical
+# without ever materialising a float64 copy of the image
+TO_FLOAT = {
+    'uint8': (np.arange(2 ** 8) / 255.0).astype('float32'),
+    'uint16': (np.arange(2 ** 16) / 255.0 / 255.0).astype('float32'),
+}
+
+FITS_SUFFIXES = ('.fits', '.fit', '.fts')
+
+def unit_scale(dtype, low:float = 0.0, high:float = 1.0):
+    """
+    Function mapping samples of the given dtype to float32 in [0, 1]: through
+    TO_FLOAT for 8 and 16-bit images, linearly from [low, high] for anything
+    else (32-bit and float data, see sample_range). Blank (NaN) samples map to 0.
+    """
+    if str(dtype) in TO_FLOAT:
+        lut = TO_FLOAT[str(dtype)]
+        return lambda samples: lut[samples]
+    scale = np.float32(1 / (high - low)) if high > low else np.float32(1)
+    return lambda samples: np.nan_to_num((np.asarray(samples, dtype='float32') - np.float32(low)) * scale)
+
+def output_scale(dtype, low:float = 0.0, high:float = 1.0):
+    """
+    The dtype of the starless image of an image with samples of the given dtype,
+    and the function converting [0, 1] float values to it (the inverse of
+    unit_scale). 32-bit and float images give float32 outputs in their own range.
+    """
+    if str(dtype) == 'uint8':
+        return np.dtype('uint8'), lambda values: (values * 255).astype('uint8')
+    if str(dtype) == 'uint16':
+        return np.dtype('uint16'), lambda values: (values * 255 * 255).astype('uint16')
+    return np.dtype('float32'), lambda values: (values * np.float32(high - low) + np.float32(low)).astype('float32')
+
+def sample_range(layers, band:int = 256):
+    """
+    Range of the samples of images that aren't 8 or 16-bit, read a band of rows
+    at a time: (min, max) widened to include [0, 1], so data that is already
+    normalized keeps its scale.
+    """
+    low, high = 0.0, 1.0
+    for layer in layers:
+        for row in range(0, layer.shape[0], band):
+            samples = np.asarray(layer[row:row+band], dtype='float32')
+            if np.isfinite(samples).any():
+                low = min(low, float(np.nanmin(samples)))
+                high = max(high, float(np.nanmax(samples)))
+    return low, high
+
+class FitsData:
+    """
+    Lazily scaled view of the memory-mapped data of a FITS image.
+
+    Indexing reads only the requested region from disk and applies BSCALE and
+    BZERO. Samples come out as uint8 or uint16 when the scaled values are
+    (e.g. 16-bit data stored as signed integers with BZERO = 32768) and as
+    float32 otherwise. FITS rows run bottom to top; they are flipped so outputs
+    and previews are the right way up.
+    """
+    def __init__(self, raw, bscale:float = 1, bzero:float = 0):
+        self.raw = raw
+        self.bscale = bscale
+        self.bzero = bzero
+        if bscale == 1 and bzero == 0 and raw.dtype.kind == 'u' and raw.dtype.itemsize == 1:
+            self.dtype = np.dtype('uint8')
+        elif bscale == 1 and bzero == 32768 and raw.dtype.kind == 'i' and raw.dtype.itemsize == 2:
+            self.dtype = np.dtype('uint16')
+        else:
+            self.dtype = np.dtype('float32')
+
+    @classmethod
+    def open(cls, path):
+        from astropy.io import fits
+        # Scaling is applied per region on access, scaling on open would read the whole file
+        with fits.open(path, memmap=True, do_not_scale_image_data=True) as hdus:
+            for hdu in hdus:
+                if hdu.is_image and hdu.data is not None:
+                    return cls(hdu.data[..., ::-1, :], hdu.header.get('BSCALE', 1), hdu.header.get('BZERO', 0))
+        raise ValueError(f"No image data in FITS file {path}")
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def ndim(self):
+        return self.raw.ndim
+
+    @property
+    def _mmap(self):
+        # Lets release() drop the pages of the underlying file
+        base = self.raw
+        while isinstance(base, np.ndarray):
+            base = base.base
+        return base if isinstance(base, mmap.mmap) else None
+
+    def view(self, index):
+        """A lazily scaled view of part of the data, e.g. one layer of a cube."""
+        return FitsData(self.raw[index], self.bscale, self.bzero)
+
+    def transpose(self, *axes):
+        return FitsData(self.raw.transpose(*axes), self.bscale, self.bzero)
+
+    def __getitem__(self, index):
+        raw = np.asarray(self.raw[index])
+        if self.dtype == 'uint8':
+            return raw.astype('uint8')
+        if self.dtype == 'uint16':
+            return (raw.astype('int32') + 32768).astype('uint16')
+        return raw.astype('float32') * np.float32(self.bscale) + np.float32(self.bzero)
+
+def is_fits(in_name) -> bool:
+    if Path(str(in_name)).suffix.lower() in FITS_SUFFIXES:
+        return True
+    try:
+        with open(in_name, 'rb') as f:
+            return f.read(9) == b'SIMPLE  ='
+    except OSError:
+        return False
+
+def image_layers(data, rgb:bool) -> list:
+    """
+    Split an image into the layers StarNet processes one by one: h x w (x channels)
+    arrays, views of data where possible.
+
+    FITS cubes are stored layer first: in RGB mode a 3 x h x w cube is one colour
+    image and an n x 3 x h x w cube n colour layers; otherwise every plane is a
+    layer. Other formats are channels last, with an n x h x w x c stack holding
+    n layers.
+    """
+    if isinstance(data, FitsData):
+        if data.ndim == 2:
+            return [data]
+        if rgb and data.ndim == 3 and data.shape[0] == 3:
+            return [data.transpose(1, 2, 0)]
+        if rgb and data.ndim == 4 and data.shape[1] == 3:
+            return [data.view(i).transpose(1, 2, 0) for i in range(data.shape[0])]
+        return [data.view(index) for index in np.ndindex(data.shape[:-2])]
+    if data.ndim > 3:
+        return [data[i] for i in range(data.shape[0])]
+    return [data]
+
+def read_image(in_name):
+    """
+    Open an image for region-wise reading.
+    Uncompressed TIFFs and FITS files are memory-mapped so only the regions that
+    are read get loaded; other formats are decoded once, at their native integer dtype.
+    """
+    if is_fits(in_name):
+        return FitsData.open(in_name)
+    try:
+        return tiff.memmap(in_name, mode='r')
+    except Exception:
+        pass
+
+    # Use PIL to read the image, which supports multiple formats
+    try:
+        with img.open(in_name) as pil_image:
+            return np.array(pil_image)
+    except Exception as e:
+        print(f"Error reading image with PIL: {e}")
+
+    # Fall back to tiff.imread for compressed TIFF files PIL can't decode
+    try:
+        return tiff.imread(in_name)
+    except Exception as e:
+        print(f"Error reading image with tiff: {e}")
+        raise ValueError(f"Could not read image {in_name}. Please ensure it's a valid image file.")
+
+def release(array):
+    """
+    Flush a memory-mapped array and drop its pages from memory.
+    Pages that were already read or written otherwise keep counting against
+    the process RSS until the kernel gets around to reclaiming them.
+    """
+    mapping = getattr(array, '_mmap', None)
+    if mapping is None:
+        return
+    if isinstance(array, np.memmap) and array.flags.writeable:
+        array.flush()
+    if hasattr(mmap, 'MADV_DONTNEED'):
+        mapping.madvise(mmap.MADV_DONTNEED)
+
+def padded_index(n:int, stride:int, offset:int):
+    """
+    Source row (or column) of every row of the padded canvas StarNet tiles over.
+
+    The last rows are repeated to round n up to a multiple of stride plus one,
+    then `offset` rows are repeated on either side, as the original in-memory
+    padding did with np.concatenate. Images smaller than the padding repeat
+    their first row instead of producing a canvas of the wrong size.
+    """
+    count = int(n / stride) + 1
+    dn = count * stride - n
+    index = np.arange(n)
+    index = np.concatenate((index, np.arange(n - dn, n).clip(0)))
+    index = np.concatenate((index[: offset], index, index[len(index) - offset :]))
+    return index
+
+class TileGrid:
+    """
+    Tile layout for an h x w image.
+
+    Windows of window_size x window_size are read every `stride` pixels from a
+    virtual padded canvas, and only their central stride x stride cell is kept.
+    The canvas is never built: windows are gathered from the source image
+    through padded_index.
+    """
+    def __init__(self, h:int, w:int, window_size:int, stride:int):
+        self.h = h
+        self.w = w
+        self.window_size = window_size
+        self.stride = stride
+        self.offset = int((window_size - stride) / 2)
+        self.rows = padded_index(h, stride, self.offset)
+        self.cols = padded_index(w, stride, self.offset)
+        self.ith = int(h / stride) + 1
+        self.itw = int(w / stride) + 1
+
+    def tiles(self):
+        """
+        Top-left corner of every window on the padded canvas, row by row.
+        When h or w is a multiple of stride the last row or column of windows
+        lies entirely in the padding and is left out.
+        """
+        return [(x, y) for x in range(0, self.ith * self.stride, self.stride) if x < self.h
+                       for y in range(0, self.itw * self.stride, self.stride) if y < self.w]
+
+    def window(self, data, x:int, y:int):
+        """Read the window at (x, y) from the unpadded source image."""
+        rows = self.rows[x:x+self.window_size]
+        cols = self.cols[y:y+self.window_size]
+        return data[np.ix_(rows, cols)]
+
+    def cell(self, x:int, y:int):
+        """
+        The part of the window at (x, y) that ends up in the output, as a pair of
+        (output region, window region) slice tuples. Cells overhanging the bottom
+        or right edge of the image are cropped.
+        """
+        rows = min(self.stride, self.h - x)
+        cols = min(self.stride, self.w - y)
+        out = (slice(x, x + rows), slice(y, y + cols))
+        win = (slice(self.offset, self.offset + rows), slice(self.offset, self.offset + cols))
+        return out, win
+
+class BlendGrid:
+    """
+    Tile layout for an h x w image where neighbouring windows overlap by
+    `overlap` pixels and are blended instead of cropped.
+
+    Windows are read every window_size - overlap pixels, starting overlap // 2
+    pixels before the image so its edges aren't on the border of a window (the
+    image is mirrored into that margin and past its bottom and right edges). The
+    whole output of every window is kept, weighted by linear ramps across each
+    overlap it shares with a neighbour. The weights of overlapping windows add up
+    to 1, so the blended image is their weighted average without seams.
+    """
+    def __init__(self, h:int, w:int, window_size:int, overlap:int):
+        assert 0 < overlap <= window_size // 2, "Overlap should be between 1 and half the window size"
+        self.h = h
+        self.w = w
+        self.window_size = window_size
+        self.overlap = overlap
+        self.step = window_size - overlap
+        self.margin = overlap // 2
+        self.ith = max(1, -(-(h + self.margin - window_size) // self.step) + 1)
+        self.itw = max(1, -(-(w + self.margin - window_size) // self.step) + 1)
+        self.rows = self._index(h, self.ith)
+        self.cols = self._index(w, self.itw)
+        # Weight across an overlap, rising towards the inside of the window
+        self.ramp = ((np.arange(overlap) + 0.5) / overlap).astype('float32')
+
+    def _index(self, n:int, count:int):
+        size = (count - 1) * self.step + self.window_size
+        return np.pad(np.arange(n), (self.margin, size - n - self.margin), mode='symmetric')
+
+    def tiles(self):
+        """Top-left corner of every window on the padded canvas, row by row."""
+        return [(x, y) for x in range(0, self.ith * self.step, self.step)
+                       for y in range(0, self.itw * self.step, self.step)]
+
+    def window(self, data, x:int, y:int):
+        """Read the window at (x, y) from the unpadded source image."""
+        rows = self.rows[x:x+self.window_size]
+        cols = self.cols[y:y+self.window_size]
+        return data[np.ix_(rows, cols)]
+
+    def cell(self, x:int, y:int):
+        """
+        The part of the window at (x, y) that lies in the image, as a pair of
+        (output region, window region) slice tuples.
+        """
+        top, left = x - self.margin, y - self.margin
+        rows = slice(max(0, top), min(self.h, top + self.window_size))
+        cols = slice(max(0, left), min(self.w, left + self.window_size))
+        win = (slice(rows.start - top, rows.stop - top), slice(cols.start - left, cols.stop - left))
+        return (rows, cols), win
+
+    def weights(self, x:int, y:int):
+        """Blending weights of the window at (x, y), window_size x window_size."""
+        return np.outer(self._weights_1d(x, self.ith), self._weights_1d(y, self.itw))
+
+    def _weights_1d(self, start:int, count:int):
+        weights = np.ones(self.window_size, dtype='float32')
+        if start > 0:
+            weights[:self.overlap] = self.ramp
+        if start < (count - 1) * self.step:
+            weights[-self.overlap:] = self.ramp[::-1]
+        return weights
+
+def luminance(image):
+    """Luminance of an RGB image (0.299R + 0.587G + 0.114B); greyscale images are returned as is."""
+    if image.shape[-1] == 1:
+        return image[..., 0]
+    return 0.299 * image[..., 0] + 0.587 * image[..., 1] + 0.114 * image[..., 2]
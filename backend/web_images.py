@@ -0,0 +1,188 @@
+from PIL import Image, UnidentifiedImageError
+from email.utils import parsedate
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+import tifffile as tiff
+import io
+import os
+import struct
+import threading
+import zlib
+from tiling import image_layers, is_fits, read_image
+
+# Formats browsers display natively, served as they are
+WEB_FORMATS = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+}
+
+def web_image(path):
+    """
+    Path and media type of a browser-friendly version of an image.
+    Web formats are used as is; anything else (TIFF, FITS) is converted to PNG
+    once, and the PNG is kept next to the original for later requests.
+    """
+    path = Path(path)
+    return _web_image(str(path), path.stat().st_mtime_ns)
+
+def rendition_path(path) -> Path:
+    return Path(f"{path}.png")
+
+@lru_cache(maxsize=1024)
+def _web_image(path, mtime_ns):
+    path = Path(path)
+    rendition = rendition_path(path)
+    if rendition.exists() and rendition.stat().st_mtime_ns >= mtime_ns:
+        return rendition, 'image/png'
+
+    if not is_fits(path):
+        try:
+            with Image.open(path) as img:
+                if img.format in WEB_FORMATS:
+                    return path, WEB_FORMATS[img.format]
+        except UnidentifiedImageError:
+            # PIL can't open 16-bit RGB TIFFs, read_pixels can
+            pass
+
+    _save_atomic(Image.fromarray(to_8bit(read_pixels(path))), rendition, format='PNG')
+    return rendition, 'image/png'
+
+# Longest side of the downscaled previews kept for every image file
+PREVIEW_SIZES = (256, 1024)
+
+def preview_path(path, size:int) -> Path:
+    return Path(f"{path}.{size}.jpg")
+
+def build_previews(path):
+    """
+    Generate the preview pyramid of an image file (PREVIEW_SIZES, as JPEG) and
+    its full size web rendition. The 8-bit rendition is decoded once and every
+    level is downscaled from the one above it.
+    """
+    rendition, _ = web_image(path)
+    with Image.fromarray(to_8bit(read_pixels(rendition))) as img:
+        for size in sorted(PREVIEW_SIZES, reverse=True):
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            _save_atomic(img, preview_path(path, size), format='JPEG', quality=85)
+
+def preview(path, size:int) -> Path:
+    """Path of a preview of an image file, generating the pyramid if it is missing."""
+    if size not in PREVIEW_SIZES:
+        raise ValueError(f"Preview size must be one of {PREVIEW_SIZES}")
+    target = preview_path(path, size)
+    if not target.exists():
+        build_previews(path)
+    return target
+
+def snapshot(path, size:int) -> bytes:
+    """
+    JPEG of an image at most size pixels on its longest side, read from a TIFF
+    that may still be being written (e.g. the starless image of a running job).
+    Pixels are sampled rather than resampled, so only a fraction of the file is read.
+    """
+    data = tiff.memmap(path, mode='r')
+    step = max(1, -(-max(data.shape[:2]) // size))
+    img = Image.fromarray(to_8bit(np.array(data[::step, ::step])))
+    del data
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=70)
+    return buffer.getvalue()
+
+def _save_atomic(img, target:Path, **params):
+    # Write to a temporary name first so concurrent requests never see a partial file
+    partial = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.partial")
+    img.save(partial, **params)
+    partial.replace(target)
+
+class PngWriter:
+    """
+    8-bit PNG written a band of rows at a time, e.g. the web rendition of an
+    output while the output itself is being written (see StarNet.transform).
+    Rows are stored with the Up filter and a fast zlib level; the file only
+    appears at target once close is called.
+    """
+    def __init__(self, target, width:int, height:int, channels:int, level:int = 1):
+        self.target = Path(target)
+        self.partial = self.target.with_name(f"{self.target.name}.{os.getpid()}-{threading.get_ident()}.partial")
+        self.file = open(self.partial, 'wb')
+        self.compressor = zlib.compressobj(level)
+        self.previous = np.zeros(width * channels, dtype='uint8')
+        colour_type = {1: 0, 3: 2}[channels]
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, colour_type, 0, 0, 0))
+
+    def write(self, rows):
+        rows = np.ascontiguousarray(rows, dtype='uint8').reshape(len(rows), -1)
+        filtered = np.empty((len(rows), rows.shape[1] + 1), dtype='uint8')
+        filtered[:, 0] = 2  # Up: the difference to the row above, modulo 256
+        filtered[0, 1:] = rows[0] - self.previous
+        filtered[1:, 1:] = rows[1:] - rows[:-1]
+        self.previous = rows[-1].copy()
+        self._chunk(b'IDAT', self.compressor.compress(filtered.tobytes()))
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.file.close()
+        self.partial.replace(self.target)
+
+    def discard(self):
+        self.file.close()
+        self.partial.unlink(missing_ok=True)
+
+    def _chunk(self, kind:bytes, data:bytes):
+        if kind == b'IDAT' and not data:
+            return
+        self.file.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)))
+
+def read_pixels(path):
+    """
+    Decode an image to an array, using tifffile for TIFFs (PIL can't read 16-bit
+    RGB). Of FITS files, the first colour image (or plane) is read.
+    """
+    if is_fits(path):
+        data = read_image(path)
+        return image_layers(data, data.ndim > 2 and data.shape[-3] == 3)[0][:]
+    if Path(path).suffix.lower() in ('.tif', '.tiff'):
+        try:
+            return tiff.imread(path)
+        except Exception:
+            pass
+    with Image.open(path) as img:
+        if img.mode not in ('L', 'RGB'):
+            img = img.convert('RGB')
+        return np.array(img)
+
+def to_8bit(data):
+    """Scale 16-bit and float samples down to 8 bits and drop alpha or extra layers."""
+    if data.dtype == 'uint16':
+        data = (data >> 8).astype('uint8')
+    elif data.dtype.kind == 'f':
+        # No fixed white level, stretch the range of the samples
+        low, high = np.nanmin(data), np.nanmax(data)
+        data = (np.nan_to_num((data - low) / max(high - low, 1e-12)) * 255).astype('uint8')
+    elif data.dtype != 'uint8':
+        data = np.clip(data, 0, 255).astype('uint8')
+    while data.ndim > 3:
+        data = data[0]
+    if data.ndim == 3 and data.shape[2] > 3:
+        data = data[:, :, :3]
+    return data
+
+def is_not_modified(request_headers, etag:str, last_modified:str) -> bool:
+    """Whether a conditional request (If-None-Match / If-Modified-Since) can be answered with 304."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        since = parsedate(if_modified_since)
+        modified = parsedate(last_modified)
+        return since is not None and modified is not None and since >= modified
+    return False
@@ -9,6 +9,8 @@ type ProcessedImage = {
     originalImage: string
     starlessImage: string
     maskImage: string
+    starCatalogUrl: string
+    sceneUrl: string
     created_at: string
 }
 
@@ -18,25 +20,24 @@ export default function NebulaPage() {
     const [loading, setLoading] = useState(true)
 
     useEffect(() => {
-        const fetchImageData = async () => {
+        const checkImage = async () => {
             try {
                 setLoading(true)
-                const [originalResponse, starlessResponse, maskResponse] = await Promise.all([
-                    fetch(API_ENDPOINTS.GET_IMAGE('original', Number(params.id))),
-                    fetch(API_ENDPOINTS.GET_IMAGE('starless', Number(params.id))),
-                    fetch(API_ENDPOINTS.GET_IMAGE('mask', Number(params.id)))
-                ])
-
-                const [originalData, starlessData, maskData] = await Promise.all([
-                    originalResponse.json(),
-                    starlessResponse.json(),
-                    maskResponse.json()
-                ])
+                const id = Number(params.id)
+                // The images themselves are loaded straight from their URLs by the
+                // browser (and cached by it), only check that this one exists
+                const response = await fetch(API_ENDPOINTS.GET_IMAGE_FILE('original', id), { method: 'HEAD' })
+                if (!response.ok) {
+                    setImageData(null)
+                    return
+                }
 
                 setImageData({
-                    originalImage: `data:image/${originalData.format};base64,${originalData.image}`,
-                    starlessImage: `data:image/${starlessData.format};base64,${starlessData.image}`,
-                    maskImage: `data:image/${maskData.format};base64,${maskData.image}`,
+                    originalImage: API_ENDPOINTS.GET_IMAGE_FILE('original', id),
+                    starlessImage: API_ENDPOINTS.GET_IMAGE_FILE('starless', id),
+                    maskImage: API_ENDPOINTS.GET_IMAGE_FILE('mask', id),
+                    starCatalogUrl: API_ENDPOINTS.GET_STAR_CATALOG(id),
+                    sceneUrl: API_ENDPOINTS.GET_SCENE(id),
                     created_at: new Date().toISOString() // We'll get this from the API later if needed
                 })
             } catch (error) {
@@ -47,7 +48,7 @@ export default function NebulaPage() {
         }
 
         if (params.id) {
-            fetchImageData()
+            checkImage()
         }
     }, [params.id])
 
@@ -70,6 +71,8 @@ export default function NebulaPage() {
                     starlessImage={imageData.starlessImage}
                     starfulImage={imageData.originalImage}
                     maskImage={imageData.maskImage}
+                    starCatalogUrl={imageData.starCatalogUrl}
+                    sceneUrl={imageData.sceneUrl}
                 />
             </div>
         </div>
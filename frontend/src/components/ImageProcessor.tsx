@@ -1,11 +1,72 @@
 'use client';
 
 import { API_ENDPOINTS } from '@/constants';
+import Image from 'next/image';
 import { useRouter } from 'next/navigation';
 import { useState } from 'react';
 import NebulaFlythrough from './NebulaFlythrough';
 import SpaceParticles from './SpaceParticles';
 
+const JOB_POLL_INTERVAL_MS = 1000;
+
+interface JobProgress {
+    stage: string;
+    tiles_done: number;
+    tiles_total: number;
+}
+
+const pollJob = async (jobId: string) => {
+    while (true) {
+        const response = await fetch(API_ENDPOINTS.GET_JOB(jobId), {
+            credentials: 'include',
+        });
+        const job = await response.json();
+
+        if (!response.ok || job.status === 'failed') {
+            throw new Error(job.error || 'Failed to process image');
+        }
+        if (job.status === 'done') {
+            return job.result;
+        }
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+};
+
+// Follow a job through its event stream, reporting progress and partial previews,
+// and fall back to polling when the stream isn't available
+const waitForJob = (
+    jobId: string,
+    onProgress: (progress: JobProgress) => void,
+    onPreview: (image: string) => void
+) => new Promise<{ image_id: number }>((resolve, reject) => {
+    if (typeof EventSource === 'undefined') {
+        pollJob(jobId).then(resolve, reject);
+        return;
+    }
+
+    const events = new EventSource(API_ENDPOINTS.GET_JOB_EVENTS(jobId), { withCredentials: true });
+    events.addEventListener('job', (event) => {
+        const job = JSON.parse((event as MessageEvent).data);
+        if (job.progress) {
+            onProgress(job.progress);
+        }
+        if (job.status === 'done') {
+            events.close();
+            resolve(job.result);
+        } else if (job.status === 'failed') {
+            events.close();
+            reject(new Error(job.error || 'Failed to process image'));
+        }
+    });
+    events.addEventListener('preview', (event) => {
+        onPreview(JSON.parse((event as MessageEvent).data).image);
+    });
+    events.onerror = () => {
+        events.close();
+        pollJob(jobId).then(resolve, reject);
+    };
+});
+
 export default function ImageProcessor() {
     const router = useRouter();
     const [originalImage, setOriginalImage] = useState<string | null>(null);
@@ -13,12 +74,16 @@ export default function ImageProcessor() {
     const [maskImage, setMaskImage] = useState<string | null>(null);
     const [isProcessing, setIsProcessing] = useState(false);
     const [error, setError] = useState<string | null>(null);
+    const [progress, setProgress] = useState<JobProgress | null>(null);
+    const [partialPreview, setPartialPreview] = useState<string | null>(null);
 
     const handleFileUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
         const file = event.target.files?.[0];
         if (!file) return;
 
         setError(null);
+        setProgress(null);
+        setPartialPreview(null);
         setIsProcessing(true);
 
         try {
@@ -36,8 +101,9 @@ export default function ImageProcessor() {
                 throw new Error(errorData.error || 'Failed to process image');
             }
 
-            const data = await response.json();
-            router.push(`/gallery/${data.image_id}`);
+            const { job_id } = await response.json();
+            const result = await waitForJob(job_id, setProgress, setPartialPreview);
+            router.push(`/gallery/${result.image_id}`);
         } catch (err) {
             setError(err instanceof Error ? err.message : 'An error occurred');
         } finally {
@@ -63,7 +129,32 @@ export default function ImageProcessor() {
                             {isProcessing ? (
                                 <div className="space-y-2">
                                     <div className="text-purple-300 glow-text">Processing nebula data...</div>
-                                    <div className="w-16 h-16 border-4 border-purple-500 border-t-transparent rounded-full animate-spin mx-auto"></div>
+                                    {partialPreview ? (
+                                        <div className="relative w-full h-48">
+                                            <Image
+                                                src={partialPreview}
+                                                alt="Starless image so far"
+                                                fill
+                                                unoptimized
+                                                className="object-contain rounded"
+                                            />
+                                        </div>
+                                    ) : (
+                                        <div className="w-16 h-16 border-4 border-purple-500 border-t-transparent rounded-full animate-spin mx-auto"></div>
+                                    )}
+                                    {progress && progress.tiles_total > 0 && (
+                                        <div className="space-y-1">
+                                            <div className="w-full h-2 bg-purple-900/50 rounded-full overflow-hidden">
+                                                <div
+                                                    className="h-full bg-purple-500 transition-all duration-300"
+                                                    style={{ width: `${(100 * progress.tiles_done) / progress.tiles_total}%` }}
+                                                ></div>
+                                            </div>
+                                            <div className="text-sm text-purple-200">
+                                                {progress.tiles_done} / {progress.tiles_total} tiles
+                                            </div>
+                                        </div>
+                                    )}
                                 </div>
                             ) : (
                                 <div className="space-y-2">
@@ -2,14 +2,22 @@
 
 import { useEffect, useRef } from 'react'
 import * as THREE from 'three'
-import { extractStarData } from '../utils/starExtractor'
+import { StarData } from '../types/nebula'
+import { extractStarData, starDataFromCatalog } from '../utils/starExtractor'
+import { loadSceneData } from '../utils/sceneData'
+import { createNebulaLayers } from './NebulaLayers'
 import { createNebulaScene } from './NebulaScene'
-import { createStarSprites } from './StarSprites'
+import { createStarPoints, createStarSprites } from './StarSprites'
 
 type NebulaFlythroughProps = {
     starlessImage: string
     starfulImage: string
     maskImage: string
+    // When set, stars come from the backend catalog instead of scanning the mask in the browser
+    starCatalogUrl?: string
+    // When set, the whole scene comes precomputed from the backend (GET /scene/{id});
+    // the images are only used if it can't be loaded
+    sceneUrl?: string
 }
 
 type NebulaScene = {
@@ -24,7 +32,28 @@ type NebulaScene = {
     mesh?: THREE.Mesh
 }
 
-export const NebulaFlythrough = ({ starlessImage, starfulImage, maskImage }: NebulaFlythroughProps) => {
+const loadImage = (src: string, name: string) => new Promise<HTMLImageElement>((resolve, reject) => {
+    const img = new Image()
+    img.crossOrigin = 'anonymous'
+    img.onload = () => resolve(img)
+    img.onerror = (error) => {
+        console.error(`Error in ${name} image loading:`, error)
+        reject(error)
+    }
+    img.src = src
+})
+
+const loadStarData = (starfulImage: string, maskImage: string, starCatalogUrl?: string): Promise<StarData[]> => {
+    if (starCatalogUrl) {
+        return fetch(starCatalogUrl)
+            .then((response) => response.json())
+            .then(starDataFromCatalog)
+    }
+    return Promise.all([loadImage(starfulImage, 'starful'), loadImage(maskImage, 'mask')])
+        .then(([starful, mask]) => extractStarData(mask, starful))
+}
+
+export const NebulaFlythrough = ({ starlessImage, starfulImage, maskImage, starCatalogUrl, sceneUrl }: NebulaFlythroughProps) => {
     const containerRef = useRef<HTMLDivElement>(null)
     const sceneRef = useRef<NebulaScene | null>(null)
 
@@ -39,7 +68,8 @@ export const NebulaFlythrough = ({ starlessImage, starfulImage, maskImage }: Neb
         sceneRef.current = scene
         const textureLoader = new THREE.TextureLoader()
         
-        Promise.all([
+        // Builds the scene from the full size images and the star catalog (or mask) in the browser
+        const buildFromImages = () => Promise.all([
             new Promise<THREE.Texture>((resolve, reject) => {
                 textureLoader.load(
                     starlessImage,
@@ -68,25 +98,8 @@ export const NebulaFlythrough = ({ starlessImage, starfulImage, maskImage }: Neb
                     }
                 )
             }),
-            new Promise<HTMLImageElement>((resolve, reject) => {
-                const img = new Image()
-                img.onload = () => resolve(img)
-                img.onerror = (error) => {
-                    console.error('Error in starful image loading:', error)
-                    reject(error)
-                }
-                img.src = starfulImage
-            }),
-            new Promise<HTMLImageElement>((resolve, reject) => {
-                const img = new Image()
-                img.onload = () => resolve(img)
-                img.onerror = (error) => {
-                    console.error('Error in mask image loading:', error)
-                    reject(error)
-                }
-                img.src = maskImage
-            })
-        ]).then(([colorTexture, depthTexture, starfulImage, maskImage]) => {
+            loadStarData(starfulImage, maskImage, starCatalogUrl)
+        ]).then(([colorTexture, depthTexture, starData]) => {
             const imageAspectRatio = colorTexture.image.width / colorTexture.image.height
             const planeWidth = 10
             const planeHeight = planeWidth / imageAspectRatio
@@ -137,13 +150,29 @@ export const NebulaFlythrough = ({ starlessImage, starfulImage, maskImage }: Neb
             
             scene.scene.add(mesh)
             
-            const starData = extractStarData(maskImage, starfulImage)
             const starSprites = createStarSprites(scene.scene, starData, planeWidth, planeHeight)
             scene.starSprites = starSprites
             
             scene.mesh = mesh
             
-        }).catch(error => {
+        })
+
+        // Builds the scene from the buffers precomputed by the backend, with no decoding or parsing
+        const buildFromScene = (url: string) => loadSceneData(url).then((data) => {
+            const planeWidth = 10
+            const planeHeight = planeWidth * data.height / data.width
+            const layers = createNebulaLayers(scene.scene, data, planeWidth, planeHeight)
+            createStarPoints(scene.scene, data, planeWidth, planeHeight, scene.camera)
+            scene.mesh = layers[0]
+        })
+
+        const build = sceneUrl
+            ? buildFromScene(sceneUrl).catch((error) => {
+                console.error('Error in scene loading, building it from the images:', error)
+                return buildFromImages()
+            })
+            : buildFromImages()
+        build.catch(error => {
             console.error('Error in texture loading:', error)
         })
 
@@ -183,7 +212,7 @@ export const NebulaFlythrough = ({ starlessImage, starfulImage, maskImage }: Neb
                 sceneRef.current.cleanup()
             }
         }
-    }, [starlessImage, starfulImage, maskImage])
+    }, [starlessImage, starfulImage, maskImage, starCatalogUrl, sceneUrl])
 
     return <div ref={containerRef} className="w-full h-full absolute inset-0" />
 }
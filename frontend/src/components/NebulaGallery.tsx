@@ -3,7 +3,7 @@
 import { API_ENDPOINTS } from '@/constants'
 import Image from 'next/image'
 import { useRouter } from 'next/navigation'
-import { useCallback, useEffect, useState } from 'react'
+import { useCallback, useEffect, useRef, useState } from 'react'
 
 type ImageData = {
     id: number
@@ -11,6 +11,8 @@ type ImageData = {
     starless_path: string
     mask_path: string
     created_at: string
+    thumbnails: Record<'original' | 'starless' | 'mask', string>
+    thumbnail?: string | null
 }
 
 type PaginationData = {
@@ -18,6 +20,7 @@ type PaginationData = {
     total_pages: number
     total_images: number
     per_page: number
+    next_cursor: string | null
 }
 
 type ProcessedImage = {
@@ -33,31 +36,28 @@ export default function NebulaGallery() {
         current_page: 1,
         total_pages: 1,
         total_images: 0,
-        per_page: 5
+        per_page: 5,
+        next_cursor: null
     })
     const [loading, setLoading] = useState(true)
+    // Cursor to fetch each page we have reached, so paging stays fast deep into the gallery
+    const cursorsRef = useRef<Record<number, string | null>>({ 1: null })
 
     const fetchImages = useCallback(async (page: number) => {
         setLoading(true)
         try {
-            const response = await fetch(API_ENDPOINTS.GET_PAGINATED_IMAGES(page, pagination.per_page), {
+            const response = await fetch(API_ENDPOINTS.GET_PAGINATED_IMAGES(page, pagination.per_page, cursorsRef.current[page]), {
                 credentials: 'include'
             })
             const data = await response.json()
+            cursorsRef.current[page + 1] = data.pagination.next_cursor
             
-            // Only fetch original images
-            const processedImages = await Promise.all(
-                data.images.map(async (image: ImageData) => {
-                    const originalResponse = await fetch(API_ENDPOINTS.GET_IMAGE('original', image.id))
-                    const originalData = await originalResponse.json()
-
-                    return {
-                        id: image.id,
-                        originalImage: `data:image/${originalData.format};base64,${originalData.image}`,
-                        created_at: image.created_at
-                    }
-                })
-            )
+            // Thumbnails of the originals come inline with the listing
+            const processedImages = data.images.map((image: ImageData) => ({
+                id: image.id,
+                originalImage: image.thumbnail ?? image.thumbnails.original,
+                created_at: image.created_at
+            }))
 
             setImages(processedImages)
             setPagination(data.pagination)
@@ -124,6 +124,7 @@ export default function NebulaGallery() {
                             src={image.originalImage} 
                             alt={`Nebula ${image.id}`}
                             fill
+                            unoptimized
                             className="object-cover"
                         />
                         <div className="absolute bottom-0 left-0 right-0 bg-black bg-opacity-50 p-4">
@@ -0,0 +1,82 @@
+import * as THREE from 'three'
+import { SceneData } from '../types/nebula'
+
+// Distance between the depth layers of a precomputed scene, the farthest one is at NEBULA_DISTANCE
+const LAYER_SPACING = 0.6
+export const NEBULA_DISTANCE = 10
+
+const vertexShader = `
+    uniform sampler2D depthMap;
+    uniform float displacementScale;
+    varying vec2 vUv;
+
+    void main() {
+        vUv = uv;
+        float displacement = texture2D(depthMap, uv).r * displacementScale;
+        vec3 newPosition = position + normal * displacement;
+        gl_Position = projectionMatrix * modelViewMatrix * vec4(newPosition, 1.0);
+    }
+`
+
+const fragmentShader = `
+    uniform sampler2D colorMap;
+    uniform sampler2D alphaMap;
+    uniform bool opaque;
+    varying vec2 vUv;
+
+    void main() {
+        vec4 color = texture2D(colorMap, vUv);
+        gl_FragColor = vec4(color.rgb, opaque ? 1.0 : texture2D(alphaMap, vUv).r);
+    }
+`
+
+const dataTexture = (data: Uint8Array, width: number, height: number, format: THREE.PixelFormat) => {
+    const texture = new THREE.DataTexture(data, width, height, format)
+    // Rows of a scene are 1-byte aligned
+    texture.unpackAlignment = 1
+    texture.magFilter = THREE.LinearFilter
+    texture.minFilter = THREE.LinearFilter
+    texture.needsUpdate = true
+    return texture
+}
+
+// One plane per depth layer of a precomputed scene, nearer layers in front of
+// farther ones and scaled so they all cover the same view from the camera.
+// The farthest plane is opaque, the others show their share of the image.
+export const createNebulaLayers = (scene: THREE.Scene, data: SceneData, planeWidth: number, planeHeight: number): THREE.Mesh[] => {
+    const pixels = data.width * data.height
+    const colorMap = dataTexture(data.colour, data.width, data.height, THREE.RGBAFormat)
+    const depthMap = dataTexture(data.depth, data.width, data.height, THREE.RedFormat)
+    const geometry = new THREE.PlaneGeometry(planeWidth, planeHeight, 256, 256)
+
+    const meshes: THREE.Mesh[] = []
+    for (let layer = 0; layer < data.layers; layer++) {
+        const alphaMap = dataTexture(data.layerAlpha.subarray(layer * pixels, (layer + 1) * pixels),
+            data.width, data.height, THREE.RedFormat)
+        const material = new THREE.ShaderMaterial({
+            uniforms: {
+                colorMap: { value: colorMap },
+                depthMap: { value: depthMap },
+                alphaMap: { value: alphaMap },
+                opaque: { value: layer === 0 },
+                displacementScale: { value: 1.0 }
+            },
+            vertexShader,
+            fragmentShader,
+            side: THREE.DoubleSide,
+            transparent: layer > 0,
+            depthWrite: layer === 0
+        })
+
+        const distance = NEBULA_DISTANCE - layer * LAYER_SPACING
+        const mesh = new THREE.Mesh(geometry, material)
+        mesh.position.set(0, 0, distance)
+        mesh.rotation.y = Math.PI
+        mesh.scale.setScalar(distance / NEBULA_DISTANCE)
+        // Draw back to front
+        mesh.renderOrder = layer
+        scene.add(mesh)
+        meshes.push(mesh)
+    }
+    return meshes
+}
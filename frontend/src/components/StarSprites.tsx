@@ -1,5 +1,6 @@
 import * as THREE from 'three'
-import { StarData } from '../types/nebula'
+import { SceneData, StarData } from '../types/nebula'
+import { STAR_FIELDS } from '../utils/sceneData'
 
 export const createStarSprites = (scene: THREE.Scene, starData: StarData[], planeWidth: number, planeHeight: number): THREE.Sprite[] => {
     const starSprites: THREE.Sprite[] = []
@@ -26,4 +27,66 @@ export const createStarSprites = (scene: THREE.Scene, starData: StarData[], plan
     })
     
     return starSprites
-} 
\ No newline at end of file
+}
+
+const starVertexShader = `
+    attribute float size;
+    attribute float brightness;
+    attribute vec4 colour;
+    uniform vec2 halfPlane;
+    uniform float pixelScale;
+    varying vec4 vColour;
+    varying float vBrightness;
+
+    void main() {
+        // position holds the star's image position in [-1, 1] and its distance,
+        // spread out so that every star lines up with the nebula from the camera
+        float scale = position.z / 10.0;
+        vec4 mvPosition = modelViewMatrix * vec4(-position.x * halfPlane.x * scale, position.y * halfPlane.y * scale, position.z, 1.0);
+        gl_PointSize = max(2.0, size * halfPlane.x * 2.0 * scale * pixelScale / -mvPosition.z);
+        gl_Position = projectionMatrix * mvPosition;
+        vColour = colour;
+        vBrightness = brightness;
+    }
+`
+
+const starFragmentShader = `
+    varying vec4 vColour;
+    varying float vBrightness;
+
+    void main() {
+        float d = length(gl_PointCoord - 0.5) * 2.0;
+        gl_FragColor = vec4(mix(vec3(1.0), vColour.rgb, 0.5), smoothstep(1.0, 0.0, d) * vBrightness);
+    }
+`
+
+// All stars of a precomputed scene as one point cloud, drawn straight from its buffers
+export const createStarPoints = (scene: THREE.Scene, data: SceneData, planeWidth: number, planeHeight: number,
+                                 camera: THREE.PerspectiveCamera): THREE.Points => {
+    const stars = new THREE.InterleavedBuffer(data.starData, STAR_FIELDS)
+    const geometry = new THREE.BufferGeometry()
+    geometry.setAttribute('position', new THREE.InterleavedBufferAttribute(stars, 3, 0))
+    geometry.setAttribute('size', new THREE.InterleavedBufferAttribute(stars, 1, 3))
+    geometry.setAttribute('brightness', new THREE.InterleavedBufferAttribute(stars, 1, 4))
+    geometry.setAttribute('colour', new THREE.BufferAttribute(data.starColours, 4, true))
+
+    const material = new THREE.ShaderMaterial({
+        uniforms: {
+            halfPlane: { value: new THREE.Vector2(planeWidth / 2, planeHeight / 2) },
+            // Pixels per scene unit at distance 1
+            pixelScale: { value: window.innerHeight / (2 * Math.tan(THREE.MathUtils.degToRad(camera.fov) / 2)) }
+        },
+        vertexShader: starVertexShader,
+        fragmentShader: starFragmentShader,
+        transparent: true,
+        depthWrite: false,
+        blending: THREE.AdditiveBlending
+    })
+
+    const points = new THREE.Points(geometry, material)
+    // position is not where the stars are drawn, don't cull them by it
+    points.frustumCulled = false
+    points.renderOrder = 100
+    scene.add(points)
+    return points
+}
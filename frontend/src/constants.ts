@@ -2,8 +2,14 @@ export const BACKEND_URL = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localh
 
 export const API_ENDPOINTS = {
     PROCESS_IMAGE: `${BACKEND_URL}/process_image/`,
+    GET_JOB: (jobId: string) => `${BACKEND_URL}/jobs/${jobId}`,
+    GET_JOB_EVENTS: (jobId: string) => `${BACKEND_URL}/jobs/${jobId}/events?previews=true`,
     GET_IMAGE: (type: string, id: number) => `${BACKEND_URL}/image/${type}/${id}`,
-    GET_PAGINATED_IMAGES: (page: number, perPage: number) => 
-        `${BACKEND_URL}/images/paginated?page=${page}&per_page=${perPage}`,
+    GET_IMAGE_FILE: (type: string, id: number) => `${BACKEND_URL}/image/${type}/${id}/raw`,
+    GET_PAGINATED_IMAGES: (page: number, perPage: number, cursor?: string | null) => 
+        `${BACKEND_URL}/images/paginated?page=${page}&per_page=${perPage}&inline_thumbnails=true` +
+        (cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''),
     DELETE_IMAGE: (id: number) => `${BACKEND_URL}/image/${id}`,
+    GET_STAR_CATALOG: (id: number) => `${BACKEND_URL}/stars/${id}`,
+    GET_SCENE: (id: number) => `${BACKEND_URL}/scene/${id}`,
 }; 
\ No newline at end of file
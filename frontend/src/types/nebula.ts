@@ -19,4 +19,35 @@ export type StarData = {
     y: number
     brightness: number
     texture: THREE.Texture
-} 
\ No newline at end of file
+}
+
+// Star catalog computed by the backend from the star mask (GET /stars/{id}).
+// Each row of stars holds the columns named in fields.
+export type StarCatalog = {
+    version: number
+    width: number
+    height: number
+    fields: string[]
+    stars: number[][]
+}
+
+// Flythrough scene precomputed by the backend (GET /scene/{id}): views onto the
+// typed buffers of the response, see backend/scene.py for the layout.
+export type SceneData = {
+    width: number
+    height: number
+    layers: number
+    stars: number
+    imageWidth: number
+    imageHeight: number
+    // RGBA, width x height, rows bottom to top
+    colour: Uint8Array
+    // Depth estimate, width x height, 255 = nearest
+    depth: Uint8Array
+    // Alpha of each depth layer, layers x width x height, layer 0 farthest
+    layerAlpha: Uint8Array
+    // x, y (in [-1, 1]), z (distance), size (fraction of the image width), brightness per star
+    starData: Float32Array
+    // RGBA per star
+    starColours: Uint8Array
+}
@@ -0,0 +1,32 @@
+import { sceneDataFromBuffer } from './sceneData'
+
+describe('sceneDataFromBuffer', () => {
+    // 3 x 2 texture, 2 layers, 1 star, laid out like backend/scene.py writes it
+    const buildScene = (magic = 0x4353424e) => {
+        const buffer = new ArrayBuffer(132)
+        new Uint32Array(buffer, 0, 13).set([magic, 1, 3, 2, 2, 1, 300, 200, 64, 88, 96, 108, 128])
+        new Uint8Array(buffer, 64, 24).fill(10)
+        new Uint8Array(buffer, 88, 6).set([0, 51, 102, 153, 204, 255])
+        new Uint8Array(buffer, 96, 12).fill(128)
+        new Float32Array(buffer, 108, 5).set([0.5, -0.25, 7, 0.01, 0.9])
+        new Uint8Array(buffer, 128, 4).set([255, 200, 150, 255])
+        return buffer
+    }
+
+    it('should map the buffers of a scene file', () => {
+        const scene = sceneDataFromBuffer(buildScene())
+
+        expect([scene.width, scene.height, scene.layers, scene.stars]).toEqual([3, 2, 2, 1])
+        expect([scene.imageWidth, scene.imageHeight]).toEqual([300, 200])
+        expect(scene.colour.length).toBe(24)
+        expect(Array.from(scene.depth)).toEqual([0, 51, 102, 153, 204, 255])
+        expect(scene.layerAlpha.length).toBe(12)
+        expect(scene.starData[0]).toBe(0.5)
+        expect(scene.starData[2]).toBe(7)
+        expect(Array.from(scene.starColours)).toEqual([255, 200, 150, 255])
+    })
+
+    it('should reject other files', () => {
+        expect(() => sceneDataFromBuffer(buildScene(0))).toThrow('Unsupported scene file')
+    })
+})
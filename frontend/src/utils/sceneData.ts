@@ -0,0 +1,39 @@
+import { SceneData } from '../types/nebula'
+
+const SCENE_MAGIC = 0x4353424e
+const SCENE_VERSION = 1
+const HEADER_WORDS = 16
+export const STAR_FIELDS = 5
+
+// Maps the buffers of a scene file onto typed arrays, without copying or parsing them
+export const sceneDataFromBuffer = (buffer: ArrayBuffer): SceneData => {
+    const header = new Uint32Array(buffer, 0, HEADER_WORDS)
+    if (header[0] !== SCENE_MAGIC || header[1] !== SCENE_VERSION) {
+        throw new Error(`Unsupported scene file (version ${header[1]})`)
+    }
+    const [, , width, height, layers, stars, imageWidth, imageHeight,
+        colourOffset, depthOffset, layersOffset, starsOffset, starColoursOffset] = header
+    const pixels = width * height
+
+    return {
+        width,
+        height,
+        layers,
+        stars,
+        imageWidth,
+        imageHeight,
+        colour: new Uint8Array(buffer, colourOffset, pixels * 4),
+        depth: new Uint8Array(buffer, depthOffset, pixels),
+        layerAlpha: new Uint8Array(buffer, layersOffset, layers * pixels),
+        starData: new Float32Array(buffer, starsOffset, stars * STAR_FIELDS),
+        starColours: new Uint8Array(buffer, starColoursOffset, stars * 4)
+    }
+}
+
+export const loadSceneData = (sceneUrl: string): Promise<SceneData> =>
+    fetch(sceneUrl).then((response) => {
+        if (!response.ok) {
+            throw new Error(`Scene request failed: ${response.status}`)
+        }
+        return response.arrayBuffer()
+    }).then(sceneDataFromBuffer)
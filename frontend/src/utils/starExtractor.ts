@@ -1,5 +1,5 @@
 import * as THREE from 'three'
-import { StarData } from '../types/nebula'
+import { StarCatalog, StarData } from '../types/nebula'
 import { findStarBounds } from './starBounds'
 
 const useActualSprites = false
@@ -225,4 +225,20 @@ export const extractStarData = (maskImage: HTMLImageElement, starfulImage: HTMLI
     console.log('stars', stars)
 
     return stars
-} 
+}
+
+export const starDataFromCatalog = (catalog: StarCatalog): StarData[] => {
+    const [x, y, size, brightness] = ['x', 'y', 'size', 'brightness'].map((field) => catalog.fields.indexOf(field))
+
+    return catalog.stars.map((star) => {
+        const starTexture = new THREE.CanvasTexture(generateStarShape(star[size], star[brightness]))
+        starTexture.needsUpdate = true
+
+        return {
+            x: (star[x] / catalog.width) * 2 - 1,
+            y: -(star[y] / catalog.height) * 2 + 1,
+            brightness: star[brightness],
+            texture: starTexture
+        }
+    })
+}